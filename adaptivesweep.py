@@ -0,0 +1,190 @@
+# jon klein
+# jtklein@alaska.edu
+# adaptive frequency sampling with rational interpolation of impedance and gain
+#
+# instead of a matrix solve at every step of a fixed FR sweep, the sweep starts from a few
+# frequencies and fits a rational model to every response (port impedances, boresight gain)
+# with the AAA algorithm (Nakatsukasa, Sete, Trefethen, "The AAA algorithm for rational
+# approximation", SIAM J. Sci. Comput. 2018). the fit of all samples is compared with the fit
+# of the previous iteration on a dense grid, and new frequencies are solved only where they
+# disagree by more than the tolerance. smooth stretches of the band get a handful of solves,
+# the resonances around the loaded rear elements get the rest.
+#
+# usage:
+#   solve = NecSolver(build_lpda_model([horiz], True, True, None), 'lpda_horiz')
+#   s = adaptive_sweep(solve, 8, 18, tol = 1e-3)
+#   s['grid'], s['fit'][:, 0] -> dense frequency grid (MHz) and interpolated port impedance
+#   vswr(s['fit'][:, 0])
+
+import os
+import numpy as np
+import necout
+import scheduler
+from nec2utils import PatternSpec, writeCardsToFile
+
+Z0 = 100. # feed line characteristic impedance (ohms)
+
+def aaa(z, f, tol = 1e-13, mmax = None):
+    # rational approximation of samples f at real points z, returns barycentric support points,
+    # values and weights (see evaluate). mmax limits the number of support points, by default one short
+    # of the samples, so at least one sample is fit in the least squares sense rather than interpolated
+    z = np.asarray(z, dtype = float)
+    f = np.asarray(f, dtype = complex)
+    n = len(z)
+    if mmax is None:
+        mmax = max(1, n - 1)
+    scale = np.max(np.abs(f)) or 1.
+    free = np.ones(n, dtype = bool)
+    r = np.full(n, np.mean(f))
+    support = []
+    for m in range(min(mmax, n)):
+        j = np.argmax(np.where(free, np.abs(f - r), -1.))
+        support.append(j)
+        free[j] = False
+        zj, fj = z[support], f[support]
+        if not free.any():
+            w = np.ones(len(support)) / np.sqrt(len(support))
+            break
+        # loewner matrix of the samples that aren't support points, its smallest singular vector gives the weights
+        cauchy = 1. / (z[free, np.newaxis] - zj[np.newaxis])
+        loewner = f[free, np.newaxis] * cauchy - cauchy * fj[np.newaxis]
+        w = np.conj(np.linalg.svd(loewner)[2][-1])
+        r = f.copy()
+        r[free] = np.dot(cauchy, w * fj) / np.dot(cauchy, w)
+        if np.max(np.abs(f - r)) <= tol * scale:
+            break
+    return zj, fj, w
+
+def evaluate(x, zj, fj, w):
+    # evaluate the barycentric rational function r(x) = sum(w fj / (x - zj)) / sum(w / (x - zj))
+    x = np.asarray(x, dtype = float)
+    d = x[:, np.newaxis] - zj[np.newaxis]
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        cauchy = 1. / d
+        r = np.dot(cauchy, w * fj) / np.dot(cauchy, w)
+    i, j = np.nonzero(d == 0)
+    r[i] = fj[j]
+    return r
+
+def fit_columns(freqs, values):
+    # one rational fit per response column, evaluated by fit_eval
+    return [aaa(freqs, values[:, k]) for k in range(values.shape[1])]
+
+def fit_eval(fits, x):
+    return np.column_stack([evaluate(x, *fit) for fit in fits])
+
+def adaptive_sweep(solve, fmin, fmax, tol = 1e-3, initial = 6, batch = 4, max_solves = 60, grid = 1001,
+                   resolution = 1e-3, scale = None):
+    # sample responses between fmin and fmax (MHz) until their rational fits are within tol
+    #   solve - callable taking a sorted array of frequencies and returning an (n_freqs, n_responses)
+    #           array of responses, e.g. NecSolver
+    #   tol - largest disagreement between successive fits, relative to scale
+    #   batch - most frequencies added per iteration (they are solved together, in parallel by NecSolver)
+    #   grid - points of the dense grid the fits are compared and returned on
+    #   resolution - frequencies are rounded to this (MHz)
+    #   scale - per response error scale, by default the largest magnitude of each sampled response
+    # returns a dict with the solved 'freq' and 'values', the dense 'grid' and the 'fit' on it, the
+    # estimated relative 'error' on the grid and whether the sweep 'converged' within max_solves
+    x = np.linspace(fmin, fmax, grid)
+    spacing = 2 * (fmax - fmin) / (grid - 1.)
+    freqs = np.unique(np.round(np.linspace(fmin, fmax, initial) / resolution) * resolution)
+    values = np.asarray(solve(freqs))
+
+    previous = fit_eval(fit_columns(freqs[::2], values[::2]), x)
+    passes = 0
+    while True:
+        fits = fit_columns(freqs, values)
+        fit = fit_eval(fits, x)
+        s = np.max(np.abs(values), axis = 0) if scale is None else np.asarray(scale, dtype = float)
+        error = np.max(np.abs(fit - previous) / np.where(s > 0, s, 1.), axis = 1)
+        error[~np.isfinite(error)] = np.inf
+        previous = fit
+
+        # a sweep is only done when two fits in a row agree, one extra solve at the worst point checks the first
+        passes = passes + 1 if error.max() <= tol else 0
+        if passes >= 2 or len(freqs) >= max_solves:
+            break
+
+        if passes:
+            # the confirming solve goes to the worst grid point that isn't next to a solved frequency
+            candidates = np.argsort(error)[::-1]
+            count = 1
+        else:
+            # worst local maxima of the error, away from frequencies already solved and from each other
+            peaks = np.nonzero((error >= np.roll(error, 1)) & (error >= np.roll(error, -1)) & (error > tol))[0]
+            # then anywhere else the error is largest, when the peaks sit on solved frequencies
+            rest = np.argsort(error)[::-1]
+            rest = rest[:max(1, np.count_nonzero(error > tol))]
+            candidates = np.concatenate((peaks[np.argsort(error[peaks])[::-1]], rest))
+            count = min(batch, max_solves - len(freqs))
+        new = []
+        for i in candidates:
+            f = np.round(x[i] / resolution) * resolution
+            if np.min(np.abs(np.concatenate((freqs, new)) - f)) >= spacing:
+                new.append(f)
+            if len(new) >= count:
+                break
+        if not new:
+            if passes:
+                # every grid point is next to a solved frequency, there's nowhere left for the fit to be wrong
+                passes = 2
+            break
+
+        new = np.sort(new)
+        freqs = np.concatenate((freqs, new))
+        values = np.concatenate((values, np.asarray(solve(new))))
+        order = np.argsort(freqs)
+        freqs, values = freqs[order], values[order]
+
+    return {'freq': freqs, 'values': values, 'grid': x, 'fit': fit, 'fits': fits, 'error': error,
+            'converged': passes >= 2}
+
+def vswr(z, z0 = Z0):
+    gamma = np.abs((z - z0) / (z + z0))
+    with np.errstate(divide = 'ignore'):
+        return (1 + gamma) / (1 - gamma)
+
+class NecSolver:
+    def __init__(self, model, name, folder = './necfiles/', outdir = 'out', direction = (70., 180.),
+                 solver = scheduler.SOLVER, ram = 4e9, cores = 4, comments = 'CM adaptive sweep\nCE'):
+        # solve a Model at arbitrary frequencies with nec, for adaptive_sweep
+        # each call writes up to `cores` decks of single frequency FR cards, runs them with the scheduler
+        # and returns the input impedance of every port and the total gain (dBi) toward direction, a
+        # (theta, phi) in degrees, as (n_freqs, n_ports + 1) columns. only that one pattern point is requested
+        self.model = model
+        self.name = name
+        self.folder = folder
+        self.outdir = outdir
+        self.direction = direction
+        self.solver = solver
+        self.ram = ram
+        self.cores = cores
+        self.comments = comments
+        self.calls = 0
+
+    def __call__(self, freqs):
+        jobs = []
+        for k, chunk in enumerate(np.array_split(np.asarray(freqs, dtype = float), self.cores)):
+            if not len(chunk):
+                continue
+            deck = os.path.join(self.folder, '%s_a%d_%d.nec' % (self.name, self.calls, k))
+            text = self.model.getSweepText([(f, 0, 1) for f in chunk], PatternSpec(self.direction[0], 0., 1,
+                                                                                   self.direction[1], 0., 1))
+            writeCardsToFile(deck, self.comments, text)
+            jobs.append(scheduler.job_from_model(self.model, deck, self.outdir, len(chunk)))
+        self.calls += 1
+
+        records = scheduler.run_jobs(jobs, self.ram, self.cores, self.solver)
+        failed = [r['deck'] for r in records if r['status'] != 0]
+        if failed:
+            raise RuntimeError('nec runs failed: %s' % ', '.join(failed))
+
+        r = necout.read_shards([job.out for job in jobs], ('inputs', 'pattern'))
+        if len(r['freq']) != len(freqs):
+            raise RuntimeError('expected %d frequencies in the output, found %d' % (len(freqs), len(r['freq'])))
+        pattern = r['pattern']
+        theta, phi = np.deg2rad(self.direction)
+        cos_angle = (np.sin(np.deg2rad(pattern['theta'][0])) * np.sin(theta) *
+                     np.cos(np.deg2rad(pattern['phi'][0]) - phi) + np.cos(np.deg2rad(pattern['theta'][0])) * np.cos(theta))
+        gain = pattern['total_db'][:, np.argmax(cos_angle)]
+        return np.column_stack((r['inputs']['impedance'], gain))
@@ -0,0 +1,140 @@
+# jon klein
+# jtklein@alaska.edu
+# array factor engine for superdarn arrays of sabre lpdas
+#
+# instead of solving a 16 antenna model, the array pattern is the pattern of one element
+# (isolated, or embedded in the array) times the array factor of the layout. phases for every
+# beam direction and every frequency are built as one batch, so hundreds of beams at all the
+# frequencies of an RP sweep take a few einsums.
+#
+# angles follow nec: theta from +z, phi from +x in the xy plane, degrees. positions are meters.
+# the lpdas built by log_antenna point along -x (short elements at x = 0), so a main array
+# lies along y with its boresight at phi = 180.
+#
+# usage:
+#   r = necout.read_out('out/lpda_horiz_ground.nec.out', ('pattern',))
+#   el = ElementPattern.from_out(r)
+#   pos = superdarn_layout()
+#   beams = beam_directions(np.arange(-7.5, 8) * 3.24)
+#   a = array_pattern(el, pos, steering_weights(pos, el.freq, beams))
+#   a['gain_db'] -> (n_freqs, n_beams, n_directions)
+#
+# mutual coupling: the weights can be corrected with a coupling matrix from a small full-wave
+# model (see coupling_from_admittance and superposition.PortSolution.admittance).
+
+import numpy as np
+from log_antenna import ANTENNA_SPACING
+
+C = 299792458.0
+
+# superdarn main array, 16 antennas spaced ANTENNA_SPACING along a line
+N_ANTENNAS = 16
+BORESIGHT_PHI = 180.
+BEAM_SEPARATION = 3.24 # degrees
+
+def unit_vectors(theta, phi):
+    # (n, 3) direction unit vectors for nec theta/phi angles in degrees
+    t = np.deg2rad(np.asarray(theta, dtype = float))
+    p = np.deg2rad(np.asarray(phi, dtype = float))
+    return np.stack((np.sin(t) * np.cos(p), np.sin(t) * np.sin(p), np.cos(t)), axis = -1)
+
+def superdarn_layout(n = N_ANTENNAS, spacing = ANTENNA_SPACING):
+    # (n, 3) positions of a linear array along y, centered on the origin
+    y = (np.arange(n) - (n - 1) / 2.) * spacing
+    return np.column_stack((np.zeros(n), y, np.zeros(n)))
+
+def beam_directions(azimuths, elevation = 0., boresight_phi = BORESIGHT_PHI):
+    # (theta, phi) arrays of beams steered `azimuths` degrees off boresight at the given elevation
+    azimuths = np.asarray(azimuths, dtype = float)
+    theta = np.full(azimuths.shape, 90. - elevation)
+    return theta, boresight_phi + azimuths
+
+def steering_weights(positions, freqs, beams, taper = None):
+    # complex element weights (n_freqs, n_beams, n_elements) that phase the array toward each beam
+    #   freqs - MHz, beams - (theta, phi) arrays, taper - optional per element amplitudes
+    k = 2 * np.pi * np.asarray(freqs, dtype = float) * 1e6 / C
+    u = unit_vectors(*beams)
+    path = np.dot(u, np.asarray(positions, dtype = float).T)          # (n_beams, n_elements)
+    w = np.exp(-1j * k[:, np.newaxis, np.newaxis] * path[np.newaxis])
+    if taper is not None:
+        w = w * np.asarray(taper, dtype = float)
+    return w
+
+def coupling_from_admittance(admittance, isolated = None):
+    # coupling matrix (n_freqs, n, n) from the short circuit admittance matrix of a full-wave model of
+    # the array, normalized by the admittance of an isolated element (default: the mean self admittance)
+    # so that an uncoupled array gives the identity. port currents are then coupling . weights.
+    admittance = np.asarray(admittance)
+    if isolated is None:
+        isolated = np.mean(np.diagonal(admittance, axis1 = 1, axis2 = 2), axis = 1)
+    return admittance / np.asarray(isolated)[:, np.newaxis, np.newaxis]
+
+class ElementPattern:
+    def __init__(self, freq, theta, phi, e_theta, e_phi, gain_db = None):
+        # freq (n_freqs,) MHz, theta/phi (n_directions,) degrees
+        # e_theta, e_phi - complex far field (n_freqs, n_directions) shared by every element, or
+        #                  (n_elements, n_freqs, n_directions) embedded patterns, each with its phase
+        #                  referenced to its own element position
+        # gain_db - power gain of the element (n_freqs, n_directions) the field corresponds to, used to
+        #           scale array gains
+        self.freq = np.asarray(freq, dtype = float)
+        self.theta = np.asarray(theta, dtype = float)
+        self.phi = np.asarray(phi, dtype = float)
+        self.e_theta = np.asarray(e_theta)
+        self.e_phi = np.asarray(e_phi)
+        self.gain_db = gain_db
+
+    @classmethod
+    def from_out(cls, result):
+        # element pattern from necout.read_out of a single antenna run
+        pattern = result['pattern']
+        return cls(result['freq'], pattern['theta'][0], pattern['phi'][0], pattern['e_theta'], pattern['e_phi'],
+                   pattern['total_db'])
+
+    def embedded(self):
+        return self.e_theta.ndim == 3
+
+def array_pattern(element, positions, weights, coupling = None, chunk = 64):
+    # array far field for every frequency and set of weights
+    #   weights - (n_freqs, n_beams, n_elements), see steering_weights
+    #   coupling - optional (n_freqs, n_elements, n_elements) matrix applied to the weights
+    #   chunk - beams evaluated per pass, bounds the memory of the (freqs, beams, directions) arrays
+    # returns a dict of (n_freqs, n_beams, n_directions) arrays: e_theta, e_phi, array_factor and gain_db
+    # (relative to the element gain, assuming each element's input power is unchanged by the array)
+    positions = np.asarray(positions, dtype = float)
+    weights = np.asarray(weights, dtype = complex)
+    if coupling is not None:
+        weights = np.einsum('fij,fbj->fbi', coupling, weights)
+
+    k = 2 * np.pi * element.freq * 1e6 / C
+    u = unit_vectors(element.theta, element.phi)
+    # phase of each element toward each direction, computed once per frequency (n_freqs, n_elements, n_directions)
+    phase = np.exp(1j * k[:, np.newaxis, np.newaxis] * np.dot(positions, u.T)[np.newaxis])
+
+    n_freqs, n_beams = weights.shape[:2]
+    n_dirs = len(element.theta)
+    out = dict((name, np.empty((n_freqs, n_beams, n_dirs), dtype = complex))
+               for name in ('e_theta', 'e_phi', 'array_factor'))
+    for b in range(0, n_beams, chunk):
+        w = weights[:, b:b + chunk]
+        af = np.einsum('fbn,fnd->fbd', w, phase)
+        out['array_factor'][:, b:b + chunk] = af
+        if element.embedded():
+            out['e_theta'][:, b:b + chunk] = np.einsum('fbn,nfd,fnd->fbd', w, element.e_theta, phase)
+            out['e_phi'][:, b:b + chunk] = np.einsum('fbn,nfd,fnd->fbd', w, element.e_phi, phase)
+        else:
+            out['e_theta'][:, b:b + chunk] = af * element.e_theta[:, np.newaxis]
+            out['e_phi'][:, b:b + chunk] = af * element.e_phi[:, np.newaxis]
+
+    if element.gain_db is not None:
+        # array gain = element gain * |E_array|^2 / (|E_element|^2 * sum |w|^2)
+        if element.embedded():
+            e_ref = np.mean(np.abs(element.e_theta) ** 2 + np.abs(element.e_phi) ** 2, axis = 0)
+        else:
+            e_ref = np.abs(element.e_theta) ** 2 + np.abs(element.e_phi) ** 2
+        norm = np.sum(np.abs(weights) ** 2, axis = 2)
+        field = np.abs(out['e_theta']) ** 2 + np.abs(out['e_phi']) ** 2
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            ratio = field / (e_ref[:, np.newaxis] * norm[:, :, np.newaxis])
+            out['gain_db'] = np.asarray(element.gain_db)[:, np.newaxis] + 10 * np.log10(ratio)
+    return out
@@ -0,0 +1,342 @@
+# jon klein
+# jtklein@alaska.edu
+# timing benchmarks for nec2 card stack generation and the rest of the pipeline
+#
+# each benchmark times one part of the pipeline along one scaling axis, so it shows where the time
+# goes (python geometry, card formatting, file i/o, output parsing or the solver) and how it grows:
+#   model      - Model building and getText against the wire count
+#   antennas   - build_lpda_model, check_model, getText and make_lpda_nec against the number of lpdas
+#   density    - the same against segments per wavelength (segmentation.SegmentationPolicy densities)
+#   freqs      - getText and necout.read_out against the number of frequency steps
+#   pattern    - necout.read_out against the RP grid size
+#   deck       - necdeck.read_deck against the wire count
+#   solver     - mom.MomSolver fill and solve against the segment count
+#   scheduler  - scheduler.run_jobs overhead per job, for deck files and streamed cards, with a stub solver
+#
+# run with: python2 benchmark.py [names] [--quick] [--json report.json] [--compare baseline.json] [--profile]
+# --json writes every row as machine readable output, --compare checks the times against an earlier
+# report and exits nonzero on a regression, --profile adds the per stage report of profiling.py
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import numpy as np
+import profiling
+from collections import OrderedDict
+from nec2utils import *
+
+WIRE_COUNTS = [1000, 3000, 10000, 30000, 100000]
+ANTENNA_COUNTS = [1, 2, 4, 8]
+DENSITIES = [50, 100, 200, 400] # segments per wavelength at each element's resonance
+FREQ_STEPS = [11, 101, 1001]
+RP_GRIDS = [(19, 37), (37, 73), (91, 181)] # theta x phi points, 10, 5 and 2 degree full patterns
+DECK_WIRES = [1000, 3000, 10000]
+SOLVER_SEGMENTS = [51, 101, 201, 401, 801]
+JOB_COUNTS = [4, 16, 64]
+
+REPORT_VERSION = 1
+REGRESSION_RATIO = 1.25 # a time this much slower than the baseline is a regression
+REGRESSION_FLOOR_S = .01 # times shorter than this are too noisy to compare
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'time card generation, parsing and solving')
+    parser.add_argument('names', nargs = '*', help = 'benchmarks to run (default all): ' + ', '.join(BENCHMARKS))
+    parser.add_argument('--quick', action = 'store_true', help = 'only the two smallest points of each axis')
+    parser.add_argument('--json', help = 'write the results to this file')
+    parser.add_argument('--compare', help = 'report of an earlier run to check for regressions')
+    parser.add_argument('--profile', action = 'store_true', help = 'add per stage times and peak memory')
+    args = parser.parse_args(argv)
+
+    names = args.names or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark: %s' % name)
+    if args.profile:
+        profiling.enable()
+
+    report = {'version': REPORT_VERSION, 'time': time.time(), 'python': platform.python_version(),
+              'numpy': np.__version__, 'machine': platform.node(), 'quick': args.quick, 'benchmarks': {}}
+    for name in names:
+        print '\n' + name
+        rows = BENCHMARKS[name](args.quick)
+        print_rows(rows)
+        report['benchmarks'][name] = rows
+
+    if args.profile:
+        print '\nstages'
+        profiling.print_report()
+        report['stages'] = profiling.report()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent = 1)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            regressions = compare(json.load(f), report)
+        for line in regressions:
+            print 'regression: ' + line
+        return 1 if regressions else 0
+    return 0
+
+def axis(values, quick):
+    return values[:2] if quick else values
+
+def best_time(function, repeats = 1):
+    # shortest wall time of repeats calls of function, and its result
+    best, result = None, None
+    for i in range(repeats):
+        t0 = time.time()
+        result = function()
+        t = time.time() - t0
+        best = t if best is None else min(best, t)
+    return best, result
+
+def print_rows(rows):
+    # rows of one benchmark as a table, times in seconds
+    if not rows:
+        return
+    columns = list(rows[0])
+    print ' '.join('%12s' % c[:12] for c in columns)
+    for row in rows:
+        print ' '.join('%12.4f' % row[c] if isinstance(row[c], float) else '%12s' % row[c] for c in columns)
+
+def compare(baseline, report, ratio = REGRESSION_RATIO, floor = REGRESSION_FLOOR_S):
+    # times (columns ending in _s) in report more than ratio times their baseline, matched by benchmark and
+    # the first column of each row (its point on the scaling axis). returns a line describing each
+    regressions = []
+    for name, rows in report['benchmarks'].items():
+        old_rows = baseline.get('benchmarks', {}).get(name, [])
+        if not rows:
+            continue
+        key = list(rows[0])[0]
+        old = dict((r.get(key), r) for r in old_rows)
+        for row in rows:
+            before = old.get(row[key])
+            if before is None:
+                continue
+            for column, value in row.items():
+                if not column.endswith('_s') or column not in before or max(value, before[column]) < floor:
+                    continue
+                if value > ratio * before[column]:
+                    regressions.append('%s %s=%s %s %.4f s -> %.4f s (x%.2f)' % (name, key, row[key], column,
+                                       before[column], value, value / max(before[column], 1e-12)))
+    return regressions
+
+def build_wires(nwires):
+    # a model of nwires short wires with arcs mixed in, similar in card mix to a large lpda array
+    m = Model(inch(.25))
+    for i in range(nwires):
+        if i % 50 == 49:
+            m.addArc(12, .1, 0, 180, Rotation(0, 0, i % 360), Point(i * .01, 0, 15))
+        else:
+            m.addWire(7, Point(i * .01, .1, 15), Point(i * .01, 2.5, 15.5))
+            if i % 100 == 0:
+                m.loadAtMiddle(2e-6, .5)
+    m.feedAtMiddle(0)
+    return m
+
+def lpda_row(count):
+    # count horizontal lpdas side by side, at the spacing of the main array
+    from log_antenna import lpda_antenna, ANTENNA_SPACING
+    return [lpda_antenna(0, xoffset = .1, yoffset = i * ANTENNA_SPACING, zoffset = 0, feed_zoffset = .1)
+            for i in range(count)]
+
+def write_nec_output(filename, freqs, ports = 1, segments = 0, grid = None):
+    # a nec2 output file in the layout necout parses, with made up values: an input parameter row per
+    # port, a current row per segment and a pattern row per point of a (n_theta, n_phi) grid
+    with open(filename, 'w') as f:
+        for freq in freqs:
+            f.write('\n                               - - - FREQUENCY - - -\n\n')
+            f.write('                                    FREQUENCY= %.4E MHZ\n\n' % freq)
+            f.write('                        - - - ANTENNA INPUT PARAMETERS - - -\n\n')
+            f.write('  TAG   SEG.    VOLTAGE (VOLTS)         CURRENT (AMPS)         IMPEDANCE (OHMS)\n')
+            f.write('  NO.   NO.     REAL      IMAG.       REAL      IMAG.       REAL      IMAG.\n')
+            for port in range(ports):
+                values = (1., 0., 9.8e-3, -1.2e-3, 100. + freq, 12.3, 9.8e-3, -1.2e-3, 4.9e-3)
+                f.write('%5d %5d' % (port + 1, 2) + ''.join('%11.4E' % v for v in values) + '\n')
+            if segments:
+                f.write('\n\n                           - - - CURRENTS AND LOCATION - - -\n\n')
+                f.write('   SEG.  TAG    COORD. OF SEG. CENTER     SEG.            - - - CURRENT (AMPS) - - -\n')
+                f.write('   NO.   NO.     X         Y         Z      LENGTH     REAL      IMAG.      MAG.        PHASE\n')
+                f.write(''.join('%6d %4d %9.4f %9.4f %9.4f %9.5f %11.4E %11.4E %11.4E %9.3f\n' %
+                                (i + 1, 1, 0., 0., i * 1e-3, 1e-3, 1.2e-3, -3.4e-4, 1.25e-3, -15.8)
+                                for i in range(segments)))
+            if grid is not None:
+                f.write('\n\n                             - - - RADIATION PATTERNS - - -\n\n')
+                f.write('  - - ANGLES - -           - POWER GAINS -       - - - POLARIZATION - - -\n')
+                f.write('  THETA     PHI        VERT.   HOR.    TOTAL       AXIAL      TILT  SENSE\n')
+                f.write(' DEGREES  DEGREES        DB       DB       DB       RATIO       DEG.\n')
+                theta = np.linspace(-90, 90, grid[0])
+                phi = np.linspace(0, 360, grid[1])
+                f.write(''.join(' %6.2f  %8.2f   %8.2f %8.2f %8.2f %9.5f %8.2f  %-6s %13.5E %7.2f %12.5E %7.2f\n' %
+                                (t, p, -3.12, -8., -1.9, .1, 10., 'RIGHT', .12, 45., .03, -30.)
+                                for p in phi for t in theta))
+
+# -------------------------------------------------------------------------------------------
+# benchmarks, each takes quick and returns a list of rows, the first column is its scaling axis
+# -------------------------------------------------------------------------------------------
+
+# time model building and card formatting as the wire count grows, time per wire should stay flat
+def bench_model_scaling(quick = False):
+    rows = []
+    for nwires in axis(WIRE_COUNTS, quick):
+        build_s, m = best_time(lambda: build_wires(nwires))
+        text_s, text = best_time(lambda: m.getText(start = 8, stepSize = 1, stepCount = 11))
+        rows.append({'wires': nwires, 'build_s': build_s, 'getText_s': text_s, 'bytes': len(text),
+                     'us_per_wire': 1e6 * (build_s + text_s) / nwires})
+    return ordered(rows, ['wires', 'build_s', 'getText_s', 'bytes', 'us_per_wire'])
+
+def bench_lpda(models):
+    # build, check, format and write the deck of each (axis value, antennas, policy)
+    from log_antenna import build_lpda_model, make_lpda_nec
+    from geometry import check_model
+    folder = tempfile.mkdtemp(prefix = 'necbench')
+    rows = []
+    try:
+        for value, antennas, policy in models:
+            build_s, m = best_time(lambda: build_lpda_model(antennas, True, True, policy))
+            check_s, issues = best_time(lambda: check_model(m))
+            text_s, text = best_time(lambda: m.getText(start = 8, stepSize = 1, stepCount = 11))
+            write_s, written = best_time(lambda: writeCardsToFile(os.path.join(folder, 'bench.nec'), '', text))
+            make_s, names = best_time(lambda: make_lpda_nec('bench_make.nec', antennas, True, True,
+                                                            folder = os.path.join(folder, ''), summary = False,
+                                                            policy = policy, validate = False))
+            rows.append({'value': value, 'wires': m.getWireCount(), 'segments': m.getSegmentCount(),
+                         'build_s': build_s, 'check_s': check_s, 'getText_s': text_s, 'write_s': write_s,
+                         'make_nec_s': make_s})
+    finally:
+        shutil.rmtree(folder, ignore_errors = True)
+    return rows
+
+def bench_antennas(quick = False):
+    rows = bench_lpda([(n, lpda_row(n), None) for n in axis(ANTENNA_COUNTS, quick)])
+    return ordered(rows, ['antennas', 'wires', 'segments', 'build_s', 'check_s', 'getText_s', 'write_s',
+                          'make_nec_s'], value = 'antennas')
+
+def bench_density(quick = False):
+    from log_antenna import max_freq
+    from segmentation import SegmentationPolicy
+    models = [(d, lpda_row(1), SegmentationPolicy(max_freq, element_density = d, feed_density = 3. * d,
+                                                   structure_density = d / 2.)) for d in axis(DENSITIES, quick)]
+    return ordered(bench_lpda(models), ['density', 'wires', 'segments', 'build_s', 'check_s', 'getText_s',
+                                        'write_s', 'make_nec_s'], value = 'density')
+
+def bench_freqs(quick = False):
+    # cards for long sweeps, and parsing the impedance and two pattern cut output they produce
+    import necout
+    from log_antenna import build_lpda_model, LPDA_PATTERN_CUTS
+    m = build_lpda_model(lpda_row(1), True, True)
+    folder = tempfile.mkdtemp(prefix = 'necbench')
+    rows = []
+    try:
+        for steps in axis(FREQ_STEPS, quick):
+            text_s, text = best_time(lambda: m.getText(8, 10. / (steps - 1), steps, LPDA_PATTERN_CUTS), 3)
+            out = os.path.join(folder, 'freqs.out')
+            write_nec_output(out, np.linspace(8, 18, steps), ports = 1, grid = (181, 2))
+            z_s, r = best_time(lambda: necout.read_out(out, ('inputs',)))
+            all_s, r = best_time(lambda: necout.read_out(out))
+            rows.append({'steps': steps, 'getText_s': text_s, 'out_bytes': os.path.getsize(out),
+                         'read_z_s': z_s, 'read_all_s': all_s})
+    finally:
+        shutil.rmtree(folder, ignore_errors = True)
+    return ordered(rows, ['steps', 'getText_s', 'out_bytes', 'read_z_s', 'read_all_s'])
+
+def bench_pattern(quick = False):
+    # parsing full patterns of 11 frequencies as the grid gets finer
+    import necout
+    folder = tempfile.mkdtemp(prefix = 'necbench')
+    rows = []
+    try:
+        for grid in axis(RP_GRIDS, quick):
+            out = os.path.join(folder, 'pattern.out')
+            write_nec_output(out, np.arange(8, 19), ports = 1, grid = grid)
+            read_s, r = best_time(lambda: necout.read_out(out, ('inputs', 'pattern')))
+            rows.append({'points': grid[0] * grid[1], 'out_bytes': os.path.getsize(out), 'read_s': read_s,
+                         'us_per_point': 1e6 * read_s / (11 * grid[0] * grid[1])})
+    finally:
+        shutil.rmtree(folder, ignore_errors = True)
+    return ordered(rows, ['points', 'out_bytes', 'read_s', 'us_per_point'])
+
+def bench_deck(quick = False):
+    # reading decks back into Models
+    import necdeck
+    folder = tempfile.mkdtemp(prefix = 'necbench')
+    rows = []
+    try:
+        for nwires in axis(DECK_WIRES, quick):
+            deck = os.path.join(folder, 'deck.nec')
+            writeCardsToFile(deck, 'CM benchmark\nCE', build_wires(nwires).getText(8, 1, 11))
+            read_s, parsed = best_time(lambda: necdeck.read_deck(deck))
+            rows.append({'wires': nwires, 'deck_bytes': os.path.getsize(deck), 'read_deck_s': read_s,
+                         'us_per_wire': 1e6 * read_s / nwires})
+    finally:
+        shutil.rmtree(folder, ignore_errors = True)
+    return ordered(rows, ['wires', 'deck_bytes', 'read_deck_s', 'us_per_wire'])
+
+def bench_solver(quick = False):
+    # interaction matrix fill and solve of a center fed half wave dipole at 10 MHz
+    import mom
+    rows = []
+    for segments in axis(SOLVER_SEGMENTS, quick):
+        m = Model(.01)
+        m.addWire(segments, Point(0, 0, -7.5), Point(0, 0, 7.5))
+        m.feedAtMiddle(0)
+        setup_s, solver = best_time(lambda: mom.MomSolver(m))
+        fill_s, z = best_time(lambda: solver.matrix(10.))
+        solve_s, coef = best_time(lambda: np.linalg.solve(z, solver.excitation()[0]))
+        total_s, r = best_time(lambda: solver.solve([10.], True))
+        rows.append({'segments': segments, 'setup_s': setup_s, 'fill_s': fill_s, 'solve_s': solve_s,
+                     'frequency_s': total_s})
+    return ordered(rows, ['segments', 'setup_s', 'fill_s', 'solve_s', 'frequency_s'])
+
+def bench_scheduler(quick = False):
+    # time per job of run_jobs itself, the solver just copies its deck to the output
+    import scheduler
+    m = build_wires(100)
+    text = m.getText(8, 1, 11)
+    folder = tempfile.mkdtemp(prefix = 'necbench')
+    rows = []
+    try:
+        for count in axis(JOB_COUNTS, quick):
+            decks = []
+            for i in range(count):
+                decks.append(os.path.join(folder, 'job%d.nec' % i))
+                writeCardsToFile(decks[-1], 'CM benchmark\nCE', text)
+            jobs = [scheduler.job_from_deck(deck, folder) for deck in decks]
+            file_s, records = best_time(lambda: scheduler.run_jobs(jobs, cores = 4, solver = 'cp {deck} {out}'))
+            cards = lambda: iterDeck('CM benchmark\nCE', m.iterSweepText([(8, 1, 11)]))
+            jobs = [scheduler.job_from_cards(cards, 'stream%d.nec' % i, folder, 100, 700, 11) for i in range(count)]
+            stream_s, records = best_time(lambda: scheduler.run_jobs(jobs, cores = 4, solver = 'cp {deck} {out}'))
+            rows.append({'jobs': count, 'files_s': file_s, 'streamed_s': stream_s,
+                         'ms_per_job': 1e3 * file_s / count})
+    finally:
+        shutil.rmtree(folder, ignore_errors = True)
+    return ordered(rows, ['jobs', 'files_s', 'streamed_s', 'ms_per_job'])
+
+def ordered(rows, columns, value = None):
+    # rows with their columns in order, value renames the 'value' column
+    out = []
+    for row in rows:
+        if value is not None:
+            row = dict(row)
+            row[value] = row.pop('value')
+        out.append(OrderedDict((c, row[c]) for c in columns))
+    return out
+
+BENCHMARKS = OrderedDict([
+    ('model', bench_model_scaling),
+    ('antennas', bench_antennas),
+    ('density', bench_density),
+    ('freqs', bench_freqs),
+    ('pattern', bench_pattern),
+    ('deck', bench_deck),
+    ('solver', bench_solver),
+    ('scheduler', bench_scheduler),
+])
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,240 @@
+# jon klein
+# jtklein@alaska.edu
+# multi-port coupling matrices (Z, Y and S parameters) of multi-antenna models
+#
+# the coupling between the two polarizations of a dual pol pair, or between the antennas of an
+# array, is the port matrix of the model: the current into every port with a unit voltage on one of
+# them and the others shorted (the short circuit admittance matrix Y), or equivalently Z = Y^-1 and
+# S = (I + z0 Y)^-1 (I - z0 Y). a PortMatrix holds Y over frequency, from any of
+#   from_mom  - mom.MomSolver, which factors the interaction matrix once per frequency and solves
+#               every port as another right hand side of it
+#   from_out  - one nec run of a Model.getPortMatrixText deck (log_antenna.make_lpda_coupling_nec), with
+#               an FR card per frequency and an EX / XQ group per port, so nec only refactors on a new frequency
+#   from_port_solution - the one deck per port runs of superposition.PortSolution
+# it's saved as a compressed npz of the upper triangle of Y (the model is reciprocal), and written
+# as a Touchstone file for circuit simulators and vna tools.
+#
+# usage:
+#   m = PortMatrix.from_mom(build_lpda_model([horiz, vert], usepole = True, ground = 'perfect'), np.arange(8, 19))
+#   m.coupling_db()[:, 0, 1]          -> isolation between the polarizations (dB) at each frequency
+#   m.active_reflection([1, 1j])      -> reflection at each port with both driven 90 degrees apart
+#   m.write_touchstone('lpda_orth.s2p')
+#
+# command line, at the frequencies of a deck of the model (its coupling deck, or an ordinary one --write-deck
+# makes the coupling deck of), solved with mom.py or read from nec's output of the coupling deck:
+#   python2 coupling.py necfiles/lpda_orth.nec --write-deck necfiles/lpda_orth_coupling.nec
+#   python2 coupling.py necfiles/lpda_orth_coupling.nec [out/lpda_orth_coupling.nec.out] --touchstone lpda_orth.s2p
+
+import sys
+import argparse
+import numpy as np
+import necout
+from adaptivesweep import Z0
+
+TOUCHSTONE_PAIRS_PER_LINE = 4 # values of more than two port matrices are wrapped to 4 per line, as the format asks
+RECIPROCAL_TOLERANCE = 1e-9 # relative asymmetry of Y below which it is saved as its upper triangle
+
+class PortMatrix:
+    def __init__(self, freq, admittance, ports, z0 = Z0):
+        # freq (n_freqs,) MHz, admittance - short circuit admittance matrix [frequency, j, k] (siemens),
+        # ports - (tag, segment) of each port in feeding order, z0 - reference impedance of the S parameters
+        self.freq = np.asarray(freq, dtype = float)
+        self.admittance = np.asarray(admittance, dtype = np.complex128).reshape(len(self.freq), len(ports), len(ports))
+        self.ports = [(int(tag), int(seg)) for tag, seg in ports]
+        self.z0 = z0
+
+    def __len__(self):
+        return len(self.ports)
+
+    @classmethod
+    def from_mom(cls, model, freqs, z0 = Z0, **options):
+        # port matrix of a Model solved with mom.MomSolver (options are its keyword arguments)
+        import mom
+        solver = mom.MomSolver(model, **options)
+        tags, segments = model.getPorts()
+        return cls(freqs, solver.port_matrix(freqs), zip(tags, segments), z0)
+
+    @classmethod
+    def from_out(cls, filename, ports = None, z0 = Z0):
+        # port matrix from nec's output of a Model.getPortMatrixText deck. every excitation prints an input
+        # parameter table with a row per port, the port at 1 V gives the column. ports defaults to the order
+        # of the rows of the first table
+        columns = {}
+        freqs = []
+        for freq, table in necout.iter_tables(filename, 'inputs'):
+            if ports is None:
+                ports = zip(table['tag'], table['segment'])
+            order = [np.nonzero((table['tag'] == tag) & (table['segment'] == seg))[0] for tag, seg in ports]
+            if any(len(i) != 1 for i in order):
+                raise ValueError('%s: the input table at %g MHz does not have one row per port' % (filename, freq))
+            table = table[np.concatenate(order)]
+            driven = np.argmax(np.abs(table['voltage']))
+            if table['voltage'][driven] == 0:
+                raise ValueError('%s: a table at %g MHz drives none of the ports' % (filename, freq))
+            if freq not in columns:
+                freqs.append(freq)
+                columns[freq] = {}
+            if driven in columns[freq]:
+                raise ValueError('%s: port %d is driven twice at %g MHz' % (filename, driven, freq))
+            columns[freq][driven] = table['current'] / table['voltage'][driven]
+        if ports is None:
+            raise ValueError('%s has no input parameter tables' % filename)
+        y = np.zeros((len(freqs), len(ports), len(ports)), dtype = np.complex128)
+        for i, freq in enumerate(freqs):
+            if len(columns[freq]) != len(ports):
+                raise ValueError('%s: %d of %d ports were driven at %g MHz' % (filename, len(columns[freq]),
+                                 len(ports), freq))
+            for k, current in columns[freq].items():
+                y[i, :, k] = current
+        return cls(freqs, y, ports, z0)
+
+    @classmethod
+    def from_port_solution(cls, solution, z0 = Z0):
+        # port matrix of a superposition.PortSolution, built from one nec run per port
+        return cls(solution.freq, solution.admittance, solution.ports, z0)
+
+    # -------------------------------------------------------------------------------------------
+    # parameters
+    # -------------------------------------------------------------------------------------------
+
+    def impedance(self):
+        # open circuit impedance matrix [frequency, j, k] (ohms)
+        return np.linalg.inv(self.admittance)
+
+    def scattering(self, z0 = None):
+        # scattering matrix [frequency, j, k] with every port referenced to z0 (default self.z0)
+        z0 = self.z0 if z0 is None else z0
+        eye = np.eye(len(self))[np.newaxis]
+        return np.linalg.solve(eye + z0 * self.admittance, eye - z0 * self.admittance)
+
+    def coupling_db(self, z0 = None):
+        # |S| in dB [frequency, j, k], the diagonal is the return loss of each port with the others matched
+        with np.errstate(divide = 'ignore'):
+            return 20 * np.log10(np.abs(self.scattering(z0)))
+
+    def active_reflection(self, weights, z0 = None):
+        # reflection coefficient at every port with all of them driven at once by incident waves weights,
+        # (n_ports,) or (..., n_freqs, n_ports) like arrayfactor.steering_weights (scan impedance of an array)
+        s = self.scattering(z0)
+        a = np.asarray(weights, dtype = complex)
+        if a.ndim == 1:
+            a = np.tile(a, (len(self.freq), 1))
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            return np.einsum('fjk,...fk->...fj', s, a) / a
+
+    def active_impedance(self, weights, z0 = None):
+        # input impedance of every port with all of them driven, see active_reflection
+        z0 = self.z0 if z0 is None else z0
+        gamma = self.active_reflection(weights, z0)
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            return z0 * (1 + gamma) / (1 - gamma)
+
+    # -------------------------------------------------------------------------------------------
+    # files
+    # -------------------------------------------------------------------------------------------
+
+    def save(self, filename):
+        # compressed npz: frequencies, ports, z0 and the upper triangle of Y if it is reciprocal, else all of it
+        y = self.admittance
+        upper = np.triu_indices(len(self))
+        reciprocal = np.allclose(y, np.swapaxes(y, 1, 2), rtol = RECIPROCAL_TOLERANCE, atol = 0)
+        np.savez_compressed(filename, freq = self.freq, ports = np.array(self.ports, dtype = np.int64).reshape(-1, 2),
+                            z0 = self.z0, reciprocal = reciprocal,
+                            admittance = y[:, upper[0], upper[1]] if reciprocal else y)
+
+    @classmethod
+    def load(cls, filename):
+        data = np.load(filename)
+        ports = [tuple(p) for p in data['ports']]
+        y = data['admittance']
+        if data['reciprocal']:
+            full = np.zeros((len(data['freq']), len(ports), len(ports)), dtype = np.complex128)
+            upper = np.triu_indices(len(ports))
+            full[:, upper[0], upper[1]] = y
+            full[:, upper[1], upper[0]] = y
+            y = full
+        return cls(data['freq'], y, ports, float(data['z0']))
+
+    def write_touchstone(self, filename, parameter = 'S', form = 'RI', z0 = None, comments = ()):
+        # write a Touchstone (version 1) file of the S, Y or Z parameters, as RI (real, imaginary), MA (magnitude,
+        # angle) or DB (dB, angle) pairs. Y and Z are normalized to z0, as the format asks
+        z0 = self.z0 if z0 is None else z0
+        parameter, form = parameter.upper(), form.upper()
+        if parameter == 'S':
+            values = self.scattering(z0)
+        elif parameter == 'Y':
+            values = self.admittance * z0
+        elif parameter == 'Z':
+            values = self.impedance() / z0
+        else:
+            raise ValueError('unknown parameter %s, expected S, Y or Z' % parameter)
+        if form not in ('RI', 'MA', 'DB'):
+            raise ValueError('unknown format %s, expected RI, MA or DB' % form)
+
+        with open(filename, 'w') as f:
+            for comment in comments:
+                f.write('! %s\n' % comment)
+            f.write('! ports (tag, segment): %s\n' % ' '.join('%d,%d' % port for port in self.ports))
+            f.write('# MHZ %s %s R %g\n' % (parameter, form, z0))
+            for freq, matrix in zip(self.freq, values):
+                f.write(touchstone_lines(freq, matrix, form))
+
+def touchstone_pair(value, form):
+    if form == 'RI':
+        return '% .9e % .9e' % (value.real, value.imag)
+    angle = np.degrees(np.angle(value))
+    if form == 'MA':
+        return '% .9e % .6f' % (abs(value), angle)
+    with np.errstate(divide = 'ignore'):
+        return '% .6f % .6f' % (20 * np.log10(abs(value)), angle)
+
+def touchstone_lines(freq, matrix, form):
+    # the data lines of one frequency. two port files list S11 S21 S12 S22 on one line, larger ones a row of
+    # the matrix per line, wrapped after TOUCHSTONE_PAIRS_PER_LINE values
+    n = len(matrix)
+    if n <= 2:
+        values = matrix.T.ravel()
+        return '%.9g ' % freq + ' '.join(touchstone_pair(v, form) for v in values) + '\n'
+    lines = []
+    for j in range(n):
+        row = [touchstone_pair(v, form) for v in matrix[j]]
+        for first in range(0, n, TOUCHSTONE_PAIRS_PER_LINE):
+            prefix = '%.9g ' % freq if j == 0 and first == 0 else ' ' * len('%.9g ' % freq)
+            lines.append(prefix + ' '.join(row[first:first + TOUCHSTONE_PAIRS_PER_LINE]))
+    return '\n'.join(lines) + '\n'
+
+def main(argv):
+    parser = argparse.ArgumentParser(description = 'port coupling matrix of a nec deck')
+    parser.add_argument('deck', help = 'nec deck of the model, or its coupling deck, solved with mom.py at the '
+                        'frequencies of its FR cards')
+    parser.add_argument('out', nargs = '?', help = 'nec output of the coupling deck of the model, read instead of solving')
+    parser.add_argument('--write-deck', help = 'write the coupling deck of the model to this file and exit')
+    parser.add_argument('--touchstone', help = 'write the S parameters to this Touchstone file')
+    parser.add_argument('--save', help = 'write the port matrix to this npz file')
+    parser.add_argument('--z0', type = float, default = Z0, help = 'reference impedance (default %(default)g)')
+    args = parser.parse_args(argv)
+
+    from necdeck import read_deck
+    from nec2utils import writeCardsToFile
+    model, sweeps, comments = read_deck(args.deck)
+    freqs = np.unique(np.concatenate([start + step * np.arange(count) for start, step, count, radpat in sweeps]))
+    if args.write_deck:
+        writeCardsToFile(args.write_deck, comments, model.getPortMatrixText(freqs))
+        return 0
+
+    tags, segments = model.getPorts()
+    if args.out:
+        m = PortMatrix.from_out(args.out, zip(tags, segments), args.z0)
+    else:
+        m = PortMatrix.from_mom(model, freqs, args.z0, approximate_ground = True)
+
+    for freq, s in zip(m.freq, m.coupling_db()):
+        print('%8.3f MHz  ' % freq + '  '.join(' '.join('%7.2f' % v for v in row) for row in s))
+    if args.touchstone:
+        m.write_touchstone(args.touchstone, comments = [args.deck])
+    if args.save:
+        m.save(args.save)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,253 @@
+# jon klein
+# jtklein@alaska.edu
+# geometry validation for nec models with a spatial grid index
+#
+# build_lpda and add_towerboom connect wires by reusing coordinates, nothing checked that the
+# ends really coincide or that separate wires stay apart. check_model indexes every segment
+# endpoint and midpoint of a Model in a uniform grid (cell keys sorted once, neighbours found
+# by binary search, so O(N log N) overall) and reports
+#   near_miss - segment ends of different wires closer than `near` segment lengths that nec
+#               will not connect (it connects ends within 1e-3 of the shorter segment length)
+#   overlap   - unconnected segments of different wires whose wire surfaces intersect
+#   spacing   - unconnected segments of different wires closer than min_spacing times the larger
+#               radius, where the thin-wire kernel of one no longer sees the other as a thin line current
+# segments of one wire (one tag) are never compared, a thick wire cut into short segments is not
+# an overlap with itself. neither are segments of two wires that both lie within the spacing limit of a
+# junction of the two, a thin boom meeting a thick tower crowds its top segments by construction
+# snap_junctions moves the wire ends of near misses onto each other. a dual pol model with its
+# tower takes tens of ms, so make_lpda_nec runs it on every deck it writes.
+#
+# usage:
+#   for kind, tag1, seg1, tag2, seg2, distance in check_model(m):
+#       print kind, tag1, seg1, tag2, seg2, distance
+
+import numpy as np
+
+# nec connects segment ends closer than this fraction of the shorter segment
+CONNECT_TOLERANCE = 1e-3
+# unconnected ends closer than this fraction of the shorter segment are reported as near misses
+NEAR_MISS = 0.1
+# smallest distance between unconnected segments, in radii of the thicker one
+MIN_SPACING = 2.
+
+ISSUE_DTYPE = [('kind', 'S9'), ('tag1', np.int64), ('seg1', np.int64), ('tag2', np.int64), ('seg2', np.int64),
+               ('distance', np.float64)]
+
+# cell offsets (0, 0, 0) and the 13 that are lexicographically positive
+HALF_NEIGHBOURS = np.array([o for o in np.ndindex(3, 3, 3) if tuple(o) >= (1, 1, 1)]) - 1
+
+class SpatialGrid:
+    def __init__(self, points, cell):
+        # index (n, 3) points in cubic cells of size cell
+        self.points = np.asarray(points, dtype = float).reshape(-1, 3)
+        self.cell = float(cell) if cell > 0 else 1.
+        cells = np.floor(self.points / self.cell).astype(np.int64) if len(self.points) else np.zeros((0, 3), np.int64)
+        # cell coordinates from 1, with a margin so neighbouring cell keys never wrap into another row
+        low = cells.min(axis = 0) - 1 if len(cells) else np.zeros(3, np.int64)
+        cells = cells - low
+        self.extent = (cells.max(axis = 0) + 2) if len(cells) else np.ones(3, np.int64)
+        self.keys = self.key(cells)
+        self.order = np.argsort(self.keys, kind = 'mergesort')
+        self.sorted_keys = self.keys[self.order]
+
+    def key(self, cells):
+        return (cells[..., 0] * self.extent[1] + cells[..., 1]) * self.extent[2] + cells[..., 2]
+
+    def pairs(self, radius):
+        # all pairs (i, j) of points within radius of each other, each pair once, radius <= cell
+        if radius > self.cell:
+            raise ValueError('search radius %g is larger than the grid cell %g' % (radius, self.cell))
+        n = len(self.points)
+        found_i, found_j = [], []
+        # a point's own cell and the 13 neighbours of the upper half, so every pair of cells is visited once
+        for offset in HALF_NEIGHBOURS:
+            target = self.keys + self.key(offset)
+            lo = np.searchsorted(self.sorted_keys, target, 'left')
+            hi = np.searchsorted(self.sorted_keys, target, 'right')
+            counts = hi - lo
+            i = np.repeat(np.arange(n), counts)
+            j = self.order[np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())]
+            if not offset.any():
+                keep = i < j
+                i, j = i[keep], j[keep]
+            found_i.append(i)
+            found_j.append(j)
+        i, j = np.concatenate(found_i), np.concatenate(found_j)
+        d = np.sqrt(np.sum((self.points[i] - self.points[j]) ** 2, axis = 1))
+        keep = d <= radius
+        return i[keep], j[keep], d[keep]
+
+def segment_distance(a0, a1, b0, b1):
+    # shortest distance between the line segments a0-a1 and b0-b1, row by row
+    u, v, w = a1 - a0, b1 - b0, a0 - b0
+    a, b, c = np.sum(u * u, axis = 1), np.sum(u * v, axis = 1), np.sum(v * v, axis = 1)
+    d, e = np.sum(u * w, axis = 1), np.sum(v * w, axis = 1)
+    denom = a * c - b * b
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        # closest point parameter on a, for parallel segments any point will do
+        s = np.clip(np.where(denom > 1e-12 * a * c, (b * e - c * d) / denom, 0.), 0., 1.)
+        t = np.where(c > 0, (b * s + e) / c, 0.)
+        # t out of range: clamp it and recompute s for the clamped t
+        t_clamped = np.clip(t, 0., 1.)
+        s = np.where(t != t_clamped, np.clip(np.where(a > 0, (t_clamped * b - d) / a, 0.), 0., 1.), s)
+    t = t_clamped
+    diff = w + s[:, np.newaxis] * u - t[:, np.newaxis] * v
+    return np.sqrt(np.sum(diff * diff, axis = 1))
+
+def issues_array(kind, tag, seg, i, j, distance):
+    rows = np.zeros(len(i), dtype = ISSUE_DTYPE)
+    rows['kind'] = kind
+    rows['tag1'], rows['seg1'], rows['tag2'], rows['seg2'] = tag[i], seg[i], tag[j], seg[j]
+    rows['distance'] = distance
+    return rows
+
+def end_pairs(start, stop, length, tag, near):
+    # near pairs of segment ends on different wires, as (end index i, end index j, distance, shorter segment)
+    # end index e is the start of segment e for e < n and the stop of segment e - n otherwise
+    n = len(start)
+    ends = np.vstack((start, stop))
+    grid = SpatialGrid(ends, near * length.max() if n else 1.)
+    i, j, d = grid.pairs(grid.cell)
+    seg_i, seg_j = i % n, j % n
+    shorter = np.minimum(length[seg_i], length[seg_j])
+    keep = (tag[seg_i] != tag[seg_j]) & (d <= near * shorter)
+    return i[keep], j[keep], d[keep], shorter[keep]
+
+def clusters(count, i, j):
+    # label of the cluster of each of count items linked by the pairs (i, j), the smallest item index in it,
+    # found by propagating the smallest index through the links
+    label = np.arange(count)
+    while True:
+        low = np.minimum(label[i], label[j])
+        new = label.copy()
+        np.minimum.at(new, i, low)
+        np.minimum.at(new, j, low)
+        new = new[new]
+        if np.array_equal(new, label):
+            return label
+        label = new
+
+def junctions(start, stop, connect = CONNECT_TOLERANCE):
+    # the node each segment end is connected to, as nec connects them (ends closer than connect times the
+    # shorter segment), returns node labels of the starts and of the stops
+    n = len(start)
+    length = np.sqrt(np.sum((stop - start) ** 2, axis = 1))
+    ends = np.vstack((start, stop))
+    # cells no smaller than 1e-5 of the model, so cell keys of a large model don't overflow
+    grid = SpatialGrid(ends, max(connect * length.max(), 1e-5 * np.ptp(ends, axis = 0).max()) if n else 1.)
+    i, j, d = grid.pairs(grid.cell)
+    keep = d <= connect * np.minimum(length[i % n], length[j % n])
+    label = clusters(2 * n, i[keep], j[keep])
+    return label[:n], label[n:]
+
+def junction_crowding(a, b, start, stop, tag, limit, connect = CONNECT_TOLERANCE):
+    # which segment pairs (a, b) of different wires both lie within limit of a junction joining their two wires
+    n = len(start)
+    ends = np.vstack((start, stop))
+    node = np.concatenate(junctions(start, stop, connect))
+    # (tag, node) of every wire end at a junction of more than one wire, sorted by tag
+    keys = np.unique(np.concatenate((tag, tag)) * (2 * n) + node)
+    nodes, wires = np.unique(keys % (2 * n), return_counts = True)
+    keys = keys[np.in1d(keys % (2 * n), nodes[wires > 1])]
+    # every junction of the wire of a, kept where the wire of b meets it too
+    lo = np.searchsorted(keys, tag[a] * (2 * n))
+    count = np.searchsorted(keys, (tag[a] + 1) * (2 * n)) - lo
+    pair = np.repeat(np.arange(len(a)), count)
+    at = keys[np.arange(len(pair)) - np.repeat(np.cumsum(count) - count, count) + np.repeat(lo, count)] % (2 * n)
+    other = tag[b][pair] * (2 * n) + at
+    shared = keys[np.minimum(np.searchsorted(keys, other), len(keys) - 1)] == other if len(keys) else other < 0
+    pair, p = pair[shared], ends[at[shared]]
+    near = (segment_distance(p, p, start[a][pair], stop[a][pair]) < limit[pair]) & \
+           (segment_distance(p, p, start[b][pair], stop[b][pair]) < limit[pair])
+    crowded = np.zeros(len(a), dtype = bool)
+    crowded[pair[near]] = True
+    return crowded
+
+def check_model(model, near = NEAR_MISS, min_spacing = MIN_SPACING, connect = CONNECT_TOLERANCE):
+    # validate the wire and arc geometry of a Model, returns a record array of issues (ISSUE_DTYPE)
+    # between segments (tag1, seg1) and (tag2, seg2), see the module comment for the kinds
+    tag, seg, start, stop, radius = model.getSegments()
+    n = len(tag)
+    if not n:
+        return np.zeros(0, dtype = ISSUE_DTYPE)
+    length = np.sqrt(np.sum((stop - start) ** 2, axis = 1))
+
+    # junctions nec will connect, and near misses it won't
+    i, j, d, shorter = end_pairs(start, stop, length, tag, near)
+    connected = d <= connect * shorter
+    miss = ~connected
+    issues = [issues_array('near_miss', tag, seg, i[miss] % n, j[miss] % n, d[miss])]
+
+    # every segment has its midpoint within half its length of all its points, so two segments closer
+    # than the spacing limit have midpoints within max_length + limit of each other
+    limit = min_spacing * radius.max()
+    mid = (start + stop) / 2
+    grid = SpatialGrid(mid, length.max() + limit)
+    a, b, dm = grid.pairs(grid.cell)
+    # segments of one wire, and segments that share an end (a junction) are connected, not close
+    share = tag[a] == tag[b]
+    for ea, eb in ((start, start), (start, stop), (stop, start), (stop, stop)):
+        gap = np.sqrt(np.sum((ea[a] - eb[b]) ** 2, axis = 1))
+        share |= gap <= connect * np.minimum(length[a], length[b])
+    a, b = a[~share], b[~share]
+    crowded = junction_crowding(a, b, start, stop, tag, min_spacing * np.maximum(radius[a], radius[b]), connect)
+    a, b = a[~crowded], b[~crowded]
+    dist = segment_distance(start[a], stop[a], start[b], stop[b])
+    overlap = dist < radius[a] + radius[b]
+    close = ~overlap & (dist < min_spacing * np.maximum(radius[a], radius[b]))
+    issues.append(issues_array('overlap', tag, seg, a[overlap], b[overlap], dist[overlap]))
+    issues.append(issues_array('spacing', tag, seg, a[close], b[close], dist[close]))
+    return np.concatenate(issues)
+
+def summarize(issues):
+    # one line count of issues by kind, empty if there are none
+    kinds, counts = np.unique(issues['kind'], return_counts = True)
+    return ', '.join('%d %s' % (c, k.decode('ascii') if isinstance(k, bytes) else k) for k, c in zip(kinds, counts))
+
+def snap_junctions(model, near = NEAR_MISS, connect = CONNECT_TOLERANCE):
+    # move wire ends that nearly meet a segment end of another wire onto it, in place
+    # ends meeting each other move to their mean, an end near a segment boundary inside another wire moves
+    # onto the boundary. returns the number of wire ends moved
+    tag, seg, start, stop, radius = model.getSegments()
+    n = len(tag)
+    if not n:
+        return 0
+    length = np.sqrt(np.sum((stop - start) ** 2, axis = 1))
+    i, j, d, shorter = end_pairs(start, stop, length, tag, near)
+    miss = d > connect * shorter
+    i, j = i[miss], j[miss]
+    if not len(i):
+        return 0
+
+    # cluster ends linked by near misses
+    label = clusters(2 * n, i, j)
+
+    # which ends are wire ends (the first segment's start or the last segment's stop of a tag) that may move,
+    # only GW ends are coordinates that can be moved, a GA arc keeps its shape
+    rows = model.wires.rows()
+    row = np.repeat(np.arange(len(rows)), np.maximum(rows['segments'], 1))
+    straight = rows['card'][row] == 0
+    first = np.nonzero(straight & (seg == 1))[0]
+    last = np.nonzero(straight & np.append(tag[1:] != tag[:-1], True))[0]
+    movable = np.zeros(2 * n, dtype = bool)
+    movable[first] = True
+    movable[n + last] = True
+
+    ends = np.vstack((start, stop))
+    members = np.unique(np.concatenate((i, j)))
+    target = np.zeros((2 * n, 3))
+    weight = np.zeros(2 * n)
+    # fixed points pin their cluster, otherwise the cluster meets at the mean of its ends
+    fixed = members[~movable[members]]
+    free = members[movable[members]]
+    np.add.at(target, label[free], ends[free])
+    np.add.at(weight, label[free], 1.)
+    target[label[fixed]] = ends[fixed]
+    weight[label[fixed]] = 1.
+    target = target / np.maximum(weight, 1.)[:, np.newaxis]
+
+    # write the moved ends back to the GW rows they came from
+    at_start = free < n
+    rows['f'][row[free[at_start]], 0:3] = target[label[free[at_start]]]
+    rows['f'][row[free[~at_start] - n], 3:6] = target[label[free[~at_start]]]
+    return len(free)
@@ -0,0 +1,85 @@
+# jon klein
+# jtklein@alaska.edu
+# ground presets and ground parameter sweeps
+#
+# models used to get one hard coded GN card (13, 0.005) whenever ground was set. a ground is now
+# a Ground (GN method, relative permittivity, conductivity), looked up by name from PRESETS, or
+# given as an 'epsilon,sigma[,method]' string so sweeps can carry it in json manifests:
+#   make_lpda_nec('lpda_vert_sea.nec', [vert], usepole = True, ground = 'sea')
+#   run_sweep({'ground': ground_sweep([5, 13, 30], [.001, .005, .01])}, ...)
+#
+# nec2dxs, which simulate.sh runs, computes the sommerfeld/norton interpolation grid of a finite
+# ground itself from the GN card, so there is no grid to precompute or cache here.
+
+import numpy as np
+
+EPS0 = 8.854187817e-12
+
+# GN card ground types
+REFLECTION = 0  # finite ground, reflection coefficient approximation
+PERFECT = 1     # perfectly conducting ground
+SOMMERFELD = 2  # finite ground, sommerfeld/norton (needs the interpolation grid)
+METHODS = {'reflection': REFLECTION, 'perfect': PERFECT, 'sommerfeld': SOMMERFELD}
+
+def gn_type(method):
+    # GN ground type of a method name or number, a ValueError for anything nec doesn't know
+    gn = METHODS.get(method, method)
+    if gn not in METHODS.values():
+        raise ValueError('unknown ground method %r, expected one of %s' % (method, ', '.join(sorted(METHODS))))
+    return gn
+
+class Ground:
+    def __init__(self, epsilon, sigma, method = SOMMERFELD, name = None):
+        # epsilon - relative permittivity, sigma - conductivity (S/m), method - GN ground type
+        self.epsilon = float(epsilon)
+        self.sigma = float(sigma)
+        self.gnType = gn_type(method)
+        self.name = name if name is not None else spec(self.epsilon, self.sigma, self.gnType)
+
+    def complex_permittivity(self, freq):
+        # complex relative permittivity at freq (MHz)
+        return self.epsilon - 1j * self.sigma / (2 * np.pi * np.asarray(freq) * 1e6 * EPS0)
+
+    def __repr__(self):
+        return 'Ground(%r, %r, %r, %r)' % (self.epsilon, self.sigma, self.gnType, self.name)
+
+def spec(epsilon, sigma, method = SOMMERFELD):
+    # string form of a ground, parsed back by get_ground
+    text = '%g,%g' % (epsilon, sigma)
+    if method != SOMMERFELD:
+        text += ',' + dict((v, k) for k, v in METHODS.items())[method]
+    return text
+
+# conductivity and permittivity of common grounds at hf, ITU-R P.527 curves
+PRESETS = dict((g.name, g) for g in [
+    Ground(13, .005, name = 'average'),       # the ground every model used before presets
+    Ground(70, 5., name = 'sea'),
+    Ground(80, .003, name = 'fresh_water'),
+    Ground(30, .01, name = 'wet'),
+    Ground(15, .001, name = 'medium_dry'),
+    Ground(3, 1e-4, name = 'very_dry'),
+    Ground(3, 1e-5, name = 'ice'),
+    Ground(1, 0, PERFECT, name = 'perfect'),
+])
+DEFAULT_GROUND = 'average'
+
+def get_ground(ground):
+    # a Ground for a model's ground argument, or None for free space
+    #   False, 0, None - free space
+    #   True, 1 - the default preset
+    #   a preset name, or an 'epsilon,sigma[,method]' string
+    if hasattr(ground, 'gnType'):
+        return ground
+    if not hasattr(ground, 'split'):
+        return PRESETS[DEFAULT_GROUND] if ground else None
+    if ground in PRESETS:
+        return PRESETS[ground]
+    fields = ground.split(',')
+    if len(fields) not in (2, 3):
+        raise ValueError('unknown ground %r, expected a preset (%s) or epsilon,sigma[,method]' %
+                         (ground, ', '.join(sorted(PRESETS))))
+    return Ground(float(fields[0]), float(fields[1]), fields[2].strip() if len(fields) == 3 else SOMMERFELD)
+
+def ground_sweep(epsilons, sigmas, method = SOMMERFELD):
+    # ground strings for every (epsilon, sigma) pair, to use as the values of a 'ground' sweep parameter
+    return [spec(e, s, gn_type(method)) for e in epsilons for s in sigmas]
@@ -9,12 +9,19 @@
 # TODO:
 # investigate coupling between polarizations.. (add slope to feed lines?)
 
+import os
 import numpy as np
+import profiling
 from nec2utils import *
+from segmentation import SegmentationPolicy
+from ground import get_ground
+from geometry import check_model, snap_junctions, summarize
 
 CENTER_POLE = 6 # pole under which there is a post
 INCHES_PER_M = 39.3701
 FREQ_STEP = 1 # MHz
+ANTENNA_SPACING = 15.24 # m between the antennas of the superdarn main array
+MAX_SEGMENTS = 11000 # segments the nec2dxs11k build run by scheduler.SOLVER is compiled for
 
 NECFILE_FOLDER = './necfiles/'
 
@@ -26,6 +33,8 @@ max_freq = 18e6 # hz
 C = 3e8
 lambda_min = C / max_freq
 dseg = lambda_min / 300 
+# pass to make_lpda_nec to segment each wire for the wavelength it matters at, see segmentation.py
+ADAPTIVE_SEGMENTATION = SegmentationPolicy(max_freq)
 # coordinate system:
 #  ----x--->
 #            \
@@ -80,7 +89,7 @@ def aircoil_inductace(l, d, turns):
     # l - length (meters)
     # d - diameter (meters)
     # turns - number of turns
-    return 0.001 * (turns ** 2) * ((float(d)/2) ** 2) / (114 * d + 254 * l)
+    return 0.001 * (turns ** 2) * ((d / 2.) ** 2) / (114 * d + 254 * l)
 
 def aircoil_resistance(d, turns):
     # returns an *approximate* resistance for an air coil
@@ -88,62 +97,82 @@ def aircoil_resistance(d, turns):
     r = 6e-3 * 2 * np.pi * d * turns
     return r
 
+# wire slots of each lpda element, every wire of the antenna is one (element, slot) pair and
+# wires are added to the model element by element in slot order
+SLOT_FEED0, SLOT_FEED1, SLOT_TERM, SLOT_EXCITE, SLOT_DIPOLE0, SLOT_DIPOLE1, SLOT_CONN0, SLOT_CONN1 = range(8)
+N_SLOTS = 8
+
 # build LPDA, add it to model
-def build_lpda(m, antenna, feed = True):
-    # addWireAutoseg(self, dseg, pt1, pt2)
+@profiling.timed()
+def build_lpda(m, antenna, feed = True, policy = None):
     coil_l, coil_r = antenna.get_endcoil()
     n_elems = antenna.get_nelements()
     feed_radius = antenna.get_feedr()
-    
-    for i in range(n_elems):
-        m.setRadius(feed_radius)
-        f0start, f1start = antenna.get_fstart(i)
-        
-        if i < n_elems - 1:
-            f0stop, f1stop = antenna.get_fstart(i+1)
-            m.addWireAutoseg(dseg, f0start, f0stop)
-            m.addWireAutoseg(dseg, f1start, f1stop)
-
-        if antenna.load and i == n_elems - 2:
-            m.addWireAutoseg(dseg, f0stop, f1stop).loadAtMiddle(coil_l, coil_r)
- 
-        # add excitation point if this is the first element, or terminate
-        if i == 0:
-            if feed:
-                m.addWireAutoseg(dseg, f0start, f1start).feedAtMiddle(antenna.get_feedangle())
-            else:
-                m.addWireAutoseg(dseg, feed_segs, f0start, f1start).loadAtMiddle(0, antenna.get_termz())
-        
-
-        # calculate dipoles 
-        d0start, d0stop, d1start, d1stop = antenna.get_dipoles(i)
-        drad = antenna.get_drad(i)
-        
-        # add dipoles to model
-        m.setRadius(drad)
-        m.addWireAutoseg(dseg, d0start, d0stop)
-        m.addWireAutoseg(dseg, d1start, d1stop)
-       
-        # connect dipoles to feed network
-        m.setRadius(feed_radius)
-
-        # connect dipoles to feed line
-        pcoil_l, pcoil_r = antenna.get_pcoil(i) 
-        
-        if i % 2:
-            if not pcoil_l: 
-                m.addWireAutoseg(dseg, f0start, d0start)
-                m.addWireAutoseg(dseg, f1start, d1start)
-            else:
-                m.addWireAutoseg(dseg, f0start, d0start).loadAtMiddle(pcoil_l, pcoil_r)
-                m.addWireAutoseg(dseg, f1start, d1start).loadAtMiddle(pcoil_l, pcoil_r)
-        else:
-            if not pcoil_l: 
-                m.addWireAutoseg(dseg, f0start, d1start)
-                m.addWireAutoseg(dseg, f1start, d0start)
-            else:
-                m.addWireAutoseg(dseg, f0start, d1start).loadAtMiddle(pcoil_l, pcoil_r)
-                m.addWireAutoseg(dseg, f1start, d0start).loadAtMiddle(pcoil_l, pcoil_r)
+    g = antenna.get_geometry()
+    pcoil_l, pcoil_r = antenna.get_pcoils()
+
+    start = np.zeros((n_elems, N_SLOTS, 3))
+    stop = np.zeros((n_elems, N_SLOTS, 3))
+    radius = np.zeros((n_elems, N_SLOTS)) + feed_radius
+    exists = np.zeros((n_elems, N_SLOTS), dtype = bool)
+    loaded = np.zeros((n_elems, N_SLOTS), dtype = bool)
+    load_l = np.zeros((n_elems, N_SLOTS))
+    load_r = np.zeros((n_elems, N_SLOTS))
+
+    # feed lines between neighbouring elements
+    start[:-1, SLOT_FEED0], stop[:-1, SLOT_FEED0] = g['f0'][:-1], g['f0'][1:]
+    start[:-1, SLOT_FEED1], stop[:-1, SLOT_FEED1] = g['f1'][:-1], g['f1'][1:]
+    exists[:-1, SLOT_FEED0] = exists[:-1, SLOT_FEED1] = True
+
+    # termination coil across the end of the feed lines
+    if antenna.load and n_elems > 1:
+        start[-2, SLOT_TERM], stop[-2, SLOT_TERM] = g['f0'][-1], g['f1'][-1]
+        exists[-2, SLOT_TERM] = loaded[-2, SLOT_TERM] = True
+        load_l[-2, SLOT_TERM], load_r[-2, SLOT_TERM] = coil_l, coil_r
+
+    # excitation point across the feed lines at the first element, or terminate
+    start[0, SLOT_EXCITE], stop[0, SLOT_EXCITE] = g['f0'][0], g['f1'][0]
+    exists[0, SLOT_EXCITE] = True
+    if not feed:
+        loaded[0, SLOT_EXCITE] = True
+        load_l[0, SLOT_EXCITE], load_r[0, SLOT_EXCITE] = 0, antenna.get_termz()
+
+    # dipoles
+    start[:, SLOT_DIPOLE0], stop[:, SLOT_DIPOLE0] = g['d0start'], g['d0stop']
+    start[:, SLOT_DIPOLE1], stop[:, SLOT_DIPOLE1] = g['d1start'], g['d1stop']
+    radius[:, SLOT_DIPOLE0] = radius[:, SLOT_DIPOLE1] = antenna.dipole_radius
+    exists[:, SLOT_DIPOLE0] = exists[:, SLOT_DIPOLE1] = True
+
+    # connect dipoles to feed line, through the feed coils where there are some
+    start[:, SLOT_CONN0], stop[:, SLOT_CONN0] = g['c0start'], g['c0stop']
+    start[:, SLOT_CONN1], stop[:, SLOT_CONN1] = g['c1start'], g['c1stop']
+    exists[:, SLOT_CONN0] = exists[:, SLOT_CONN1] = True
+    for slot in (SLOT_CONN0, SLOT_CONN1):
+        loaded[:, slot] = pcoil_l != 0
+        load_l[:, slot], load_r[:, slot] = pcoil_l, pcoil_r
+
+    # add every wire to the model in one batch, then attach feeds and loads by tag
+    keep = exists.ravel()
+    start, stop, radius = start.reshape(-1, 3)[keep], stop.reshape(-1, 3)[keep], radius.ravel()[keep]
+    tags = np.zeros(n_elems * N_SLOTS, dtype = np.int64)
+    if policy is None:
+        tags[keep] = m.addWiresAutoseg(dseg, start, stop, radius)
+    else:
+        # dipoles are segmented for the wavelength they resonate at, the feed network for the top of the band
+        nominal = np.zeros((n_elems, N_SLOTS)) + policy.feed_length()
+        nominal[:, SLOT_DIPOLE0] = nominal[:, SLOT_DIPOLE1] = policy.element_length(antenna.elem_len)
+        fixed = loaded.copy()
+        fixed[0, SLOT_EXCITE] = True
+        segments, taper, flip = policy.segment(start, stop, radius, nominal.ravel()[keep], fixed.ravel()[keep])
+        start[flip], stop[flip] = stop[flip], start[flip].copy()
+        tags[keep] = m.addWires(segments, start, stop, radius, taper)
+
+    if feed:
+        m.feedAtMiddleOf(tags[[SLOT_EXCITE]], antenna.get_feedangle())
+
+    loads = loaded.ravel()
+    m.loadAtMiddleOf(tags[loads], load_l.ravel()[loads], load_r.ravel()[loads])
+    m.setRadius(feed_radius)
 
 
 class lpda_antenna:
@@ -179,46 +208,64 @@ class lpda_antenna:
         self.feed_coil_l = np.array([0, 0, 0, 0, 0, 0, 0, .5, 1.5, 2.5]) / INCHES_PER_M # inductor coil turns, ~2.2" ODD, 10 AWG wire
         self.load = True
 
+    def get_geometry(self):
+        # returns the endpoints of every feed line, dipole and coil connection of the antenna as
+        # (n_elements, 3) arrays of x, y, z, calculated for all elements in one pass
+        x = np.cumsum(self.elem_space)
+        n_elems = len(x)
+        sin_d, cos_d = np.sin(self.dipole_angle), np.cos(self.dipole_angle)
+        sin_f, cos_f = np.sin(self.feedline_angle), np.cos(self.feedline_angle)
+        g = {}
+
+        # feed line points at each element
+        f0 = np.zeros((n_elems, 3))
+        f1 = np.zeros((n_elems, 3))
+        f0[:, 0] = x + self.feedline_xgap/2 + self.dipole_xoffset
+        f1[:, 0] = x - self.feedline_xgap/2 + self.dipole_xoffset
+
+        f0[:, 1] = self.dipole_yoffset - self.feed_d * sin_f + (self.feed_spacing / 2.) * cos_f
+        f1[:, 1] = self.dipole_yoffset - self.feed_d * sin_f - (self.feed_spacing / 2.) * cos_f
+
+        f0[:, 2] = self.antenna_h + self.dipole_zoffset + self.feed_d * cos_f + (self.feed_spacing / 2.) * sin_f
+        f1[:, 2] = self.antenna_h + self.dipole_zoffset + self.feed_d * cos_f - (self.feed_spacing / 2.) * sin_f
+        g['f0'], g['f1'] = f0, f1
+
+        # dipole halves
+        dx = self.dipole_xoffset + x
+        d0z0 = self.antenna_h + self.dipole_zoffset + self.dipole_gap * sin_d / 2.
+        d1z0 = self.antenna_h + self.dipole_zoffset - self.dipole_gap * sin_d / 2.
+        d0y0 = self.dipole_yoffset + self.dipole_gap * cos_d / 2.
+        d1y0 = self.dipole_yoffset - self.dipole_gap * cos_d / 2.
+
+        dipole_len = self.elem_len / 2. - self.dipole_gap / 2.
+        d0z1 = d0z0 + dipole_len * sin_d
+        d1z1 = d1z0 - dipole_len * sin_d
+        d0y1 = d0y0 + dipole_len * cos_d
+        d1y1 = d1y0 - dipole_len * cos_d
+
+        g['d0start'] = np.column_stack(np.broadcast_arrays(dx, d0y0, d0z0))
+        g['d0stop']  = np.column_stack((dx, d0y1, d0z1))
+        g['d1start'] = np.column_stack(np.broadcast_arrays(dx, d1y0, d1z0))
+        g['d1stop']  = np.column_stack((dx, d1y1, d1z1))
+
+        # connections from the feed lines to the dipoles, crossed over on every other element
+        odd = (np.arange(n_elems) % 2 == 1)[:, np.newaxis]
+        g['c0start'], g['c1start'] = f0, f1
+        g['c0stop'] = np.where(odd, g['d0start'], g['d1start'])
+        g['c1stop'] = np.where(odd, g['d1start'], g['d0start'])
+        return g
+
     def get_fstart(self, i):
-        x = np.cumsum(self.elem_space)[i]
-        f0x = x + self.feedline_xgap/2 + self.dipole_xoffset
-        f1x = x - self.feedline_xgap/2 + self.dipole_xoffset
-        
-        f0y = self.dipole_yoffset - self.feed_d * np.sin(self.feedline_angle) + (self.feed_spacing / 2.) * np.cos(self.feedline_angle)
-        f1y = self.dipole_yoffset - self.feed_d * np.sin(self.feedline_angle) - (self.feed_spacing / 2.) * np.cos(self.feedline_angle)
-            
-        f0z = self.antenna_h + self.dipole_zoffset + self.feed_d * np.cos(self.feedline_angle) + (self.feed_spacing / 2.) * np.sin(self.feedline_angle)
-        f1z = self.antenna_h + self.dipole_zoffset + self.feed_d * np.cos(self.feedline_angle) - (self.feed_spacing / 2.) * np.sin(self.feedline_angle)
-        f0 = Point(f0x, f0y, f0z)
-        f1 = Point(f1x, f1y, f1z)
-        return f0, f1
+        g = self.get_geometry()
+        return Point(*g['f0'][i]), Point(*g['f1'][i])
 
     def get_feedangle(self):
         # returns the phase angle on the excited signal
         return self.feedangle
         
     def get_dipoles(self, i):
-        x = np.cumsum(self.elem_space)[i]
-
-        d0z0 = self.antenna_h + self.dipole_zoffset + self.dipole_gap * np.sin(self.dipole_angle) / 2.
-        d1z0 = self.antenna_h + self.dipole_zoffset - self.dipole_gap * np.sin(self.dipole_angle) / 2. 
-        dx = self.dipole_xoffset + x
-
-        d0y0 = self.dipole_yoffset + self.dipole_gap * np.cos(self.dipole_angle) / 2.
-        d1y0 = self.dipole_yoffset - self.dipole_gap * np.cos(self.dipole_angle) / 2.
-        
-        dipole_len = self.elem_len[i] / 2. - self.dipole_gap / 2.
-        d0z1 = d0z0 + dipole_len * np.sin(self.dipole_angle) 
-        d1z1 = d1z0 - dipole_len * np.sin(self.dipole_angle) 
-
-        d0y1 = d0y0 + dipole_len * np.cos(self.dipole_angle) 
-        d1y1 = d1y0 - dipole_len * np.cos(self.dipole_angle)
-
-        d0start = Point(dx, d0y0, d0z0)
-        d0stop  = Point(dx, d0y1, d0z1)
-        d1start = Point(dx, d1y0, d1z0)
-        d1stop  = Point(dx, d1y1, d1z1)
-        return d0start, d0stop, d1start, d1stop
+        g = self.get_geometry()
+        return Point(*g['d0start'][i]), Point(*g['d0stop'][i]), Point(*g['d1start'][i]), Point(*g['d1stop'][i])
 
     def get_pcoil(self, i):
         if self.feed_coil_l[i] != 0:
@@ -227,6 +274,15 @@ class lpda_antenna:
             return pcoil_l, pcoil_r
         return 0, 0
 
+    def get_pcoils(self):
+        # returns arrays of feed coil inductance and resistance for every element, zero where there is no coil
+        pcoil_l = np.zeros(self.get_nelements())
+        pcoil_r = np.zeros(self.get_nelements())
+        coils = self.feed_coil_l != 0
+        pcoil_l[coils] = aircoil_inductace(self.feed_coil_l[coils], self.feed_coil_d[coils], self.feed_coil_turns[coils])
+        pcoil_r[coils] = aircoil_resistance(self.feed_coil_d[coils], self.feed_coil_turns[coils])
+        return pcoil_l, pcoil_r
+
 
     def get_nelements(self):
         return len(self.elem_len) 
@@ -243,7 +299,17 @@ class lpda_antenna:
         return self.feed_radius
 
 # adds a tower from the ground to boom_z at x boom_center, and a boom from 0 to boom_len
-def add_towerboom(model, boom_z, boom_radius, tower_r, boom_len, boom_center, dseg):
+def add_towerboom(model, boom_z, boom_radius, tower_r, boom_len, boom_center, dseg, policy = None):
+    if policy is not None:
+        start = np.array([[boom_center, 0, boom_z], [boom_center, 0, boom_z], [boom_center, 0, 0]])
+        stop = np.array([[0, 0, boom_z], [boom_len, 0, boom_z], [boom_center, 0, boom_z]])
+        radius = np.array([boom_radius, boom_radius, tower_r])
+        segments, taper, flip = policy.segment(start, stop, radius, policy.structure_length())
+        start[flip], stop[flip] = stop[flip], start[flip].copy()
+        model.addWires(segments, start, stop, radius, taper)
+        model.setRadius(tower_r)
+        return
+
     model.setRadius(boom_radius)
 
     post0 = Point(boom_center, 0, boom_z)
@@ -258,23 +324,32 @@ def add_towerboom(model, boom_z, boom_radius, tower_r, boom_len, boom_center, ds
     post1 = Point(boom_center, 0, boom_z)
     model.addWireAutoseg(dseg, post0, post1)
     
-# create and save a LPDA antenna
-def make_lpda_nec(filename, antennas, usepole = False, ground = 0, folder = NECFILE_FOLDER):
-    comments  = 'CM ---------------------------------------------------\n'
-    comments += 'CM NEC model for sabre 608 log periodic antenna\n'
-    comments += 'CM jon klein, jtklein@alaska.edu\n'
-    comments += 'CM ---------------------------------------------------\n'
-    comments += 'CE\n'
-    
+LPDA_COMMENTS  = 'CM ---------------------------------------------------\n'
+LPDA_COMMENTS += 'CM NEC model for sabre 608 log periodic antenna\n'
+LPDA_COMMENTS += 'CM jon klein, jtklein@alaska.edu\n'
+LPDA_COMMENTS += 'CM ---------------------------------------------------\n'
+LPDA_COMMENTS += 'CE\n'
+
+# patterns most sweeps need: elevation cuts through boresight (phi = 180, with the back lobe at negative theta)
+# and across it, 362 points per frequency instead of the 2701 of the full default pattern
+LPDA_PATTERN_CUTS = [elevationCut(180.), elevationCut(90.)]
+
+# build the model of one or more LPDA antennas, with an optional pole and boom
+# ground is False for free space, True for the default ground, a preset name or a ground.Ground (see ground.py)
+# copies > 1 repeats the whole thing every spacing meters along y, like the main array, and the deck then holds one
+# antenna and a GM card that makes the others. a single antenna's mirror or translational symmetry is looked for
+# with Model.detectSymmetry, so a symmetric model is written as its half and a GX card
+@profiling.timed()
+def build_lpda_model(antennas, usepole = False, ground = 0, policy = None, copies = 1, spacing = ANTENNA_SPACING):
     # dipole information
     post_radius = inch(6.)
     boom_radius = inch(1)
 
 
-    m = Model(0, ground)
+    m = Model(0, get_ground(ground) or 0)
     
     for ant in antennas: 
-        build_lpda(m, ant)
+        build_lpda(m, ant, policy = policy)
 
     # add pole and antenna boom 
     if usepole:
@@ -282,12 +357,113 @@ def make_lpda_nec(filename, antennas, usepole = False, ground = 0, folder = NECF
         boom_len = np.cumsum(antennas[0].elem_space)[-1]
         boom_center = np.cumsum(antennas[0].elem_space)[CENTER_POLE]
         boom_z = antennas[0].antenna_h + BOOM_ZOFFSET
-        add_towerboom(m, boom_z, boom_radius, post_radius, boom_len, boom_center, dseg)
+        add_towerboom(m, boom_z, boom_radius, post_radius, boom_len, boom_center, dseg, policy)
+
+    if copies > 1:
+        m.replicate(copies - 1, Point(0, spacing, 0))
+    else:
+        m.detectSymmetry()
+    # the GM card of an array multiplies the segments nec has to solve, well past what fits nec2dxs11k
+    if m.getSegmentCount() > MAX_SEGMENTS:
+        print('warning: %d segments (%d copies), more than the %d nec2dxs11k can solve' %
+              (m.getSegmentCount(), copies, MAX_SEGMENTS))
+    return m
+
+# file name of frequency shard n of a deck, lpda_vert.nec -> lpda_vert_fr<n>.nec
+def shard_filename(filename, shard):
+    base, ext = os.path.splitext(filename)
+    return '%s_fr%d%s' % (base, shard, ext)
+
+# create and save a nec file, returns the list of files written
+# with shards > 1 the frequency sweep is split into that many decks with disjoint FR ranges (see shard_filename),
+# so one model can be solved on several cores. necout.read_shards merges their results back in frequency order.
+# patterns is the getText radpat argument: True for the full pattern, False for an impedance only deck, or PatternSpecs
+# validate checks the geometry for near miss junctions, overlapping and too closely spaced wires (see geometry.py)
+# and prints what it finds, snap first moves the wire ends of near misses onto each other
+# copies and spacing make an array of the model, see build_lpda_model
+@profiling.timed()
+def make_lpda_nec(filename, antennas, usepole = False, ground = 0, folder = NECFILE_FOLDER, summary = True, policy = None,
+                  shards = 1, patterns = True, validate = True, snap = False, copies = 1, spacing = ANTENNA_SPACING):
+    m = build_lpda_model(antennas, usepole, ground, policy, copies, spacing)
+    if snap:
+        with profiling.stage('snap_junctions'):
+            snap_junctions(m)
+    if validate:
+        with profiling.stage('check_model'):
+            issues = check_model(m)
+        if len(issues):
+            print(filename + ': geometry warning: ' + summarize(issues))
 
     # setup frequency sweep and write card
     steps = ((18 - 8) / FREQ_STEP) + 1
-    cardstack = m.getText(start = 8, stepSize = FREQ_STEP, stepCount = steps)
-    writeCardsToFile(folder + filename, comments, cardstack)
+    sweeps = splitSweep(8, FREQ_STEP, steps, shards)
+    filenames = []
+    for shard, (start, count) in enumerate(sweeps):
+        name = filename if len(sweeps) == 1 else shard_filename(filename, shard)
+        with profiling.stage('getText'):
+            cardstack = m.getText(start = start, stepSize = FREQ_STEP, stepCount = count, radpat = patterns)
+        with profiling.stage('writeCardsToFile'):
+            writeCardsToFile(folder + name, LPDA_COMMENTS, cardstack)
+        filenames.append(name)
+
+    # print segment counts, estimated cost and thin-wire warnings before anyone spends cpu hours on it
+    if summary:
+        label = filename if len(sweeps) == 1 else '%s (%d shards)' % (filename, len(sweeps))
+        print(label + ': ' + m.getCostSummary(steps, max_freq / 1e6, patternPoints(patterns)).rstrip().replace('\n', '\n    '))
+    return filenames
+
+# create and save an impedance only deck over the full sweep (basename_z.nec) and a pattern deck over a coarser
+# sweep (basename_rp.nec), run separately, e.g. for vswr at every FREQ_STEP and patterns every pattern_step MHz
+# returns the two file names
+def make_lpda_pass_necs(basename, antennas, usepole = False, ground = 0, folder = NECFILE_FOLDER, summary = True,
+                        policy = None, patterns = LPDA_PATTERN_CUTS, pattern_step = 2):
+    m = build_lpda_model(antennas, usepole, ground, policy)
+    passes = [('%s_z.nec' % basename, FREQ_STEP, False), ('%s_rp.nec' % basename, pattern_step, patterns)]
+
+    for filename, step, radpat in passes:
+        steps = int(round((18 - 8) / float(step))) + 1
+        cardstack = m.getText(start = 8, stepSize = step, stepCount = steps, radpat = radpat)
+        writeCardsToFile(folder + filename, LPDA_COMMENTS, cardstack)
+        if summary:
+            print(filename + ': ' + m.getCostSummary(steps, max_freq / 1e6, patternPoints(radpat)).rstrip().replace('\n', '\n    '))
+    return [filename for filename, step, radpat in passes]
+
+# create and save one deck per feed port of a multi-antenna model, each exciting only its own port
+# with 1 V while the other ports are shorted. superposition.py combines the results of these runs
+# into any set of port amplitudes and phases (e.g. every feedangle of a dual pol pair) without more nec runs.
+# returns a list of (filename, tag, segment) of each port deck, files are named basename_port<n>.nec
+def make_lpda_port_necs(basename, antennas, usepole = False, ground = 0, folder = NECFILE_FOLDER, summary = True, policy = None):
+    m = build_lpda_model(antennas, usepole, ground, policy)
+    steps = ((18 - 8) / FREQ_STEP) + 1
+    tags, segments = m.getPorts()
+
+    ports = []
+    for port in range(len(tags)):
+        filename = '%s_port%d.nec' % (basename, port)
+        cardstack = m.getText(start = 8, stepSize = FREQ_STEP, stepCount = steps, port = port)
+        writeCardsToFile(folder + filename, LPDA_COMMENTS, cardstack)
+        ports.append((filename, int(tags[port]), int(segments[port])))
+
+    if summary:
+        print('%s_port*.nec: %d ports, each ' % (basename, len(ports)) +
+              m.getCostSummary(steps, max_freq / 1e6).rstrip().replace('\n', '\n    '))
+    return ports
+
+# create and save one deck that solves every port of a multi-antenna model at each frequency, for the
+# port coupling (Z, Y and S) matrix. each frequency is an FR card followed by an EX and XQ group per port,
+# so nec factors the interaction matrix once per frequency instead of once per port deck.
+# read the result with coupling.PortMatrix.from_out
+def make_lpda_coupling_nec(filename, antennas, usepole = False, ground = 0, folder = NECFILE_FOLDER, summary = True, policy = None):
+    m = build_lpda_model(antennas, usepole, ground, policy)
+    steps = ((18 - 8) / FREQ_STEP) + 1
+    freqs = 8 + FREQ_STEP * np.arange(steps)
+
+    writeCardsToFile(folder + filename, LPDA_COMMENTS, m.getPortMatrixText(freqs))
+
+    if summary:
+        print('%s: %d ports, ' % (filename, len(m.getPorts()[0])) +
+              m.getCostSummary(steps, max_freq / 1e6).rstrip().replace('\n', '\n    '))
+    return filename
 
 
 if __name__ == '__main__':
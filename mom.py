@@ -0,0 +1,454 @@
+# jon klein
+# jtklein@alaska.edu
+# thin-wire method of moments solver in numpy, for quick impedance sweeps without nec
+#
+# every run used to go through nec2dxs under wine (simulate.sh), with its process startup and ~1 gb
+# of static arrays per job. MomSolver solves a Model in process: the segments of Model.getSegments
+# are joined into nodes the way nec connects them (geometry.junctions), the current is expanded in
+# triangle functions over the two segments on either side of every node (one per extra wire at a
+# junction, a half triangle into a perfect ground), and the mixed potential integral equation is
+# tested with the same functions (galerkin) using the reduced thin-wire kernel. the 1/R part of the
+# kernel is integrated over each source segment in closed form and only the smooth rest by gauss
+# quadrature, so the self and neighbour terms need no special cases.
+#
+# the distances and closed form integrals depend only on the geometry, they are computed once and
+# reused at every frequency (kept in memory up to cache_bytes). EX cards apply their voltage as a
+# uniform field along the fed segment and LD cards spread their series RL impedance along the
+# loaded segment, and the input current is the current at the segment's middle, as in nec. free space and perfect ground (by image) are supported, a finite ground
+# can be approximated as perfect with approximate_ground. a solve returns the same tables as
+# necout.read_out, so code reading nec output can take either.
+#
+# usage:
+#   s = MomSolver(build_lpda_model([horiz], usepole = True, ground = 'perfect'))
+#   r = s.solve(np.arange(8, 19), LPDA_PATTERN_CUTS)
+#   r['inputs']['impedance'], r['pattern']['total_db']
+#   adaptive_sweep(s, 8, 18)  # port impedances and gain toward s.direction, like adaptivesweep.NecSolver
+#
+# command line, solving the sweeps of a deck and comparing with nec's output of it if one is given:
+#   python2 mom.py necfiles/lpda_horiz.nec [out/lpda_horiz.nec.out]
+
+import sys
+import numpy as np
+import necout
+import profiling
+from nec2utils import PatternSpec, patternList
+from geometry import junctions, CONNECT_TOLERANCE
+from ground import PERFECT
+
+C0 = 299792458.
+MU0 = 4e-7 * np.pi
+EPS0 = 1. / (MU0 * C0 ** 2)
+ETA0 = MU0 * C0
+
+# gauss points per segment, on both the observation and the source segment
+QUADRATURE = 3
+# geometry terms of the matrix fill kept between frequencies, bytes
+CACHE_BYTES = 1e9
+# working memory of one block of the matrix fill, bytes
+BLOCK_BYTES = 64e6
+# pattern points evaluated at once
+PATTERN_BLOCK = 512
+# gain (dB) nec prints where there is no field, e.g. below a ground plane
+NO_GAIN = -999.99
+
+def arcsinh_diff(x1, x2):
+    # asinh(x2) - asinh(x1) for x1 <= x2, without the cancellation of two large values of the same sign
+    flip = x2 < 0
+    a, b = np.where(flip, -x2, x1), np.where(flip, -x1, x2)
+    ha, hb = np.sqrt(a * a + 1), np.sqrt(b * b + 1)
+    # log((b + hb) / (a + ha)), where b + hb - a - ha = (b - a) (1 + (a + b) / (ha + hb))
+    ratio = np.log1p((b - a) * (1 + (a + b) / (ha + hb)) / (a + ha))
+    return np.where(a >= 0, ratio, np.arcsinh(b) - np.arcsinh(a))
+
+def segment_index(tag, seg, want_tag, want_seg):
+    # index into the segment arrays of each (want_tag, want_seg)
+    scale = int(seg.max()) + 1 if len(seg) else 1
+    key = tag * scale + seg
+    order = np.argsort(key, kind = 'mergesort')
+    want = np.asarray(want_tag) * scale + np.asarray(want_seg)
+    pos = np.minimum(np.searchsorted(key[order], want), len(key) - 1) if len(key) else np.zeros(len(want), int)
+    found = (key[order][pos] == want) & (np.asarray(want_seg) < scale) if len(key) else np.zeros(len(want), bool)
+    if not np.all(found):
+        bad = np.nonzero(~found)[0][0]
+        raise ValueError('no segment %d on tag %d' % (np.asarray(want_seg)[bad], np.asarray(want_tag)[bad]))
+    return order[pos]
+
+class MomSolver:
+    def __init__(self, model, quadrature = QUADRATURE, cache_bytes = CACHE_BYTES, approximate_ground = False,
+                 connect = CONNECT_TOLERANCE, direction = (70., 180.)):
+        # prepare a Model for solving, its geometry, feeds and loads are read now
+        #   approximate_ground - solve a model over a finite ground as if the ground were perfect, instead of failing
+        #   direction - (theta, phi) in degrees of the gain __call__ returns
+        ground = model.ground
+        if ground is not None and ground.gnType != PERFECT or ground is None and model.gpflag:
+            if not approximate_ground:
+                raise ValueError('only free space and perfect ground can be solved, pass approximate_ground = True '
+                                 'to treat the finite ground as perfect')
+        self.image = ground is not None or bool(model.gpflag)
+        self.direction = direction
+        self.cache_bytes = cache_bytes
+        self.u, self.w = np.polynomial.legendre.leggauss(quadrature)
+        self.u, self.w = (self.u + 1) / 2., self.w / 2.
+
+        tag, seg, start, stop, radius = model.getSegments()
+        self.tags, self.segments = tag, seg
+        ports, loads = model.excitations.rows(), model.loads.rows()
+        self.port_tag, self.port_segment = ports['tag'].copy(), ports['segment'].copy()
+        self.port_voltage = np.exp(1j * np.deg2rad(ports['angle']))
+        self.port_at = segment_index(tag, seg, ports['tag'], ports['segment'])
+        self.load_at = segment_index(tag, seg, loads['tag'], loads['segment'])
+        self.load_r, self.load_l = loads['r'].copy(), loads['l'].copy()
+
+        self.start, self.stop, self.radius = start, stop, radius
+        self.vec = stop - start
+        self.length = np.sqrt(np.sum(self.vec ** 2, axis = 1))
+        self.unit = self.vec / self.length[:, np.newaxis]
+        self.make_bases(connect)
+        self.geometry = None
+
+    def make_bases(self, connect):
+        # triangle functions over every node, halves[0] flows into the node and halves[1] out of it
+        n = len(self.start)
+        node = np.concatenate(junctions(self.start, self.stop, connect))
+        end = np.lexsort((np.arange(2 * n), node))
+        group = np.concatenate(([True], node[end][1:] != node[end][:-1]))
+        first_end = end[np.maximum.accumulate(np.where(group, np.arange(2 * n), 0))]
+
+        z = np.concatenate((self.start[:, 2], self.stop[:, 2]))
+        length = np.concatenate((self.length, self.length))
+        grounded = np.zeros(2 * n, dtype = bool)
+        if self.image:
+            # ends on the ground plane, every wire there gets a half triangle into its image
+            on_ground = np.abs(z) <= connect * length
+            grounded[np.unique(node[on_ground])] = True
+            grounded = grounded[node]
+
+        # each other end of a node pairs with its first end, a grounded end stands alone
+        pair = ~group & ~grounded[end]
+        into = np.concatenate((first_end[pair], end[grounded[end]]))
+        out = np.concatenate((end[pair], -np.ones(np.count_nonzero(grounded), dtype = np.int64)))
+        self.node = node[into]
+
+        # a half triangle on the segment of end e: rising toward its stop, falling away from its start
+        #   seg, rise (shape u or 1 - u), sign (+1 along the segment, -1 against it, 0 for no half)
+        def halves(e, direction):
+            present = e >= 0
+            e = np.where(present, e, 0)
+            rise = e >= n
+            sign = np.where(rise, 1., -1.) * direction * present
+            return e % n, rise, sign
+        self.halves = [halves(into, 1.), halves(out, -1.)]
+
+    def basis_count(self):
+        return len(self.node)
+
+    # -------------------------------------------------------------------------------------------
+    # matrix fill
+    # -------------------------------------------------------------------------------------------
+
+    def block_geometry(self, rows, image):
+        # frequency independent terms of observation segments rows against every source segment:
+        # closed form integrals of 1/R and (s / L) / R over each source, and the distances to its gauss points
+        start, unit = self.start, self.unit
+        if image:
+            start, unit = start * [1, 1, -1], unit * [1, 1, -1]
+        L = self.length
+        obs = self.start[rows, np.newaxis] + self.u[np.newaxis, :, np.newaxis] * self.vec[rows, np.newaxis]
+        d = obs[:, :, np.newaxis] - start[np.newaxis, np.newaxis]
+        z0 = np.einsum('bqnk,nk->bqn', d, unit)
+        rho2 = np.maximum(np.einsum('bqnk,bqnk->bqn', d, d) - z0 ** 2, 0.) + self.radius ** 2
+        rho = np.sqrt(rho2)
+        i0 = arcsinh_diff(-z0 / rho, (L - z0) / rho)
+        r0, rl = np.sqrt(z0 ** 2 + rho2), np.sqrt((L - z0) ** 2 + rho2)
+        i1 = (L * (L - 2 * z0) / (r0 + rl) + z0 * i0) / L
+        r = np.sqrt((L[:, np.newaxis] * self.u - z0[..., np.newaxis]) ** 2 + rho2[..., np.newaxis])
+        return i0, i1, r
+
+    def blocks(self):
+        # (rows, geometry terms of the direct and the image sources) of every block of observation segments,
+        # cached when they fit in cache_bytes
+        if self.geometry is not None:
+            for block in self.geometry:
+                yield block
+            return
+        n, q = len(self.start), len(self.u)
+        size = max(1, int(BLOCK_BYTES // (q * q * n * 24)))
+        passes = 2 if self.image else 1
+        keep = n * q * n * (q + 2) * 8 * passes <= self.cache_bytes
+        cached = []
+        for first in range(0, n, size):
+            rows = np.arange(first, min(n, first + size))
+            block = (rows, [self.block_geometry(rows, image) for image in range(passes)])
+            if keep:
+                cached.append(block)
+            yield block
+        if keep:
+            self.geometry = cached
+
+    def segment_integrals(self, k):
+        # integrals of the kernel times 1, u, v and u v (u along the observation and v along the source segment)
+        # over every pair of segments, (4, n, n) for the direct sources and the images
+        n = len(self.start)
+        passes = 2 if self.image else 1
+        j = np.zeros((passes, 4, n, n), dtype = np.complex128)
+        wu = self.w * self.u
+        for rows, terms in self.blocks():
+            lobs = self.length[rows, np.newaxis]
+            for p, (i0, i1, r) in enumerate(terms):
+                smooth = (np.exp(-1j * k * r) - 1) / r
+                s0 = (i0 + self.length * smooth.dot(self.w)) / (4 * np.pi)
+                s1 = (i1 + self.length * smooth.dot(wu)) / (4 * np.pi)
+                j[p, 0, rows] = lobs * np.einsum('bqn,q->bn', s0, self.w)
+                j[p, 1, rows] = lobs * np.einsum('bqn,q->bn', s0, wu)
+                j[p, 2, rows] = lobs * np.einsum('bqn,q->bn', s1, self.w)
+                j[p, 3, rows] = lobs * np.einsum('bqn,q->bn', s1, wu)
+        return j
+
+    def matrix(self, freq):
+        # impedance matrix of the triangle functions at freq (MHz), loads included
+        omega = 2 * np.pi * freq * 1e6
+        k = omega / C0
+        j = self.segment_integrals(k)
+        # vector potential integrals for an observation half of shape (a + b u) and a source half (c + d v),
+        # indexed by rise: falling halves are 1 - u, rising ones u
+        shape = [[None, None], [None, None]]
+        phi = j[0, 0].copy()
+        unit = self.unit
+        dots = [unit.dot(unit.T)]
+        if self.image:
+            # image currents flow along the mirrored segment with the opposite sign, their charges are opposite too
+            dots.append(unit.dot((unit * [1, 1, -1]).T))
+            phi -= j[1, 0]
+        for obs_rise in (0, 1):
+            for src_rise in (0, 1):
+                total = 0
+                for p, dot in enumerate(dots):
+                    j00, j10, j01, j11 = j[p]
+                    if obs_rise and src_rise:
+                        f = j11
+                    elif obs_rise:
+                        f = j10 - j11
+                    elif src_rise:
+                        f = j01 - j11
+                    else:
+                        f = j00 - j10 - j01 + j11
+                    total = total + (dot * f if p == 0 else -dot * f)
+                shape[obs_rise][src_rise] = total
+        del j
+
+        nb = self.basis_count()
+        z = np.zeros((nb, nb), dtype = np.complex128)
+        for seg_m, rise_m, sign_m in self.halves:
+            div_m = sign_m * np.where(rise_m, 1., -1.) / self.length[seg_m]
+            for seg_n, rise_n, sign_n in self.halves:
+                div_n = sign_n * np.where(rise_n, 1., -1.) / self.length[seg_n]
+                a = np.zeros((nb, nb), dtype = np.complex128)
+                for obs_rise in (0, 1):
+                    for src_rise in (0, 1):
+                        m = np.nonzero(rise_m == obs_rise)[0]
+                        n = np.nonzero(rise_n == src_rise)[0]
+                        if len(m) and len(n):
+                            a[np.ix_(m, n)] = shape[obs_rise][src_rise][np.ix_(seg_m[m], seg_n[n])]
+                z += 1j * omega * MU0 * np.outer(sign_m, sign_n) * a
+                z -= 1j / (omega * EPS0) * np.outer(div_m, div_n) * phi[np.ix_(seg_m, seg_n)]
+        self.add_loads(z, omega)
+        return z
+
+    def add_loads(self, z, omega):
+        # series RL loads spread along their segments: the integral of the load impedance over the segment length
+        # times the two halves' shapes, 1 / 3 for halves of the same shape and 1 / 6 for a rising and a falling one
+        n = len(self.start)
+        load = np.zeros(n, dtype = np.complex128)
+        np.add.at(load, self.load_at, self.load_r + 1j * omega * self.load_l)
+        basis, seg, rise, sign = [], [], [], []
+        for s, r, g in self.halves:
+            on = np.nonzero((load[s] != 0) & (g != 0))[0]
+            basis.append(on)
+            seg.append(s[on])
+            rise.append(r[on])
+            sign.append(g[on])
+        basis, seg, rise, sign = [np.concatenate(x) for x in (basis, seg, rise, sign)]
+        m, k = np.nonzero(seg[:, np.newaxis] == seg[np.newaxis])
+        overlap = np.where(rise[m] == rise[k], 1 / 3., 1 / 6.)
+        np.add.at(z, (basis[m], basis[k]), load[seg[m]] * sign[m] * sign[k] * overlap)
+
+    def excitation(self, port = None):
+        # right hand side of the sources, all EX cards or only the one numbered port with 1 V, and their voltages
+        # a source's field V / L along its segment tests to V / 2 with each half triangle on it
+        volts = self.port_voltage if port is None else (np.arange(len(self.port_at)) == port).astype(complex)
+        field = np.zeros(len(self.start), dtype = np.complex128)
+        np.add.at(field, self.port_at, volts)
+        v = np.zeros(self.basis_count(), dtype = np.complex128)
+        for seg, rise, sign in self.halves:
+            v += .5 * sign * field[seg]
+        return v, volts
+
+    # -------------------------------------------------------------------------------------------
+    # results
+    # -------------------------------------------------------------------------------------------
+
+    def segment_currents(self, coef):
+        # current of every segment piece as the amplitudes of its rising (u) and falling (1 - u) parts
+        n = len(self.start)
+        rising, falling = np.zeros(n, dtype = complex), np.zeros(n, dtype = complex)
+        for seg, rise, sign in self.halves:
+            np.add.at(rising, seg[rise], sign[rise] * coef[rise])
+            np.add.at(falling, seg[~rise], sign[~rise] * coef[~rise])
+        return rising, falling
+
+    def currents_table(self, coef, freq):
+        # CURRENT_DTYPE rows at the middle of every segment of the model, distances in wavelengths as nec prints them
+        wavelength = C0 / (freq * 1e6)
+        rows = np.zeros(len(self.start), dtype = necout.CURRENT_DTYPE)
+        rows['segment'], rows['tag'] = np.arange(1, len(self.start) + 1), self.tags
+        rows['x'], rows['y'], rows['z'] = ((self.start + self.stop) / (2 * wavelength)).T
+        rows['length'] = self.length / wavelength
+        rows['current'] = self.middle_currents(coef)
+        return rows
+
+    def middle_currents(self, coef):
+        # current at the middle of every segment
+        rising, falling = self.segment_currents(coef)
+        return (rising + falling) / 2.
+
+    def far_field(self, coef, k, theta, phi):
+        # r E_theta and r E_phi (volts) toward every (theta, phi) in degrees
+        rising, falling = self.segment_currents(coef)
+        # current, direction and position at every gauss point of every segment
+        current = (rising[:, np.newaxis] * self.u + falling[:, np.newaxis] * (1 - self.u)) * self.w
+        current = (current * self.length[:, np.newaxis]).ravel()
+        points = (self.start[:, np.newaxis] + self.u[np.newaxis, :, np.newaxis] * self.vec[:, np.newaxis]).reshape(-1, 3)
+        unit = np.repeat(self.unit, len(self.u), axis = 0)
+        sources = [(points, unit * current[:, np.newaxis])]
+        if self.image:
+            sources.append((points * [1, 1, -1], -unit * [1, 1, -1] * current[:, np.newaxis]))
+
+        th, ph = np.deg2rad(theta), np.deg2rad(phi)
+        st, ct, sp, cp = np.sin(th), np.cos(th), np.sin(ph), np.cos(ph)
+        r_hat = np.column_stack((st * cp, st * sp, ct))
+        theta_hat = np.column_stack((ct * cp, ct * sp, -st))
+        phi_hat = np.column_stack((-sp, cp, np.zeros(len(th))))
+        field = np.zeros((len(th), 3), dtype = complex)
+        for first in range(0, len(th), PATTERN_BLOCK):
+            block = slice(first, first + PATTERN_BLOCK)
+            for pts, moment in sources:
+                field[block] += np.exp(1j * k * r_hat[block].dot(pts.T)).dot(moment)
+        omega = k * C0
+        field *= -1j * omega * MU0 / (4 * np.pi)
+        e_theta, e_phi = np.sum(field * theta_hat, axis = 1), np.sum(field * phi_hat, axis = 1)
+        if self.image:
+            # nothing below a perfect ground
+            below = ct < -1e-9
+            e_theta[below], e_phi[below] = 0, 0
+        return e_theta, e_phi
+
+    def pattern_table(self, coef, k, input_power, radpat):
+        # PATTERN_DTYPE rows of the RP points of radpat, gains relative to the input power as nec's power gain
+        specs = patternList(radpat)
+        if not specs:
+            return None
+        angles = [spec.getAngles() for spec in specs]
+        theta = np.concatenate([a[0] for a in angles])
+        phi = np.concatenate([a[1] for a in angles])
+        e_theta, e_phi = self.far_field(coef, k, theta, phi)
+        rows = np.zeros(len(theta), dtype = necout.PATTERN_DTYPE)
+        rows['theta'], rows['phi'] = theta, phi
+        rows['e_theta'], rows['e_phi'] = e_theta, e_phi
+        scale = 4 * np.pi / (2 * ETA0 * input_power) if input_power > 0 else 0.
+        with np.errstate(divide = 'ignore'):
+            for name, power in (('vert_db', np.abs(e_theta) ** 2), ('hor_db', np.abs(e_phi) ** 2),
+                                ('total_db', np.abs(e_theta) ** 2 + np.abs(e_phi) ** 2)):
+                gain = 10 * np.log10(power * scale)
+                rows[name] = np.where(power * scale > 0, np.maximum(gain, NO_GAIN), NO_GAIN)
+        # polarization ellipse from the stokes parameters, right handed when s3 > 0 (IEEE, exp(j w t))
+        s0 = np.abs(e_theta) ** 2 + np.abs(e_phi) ** 2
+        s1 = np.abs(e_theta) ** 2 - np.abs(e_phi) ** 2
+        cross = e_theta * np.conj(e_phi)
+        s3 = np.where(s0 > 0, 2 * cross.imag / np.where(s0 > 0, s0, 1.), 0.)
+        rows['axial_ratio'] = np.abs(np.tan(np.arcsin(np.clip(s3, -1., 1.)) / 2.))
+        rows['tilt'] = np.rad2deg(np.arctan2(2 * cross.real, s1)) / 2.
+        rows['sense'] = np.where(rows['axial_ratio'] < 1e-5, 0, np.where(s3 > 0, 1, 2))
+        return rows
+
+    def solve_frequency(self, freq, radpat = False, port = None, currents = False):
+        # solve one frequency (MHz), returns a dict like one frequency of necout.iter_frequencies
+        k = 2 * np.pi * freq * 1e6 / C0
+        v, volts = self.excitation(port)
+        with profiling.stage('mom matrix'):
+            z = self.matrix(freq)
+        with profiling.stage('mom solve'):
+            coef = np.linalg.solve(z, v)
+        result = {'freq': freq}
+        inputs = np.zeros(len(self.port_at), dtype = necout.INPUT_DTYPE)
+        inputs['tag'], inputs['segment'] = self.port_tag, self.port_segment
+        inputs['voltage'] = volts
+        inputs['current'] = self.middle_currents(coef)[self.port_at]
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            inputs['impedance'] = inputs['voltage'] / inputs['current']
+            inputs['admittance'] = inputs['current'] / inputs['voltage']
+        inputs['power'] = .5 * np.real(inputs['voltage'] * np.conj(inputs['current']))
+        result['inputs'] = inputs
+        if currents:
+            result['currents'] = self.currents_table(coef, freq)
+        with profiling.stage('mom pattern'):
+            pattern = self.pattern_table(coef, k, inputs['power'].sum(), radpat)
+        if pattern is not None:
+            result['pattern'] = pattern
+        return result
+
+    def port_admittance(self, freq):
+        # short circuit admittance matrix [j, k] at freq (MHz), the current into port j with 1 V on port k and the
+        # other ports shorted. the interaction matrix is factored once and every port is a right hand side of it
+        v = np.column_stack([self.excitation(port)[0] for port in range(len(self.port_at))])
+        with profiling.stage('mom matrix'):
+            z = self.matrix(freq)
+        with profiling.stage('mom solve'):
+            coef = np.linalg.solve(z, v)
+        return np.column_stack([self.middle_currents(c)[self.port_at] for c in coef.T])
+
+    def port_matrix(self, freqs):
+        # port admittance matrices [frequency, j, k] at freqs (MHz), see port_admittance
+        return np.array([self.port_admittance(freq) for freq in np.atleast_1d(freqs)])
+
+    def solve(self, freqs, radpat = False, port = None, currents = False):
+        # solve every frequency (MHz), returns a dict like necout.read_out: 'freq' and (n_freqs, n_rows) tables
+        # 'inputs', and 'pattern' for the RP points of radpat (see Model.getSweepText) and 'currents' if asked for
+        results = [self.solve_frequency(f, radpat, port, currents) for f in np.atleast_1d(freqs)]
+        out = {'freq': np.array([r['freq'] for r in results], dtype = float)}
+        for name in ('inputs', 'pattern', 'currents'):
+            if name in results[0]:
+                out[name] = np.vstack([r[name] for r in results])
+        return out
+
+    def __call__(self, freqs):
+        # port impedances and the total gain (dBi) toward direction, (n_freqs, n_ports + 1), for adaptivesweep
+        theta, phi = self.direction
+        r = self.solve(freqs, PatternSpec(theta, 0., 1, phi, 0., 1))
+        return np.column_stack((r['inputs']['impedance'], r['pattern']['total_db'][:, 0]))
+
+def solve_deck(filename, approximate_ground = False):
+    # solve the sweeps of a nec deck, returns the read_out like result of each FR card
+    from necdeck import read_deck
+    model, sweeps, comments = read_deck(filename)
+    solver = MomSolver(model, approximate_ground = approximate_ground)
+    return [solver.solve(start + step * np.arange(count), radpat) for start, step, count, radpat in sweeps]
+
+def main(argv):
+    if len(argv) not in (1, 2):
+        sys.stderr.write('usage: mom.py DECK [NEC_OUTPUT]\n')
+        return 1
+    results = solve_deck(argv[0], approximate_ground = True)
+    reference = necout.read_out(argv[1], ('inputs',)) if len(argv) == 2 else None
+    for r in results:
+        for freq, inputs in zip(r['freq'], r['inputs']):
+            line = '%8.3f MHz' % freq + ''.join('  %9.3f %+9.3fj' % (z.real, z.imag) for z in inputs['impedance'])
+            if reference is not None:
+                match = np.nonzero(np.isclose(reference['freq'], freq))[0]
+                if len(match):
+                    z = reference['inputs']['impedance'][match[0]]
+                    line += '   nec' + ''.join('  %9.3f %+9.3fj' % (x.real, x.imag) for x in np.atleast_1d(z))
+            print(line)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
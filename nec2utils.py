@@ -7,6 +7,7 @@ Utility code for generating antenna geometry files in nec2 card stack format
 Trivial modifications by Jon Klein (jtklein@alaska.edu)
 '''
 
+import os
 import math
 import numpy as np
 import decimal
@@ -27,6 +28,43 @@ def dec(i):
         return ' ' + str(math.trunc(i))
 
 
+def sciColumn(values):
+        ''' Vectorized sci() over a whole column of floats. Each distinct value is formatted only once; the
+            match is done on the raw float bits so that -0.0 keeps its sign, exactly as sci() prints it.
+        '''
+        values = np.ascontiguousarray(values, dtype=np.float64)
+        uniq, inverse = np.unique(values.view(np.uint64), return_inverse=True)
+        text = np.array([sci(f) for f in uniq.view(np.float64).tolist()], dtype=object)
+        return text[inverse.ravel()]
+
+
+def decColumn(values):
+        ''' Vectorized dec() over a whole column of integers
+        '''
+        values = np.ascontiguousarray(values, dtype=np.int64)
+        uniq, inverse = np.unique(values, return_inverse=True)
+        text = np.array([dec(i) for i in uniq.tolist()], dtype=object)
+        return text[inverse.ravel()]
+
+
+def formatCardLines(names, columns):
+        ''' Join columns of pre-formatted fields into a list of card lines. names is either one card name for every
+            row or a column of card names.
+        '''
+        if not len(columns) or not len(columns[0]):
+                return []
+        if isinstance(names, str):
+                names = [names] * len(columns[0])
+        fmt = '%s' * (len(columns) + 1) + '\n'
+        return [fmt % row for row in zip(names, *columns)]
+
+
+def formatCards(names, columns):
+        ''' Join columns of pre-formatted fields into card lines, see formatCardLines
+        '''
+        return ''.join(formatCardLines(names, columns))
+
+
 # =======================================================================================================
 # Unit conversions... The nec2 engine requires its inputs to be in meters and degrees. Note that these
 # functions are named to denote the pre-conversion units, because I consider those more suitable for
@@ -80,27 +118,211 @@ class Rotation:
         self.rz = float(rz)
 
 
+# =======================================================================================================
+# Geometric transforms, applied to coordinates in NumPy rather than left to GM cards
+# =======================================================================================================
+
+def rotationMatrix(rx, ry, rz):
+    ''' Return the (..., 3, 3) rotation matrices of a GM card rotating by rx, ry and rz degrees. NEC rotates about
+        the X axis first, then Y, then Z. The angles may be arrays of the same shape.
+    '''
+    x, y, z = np.broadcast_arrays(*np.deg2rad([rx, ry, rz]))
+    cx, sx, cy, sy, cz, sz = np.cos(x), np.sin(x), np.cos(y), np.sin(y), np.cos(z), np.sin(z)
+    rows = [[cy * cz, sx * sy * cz - cx * sz, cx * sy * cz + sx * sz],
+            [cy * sz, sx * sy * sz + cx * cz, cx * sy * sz - sx * cz],
+            [    -sy,                sx * cy,                cx * cy]]
+    return np.moveaxis(np.array(rows, dtype = np.float64), (0, 1), (-2, -1))
+
+def rotationAngles(matrix):
+    ''' Return the rx, ry, rz angles in degrees of a GM card with the given rotation matrix (see rotationMatrix)
+    '''
+    matrix = np.asarray(matrix, dtype = np.float64)
+    ry = np.arcsin(np.clip(-matrix[..., 2, 0], -1., 1.))
+    rx = np.arctan2(matrix[..., 2, 1], matrix[..., 2, 2])
+    rz = np.arctan2(matrix[..., 1, 0], matrix[..., 0, 0])
+    return np.rad2deg(rx), np.rad2deg(ry), np.rad2deg(rz)
+
+def transformPoints(points, rotation, translation):
+    ''' Rotate (n, 3) points by a (3, 3) matrix or a (n, 3, 3) stack of them, then translate them, as a GM card does
+    '''
+    points = np.asarray(points, dtype = np.float64)
+    return np.einsum('...ij,...j->...i', rotation, points) + translation
+
+def arcPoints(radius, startAngle, endAngle, segments):
+    ''' Return the (segments + 1, 3) segment ends of a GA card arc, in the X-Z plane with its center at the origin
+    '''
+    angle = np.deg2rad(np.linspace(startAngle, endAngle, int(segments) + 1))
+    return np.column_stack((radius * np.cos(angle), np.zeros(len(angle)), radius * np.sin(angle)))
+
+
+# =======================================================================================================
+# Cost estimation and thin-wire modeling guidelines
+# =======================================================================================================
+
+SPEED_OF_LIGHT = 299792458.0
+BYTES_PER_COMPLEX = 16              # the interaction matrix is double precision complex
+COMPLEX_OPS_PER_SECOND = 1e9        # rough throughput, only used to turn operation counts into seconds
+RP_POINTS = 37 * 73                 # theta x phi points of the pattern requested by rp()
+CARD_CHUNK = 1024                   # wire rows formatted at a time when cards are streamed
+
+# rule -> (comparison, limit) that flags a wire, see the NEC-2 user's guide on segmentation
+THIN_WIRE_RULES = {
+    'segment > 0.1 wavelength'      : ('>', 0.1),   # segments must be short compared to the wavelength
+    'segment < 0.001 wavelength'    : ('<', 1e-3),  # very short segments lose numerical precision
+    'segment/radius < 8'            : ('<', 8.),    # thin-wire kernel error exceeds 1% (2 with the extended kernel)
+    'circumference > 0.1 wavelength': ('>', 0.1),   # the thin-wire approximation needs 2*pi*a << wavelength
+}
+
+
+# =======================================================================================================
+# Radiation pattern requests
+# =======================================================================================================
+
+class PatternSpec:
+    ''' One RP card: nTheta x nPhi far field points starting at (thetaStart, phiStart) in steps of
+        (thetaStep, phiStep) degrees. A deck may request several, e.g. a few elevation cuts, or a dense
+        grid around the main beam on top of a sparse one everywhere else.
+    '''
+    def __init__(self, thetaStart = -90., thetaStep = 5., nTheta = 37, phiStart = 0., phiStep = 5., nPhi = 73):
+        self.thetaStart = thetaStart
+        self.thetaStep  = thetaStep
+        self.nTheta     = int(nTheta)
+        self.phiStart   = phiStart
+        self.phiStep    = phiStep
+        self.nPhi       = int(nPhi)
+
+    def getPointCount(self):
+        return self.nTheta * self.nPhi
+
+    def getAngles(self):
+        ''' Return (theta, phi) arrays of every point, in the order nec prints them (theta varies fastest)
+        '''
+        theta = self.thetaStart + self.thetaStep * np.arange(self.nTheta)
+        phi = self.phiStart + self.phiStep * np.arange(self.nPhi)
+        return np.tile(theta, self.nPhi), np.repeat(phi, self.nTheta)
+
+def fullPattern(step = 5.):
+    ''' Whole sphere above and below the horizon, -90..90 theta at every phi. The default 5 degree grid is the
+        pattern getText has always requested
+    '''
+    return PatternSpec(-90., step, int(round(180. / step)) + 1, 0., step, int(round(360. / step)) + 1)
+
+def elevationCut(phi = 180., thetaStart = -90., thetaStop = 90., step = 1.):
+    ''' Single cut from thetaStart to thetaStop at azimuth phi. Through the full -90..90 range a cut at the
+        boresight azimuth also covers the back lobe (negative theta is the opposite azimuth)
+    '''
+    return PatternSpec(thetaStart, step, int(round((thetaStop - thetaStart) / step)) + 1, phi, 0., 1)
+
+def azimuthCut(theta = 70., phiStart = 0., phiStop = 360., step = 1.):
+    ''' Single conical cut at angle theta from zenith, from phiStart to phiStop
+    '''
+    return PatternSpec(theta, 0., 1, phiStart, step, int(round((phiStop - phiStart) / step)) + 1)
+
+def beamPattern(theta = 70., phi = 180., width = 30., denseStep = 1., sparseStep = 10.):
+    ''' Dense grid of denseStep within +- width / 2 of (theta, phi), on top of a sparse full pattern. Points of
+        the sparse grid inside the dense window are requested twice
+    '''
+    n = int(round(width / denseStep)) + 1
+    dense = PatternSpec(theta - width / 2., denseStep, n, phi - width / 2., denseStep, n)
+    return [fullPattern(sparseStep), dense]
+
+def patternList(radpat):
+    ''' Normalize a getText radpat argument: True is the full default pattern, False or None an impedance only
+        pass without any pattern, otherwise a PatternSpec or a list of them
+    '''
+    if radpat is True:
+        return [fullPattern()]
+    if radpat is False or radpat is None:
+        return []
+    if isinstance(radpat, PatternSpec):
+        return [radpat]
+    return list(radpat)
+
+def patternPoints(radpat):
+    ''' Number of far field points requested per frequency by a getText radpat argument
+    '''
+    return sum(p.getPointCount() for p in patternList(radpat))
+
+
+# =======================================================================================================
+# Card record storage
+# =======================================================================================================
+
+# GW and GA cards share a layout: tag, segments and seven float fields
+#   GW: x1, y1, z1, x2, y2, z2, wire radius
+#   GA: arc radius, start angle, end angle, wire radius, 0, 0, 0
+# a nonzero taper on a GW is the segment length ratio of a GC card following it
+# a nonzero move on a GA is the rx, ry, rz, tx, ty, tz of the GM card following it, that places the arc
+# several rows may share a tag (a tessellated arc), nec numbers segments through all of them in order
+WIRE_CARDS = ('GW', 'GA')
+WIRE_DTYPE = [('card', np.int8), ('tag', np.int64), ('segments', np.int64), ('f', np.float64, (7,)),
+              ('taper', np.float64), ('move', np.float64, (6,))]
+GM_DTYPE   = [('tagIncrement', np.int64), ('newStructures', np.int64), ('f', np.float64, (6,)), ('firstTag', np.int64)]
+EX_DTYPE   = [('tag', np.int64), ('segment', np.int64), ('angle', np.float64)]
+LD_DTYPE   = [('tag', np.int64), ('segment', np.int64), ('r', np.float64), ('l', np.float64)]
+
+class CardArray:
+    ''' Preallocated NumPy record array with one row per card. Capacity doubles when it runs out, so appending
+        n cards costs O(n) overall instead of the O(n^2) of growing one long string.
+    '''
+    def __init__(self, dtype, capacity = 256):
+        self.data  = np.zeros(capacity, dtype = dtype)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def reserve(self, n):
+        ''' Make room for n more rows
+        '''
+        needed = self.count + n
+        if needed > len(self.data):
+            grown = np.zeros(max(needed, 2 * len(self.data)), dtype = self.data.dtype)
+            grown[:self.count] = self.data[:self.count]
+            self.data = grown
+
+    def append(self, row):
+        ''' Append one row given as a tuple in field order
+        '''
+        self.reserve(1)
+        self.data[self.count] = row
+        self.count += 1
+
+    def extend(self, rows):
+        ''' Append a record array of rows with the same dtype
+        '''
+        self.reserve(len(rows))
+        self.data[self.count:self.count + len(rows)] = rows
+        self.count += len(rows)
+
+    def rows(self):
+        ''' View of the rows filled so far
+        '''
+        return self.data[:self.count]
+
+
 # =======================================================================================================
 # Model class
 # =======================================================================================================
 
 class Model:
     def __init__(self, wireRadius, ground = 0):
-        ''' Prepare the model with the given wire radius
+        ''' Prepare the model with the given wire radius. ground is a ground plane flag (the default GN card), or
+            an object with gnType, epsilon and sigma attributes (see ground.Ground) for the GN card parameters
         '''
-        self.wires      = ""
-        self.transforms = ""
+        self.wires      = CardArray(WIRE_DTYPE)
+        self.transforms = CardArray(GM_DTYPE)
+        self.excitations = CardArray(EX_DTYPE, 8)
+        self.loads       = CardArray(LD_DTYPE, 32)
+        # (card, start, copies, tagIncrement, field, rotation, translation) of each GX, GR or GM replication:
+        # wire rows start to start * (copies + 1) are copies of rows 0 to start, see copyStructure
+        self.symmetry    = []
+        # program control cards the model has no structure for (TL, NT, ...), kept verbatim from a parsed deck
+        self.controlCards = []
         self.wireRadius = wireRadius
         self.tag        = 0
-        self.EX_tags     = []
-        self.EX_angles   = []
-        self.EX_segments = []
-        self.LD_tags     = []
-        self.LD_segments = []
-        self.LD_r = []
-        self.LD_l = []
-        self.gpflag = ground
-        self.transformBuffer = ''
+        self.ground     = ground if hasattr(ground, 'gnType') else None
+        self.gpflag     = 1 if self.ground is not None else ground
 
     # ---------------------------------------------------------------------------------------------------
     # Low-level functions to generate nec2 cards
@@ -108,14 +330,6 @@ class Model:
     # Tag & segments have no units. Dimensions are in meters. Angles are in degrees.
     # ---------------------------------------------------------------------------------------------------
 
-    def flushTransformBuffer(self):
-        ''' Used in some song and dance to avoid the edge case that can occur with an arc as the last element
-            My double GM card trick causes a problem if the second GM tries to refer to a tag that doesn't exist
-        '''
-        self.transforms      += self.transformBuffer
-        self.transformBuffer  = ""
-
-
     def gw(self, tag, segments, x1, y1, z1, x2, y2, z2, radius):
         ''' Return the line for a GW card, a wire.
         '''
@@ -136,20 +350,41 @@ class Model:
         ga += sci(notUsed) + sci(notUsed) + "\n"
         return ga
 
-    def gm(self, rotX, rotY, rotZ, trX, trY, trZ, firstTag):
+    def gc(self, ratio, rad1, rad2):
+        ''' Return the line for a GC card, tapering the segment lengths and radius of the preceding GW card.
+            ratio: length of each segment relative to the previous one
+            rad1, rad2: radius of the first and last segment
+        '''
+        gc = "GC" + dec(0) + dec(0)
+        gc += sci(ratio) + sci(rad1) + sci(rad2) + "\n"
+        return gc
+
+    def gm(self, rotX, rotY, rotZ, trX, trY, trZ, firstTag, tagIncrement = 0, newStructures = 0):
         ''' Return the line for a GM card, move (rotate and translate).
             rotX, rotY, and rotZ: angle to rotate around each axis
             trX, trY, and trZ: distance to translate along each axis
             firstTag: first tag# to apply transform to (subseqent tag#'s get it too... like it or not)
+            newStructures: number of copies to make instead of moving the structure, each moved from the one before
+            and with its tags tagIncrement higher
         '''
-        tagIncrement = 0
-        newStructures = 0
         gm = "GM" + dec(tagIncrement) + dec(newStructures)
         gm += sci(rotX) + sci(rotY) + sci(rotZ)
         gm += sci(trX) + sci(trY) + sci(trZ)
         gm += sci(firstTag*1.0) + "\n"
         return gm
 
+    def gx(self, tagIncrement, planes):
+        ''' Return the line for a GX card, reflecting the whole structure in coordinate planes.
+            planes: three digits, a one in the hundreds reflects along X (in the Y-Z plane), tens along Y, units along Z
+        '''
+        return "GX" + dec(tagIncrement) + dec(planes) + "\n"
+
+    def gr(self, tagIncrement, copies):
+        ''' Return the line for a GR card, repeating the whole structure copies times around the Z axis
+            (copies counts the original)
+        '''
+        return "GR" + dec(tagIncrement) + dec(copies) + "\n"
+
     def ge(self):
         ''' Card to "terminate reading of geometry data cards"
         '''
@@ -158,13 +393,14 @@ class Model:
         ge += dec(self.gpflag) + "\n"
         return ge
         
-    def gn(self, gtypeflag = 2):
+    def gn(self, gtypeflag = 2, epsilon = 13, sigma = .005):
         ''' Card to set the ground type"
         '''
         # GN  2  0  0  0  13  .005
-          # Ground plane flag. 0 means no ground plane present.
+          # Ground type. 0 is finite ground (reflection coefficient), 1 perfect, 2 finite (Sommerfeld/Norton)
+          # epsilon: relative dielectric constant, sigma: conductivity in S/m
         gn = "GN"
-        gn += dec(gtypeflag) + dec(0) + dec(0) + dec(0) + sci(13) + sci(.005) + "\n"
+        gn += dec(gtypeflag) + dec(0) + dec(0) + dec(0) + sci(epsilon) + sci(sigma) + "\n"
         return gn
         
     def fr(self, start, stepSize, stepCount):
@@ -210,28 +446,128 @@ class Model:
         ld += sci(F1) + sci(F2) + "\n"
         return ld 
 
-    def rp(self, NTH = 37, NPH = 73):
+    def rp(self, NTH = 37, NPH = 73, THETS = -90, PHIS = 0.0, DTH = 5.0, DPH = 5.0):
         ''' Card to initiate calculation and output of radiation pattern.
         '''
         I1  = 0      # 0 is normal mode: defaults to free-space unless a previous GN card specified a ground plane
-        NTH = 37     # Number of values of theta (angle away from positive Z axis)
-        NPH = 73     # Number of values of phi (angle away from X axis in the XY plane)
+                     # NTH: Number of values of theta (angle away from positive Z axis)
+                     # NPH: Number of values of phi (angle away from X axis in the XY plane)
         I4  = 1000   # Use defaults for some misc output printing options
-        THETS = -90  # Theta start value in degrees
-        PHIS  = 0.0  # Phi start value in degrees
-        DTH   = 5.0 # Delta-theta in degrees
-        DPH   = 5.0 # Delta-phi in degrees
+                     # THETS, PHIS: Theta and phi start values in degrees
+                     # DTH, DPH: Delta-theta and delta-phi in degrees
         rp = "RP"
         rp += dec(I1) + dec(NTH) + dec(NPH) + dec(I4)
         rp += sci(THETS) + sci(PHIS) + sci(DTH) + sci(DPH) + "\n"
         return rp
 
+    def xq(self):
+        ''' Card to execute the solution at the current frequencies without a radiation pattern (impedance only)
+        '''
+        return "XQ" + dec(0) + "\n"
+
+    def patternText(self, radpat = True):
+        ''' Return the RP cards of a getText radpat argument (see patternList), or an XQ card if it asks for no pattern
+        '''
+        patterns = patternList(radpat)
+        if not patterns:
+            return self.xq()
+        return ''.join(self.rp(p.nTheta, p.nPhi, p.thetaStart, p.phiStart, p.thetaStep, p.phiStep) for p in patterns)
+
 
     def en(self):
         ''' Card to mark end of input
         '''
         return "EN\n"
 
+    # ---------------------------------------------------------------------------------------------------
+    # Vectorized card formatting, byte-identical to the single card functions above
+    # ---------------------------------------------------------------------------------------------------
+
+    def wireText(self):
+        ''' Return the GW and GA cards for every wire and arc in tag order, with a GC card after each tapered wire
+            and a GM card after each arc that has to be moved into place
+        '''
+        return ''.join(self.iterWireText())
+
+    def iterWireText(self, chunkRows = CARD_CHUNK):
+        ''' Generate the cards of wireText in blocks of up to chunkRows wire rows, so a large structure is never
+            held as one string. Rows generated by a replication are left to its card and never formatted
+        '''
+        rows = self.wires.rows()
+        emit = np.ones(len(rows), dtype = bool)
+        after = {}
+        for i in np.nonzero(rows['taper'])[0]:
+            after[i] = self.gc(rows['taper'][i], rows['f'][i, 6], rows['f'][i, 6])
+        for i in np.nonzero(rows['move'].any(axis = 1))[0]:
+            after[i] = after.get(i, '') + self.gm(*(tuple(rows['move'][i]) + (rows['tag'][i],)))
+        # rows generated by a replication are left to its card, which follows the rows it copies
+        for card, start, copies, tagIncrement, field, rotation, translation in self.getSymmetry():
+            emit[start:start * (copies + 1)] = False
+            for i in range(start, start * (copies + 1)):
+                after.pop(i, None)
+            if card == 'GX':
+                text = self.gx(tagIncrement, field)
+            elif card == 'GR':
+                text = self.gr(tagIncrement, copies + 1)
+            else:
+                text = self.gm(*(field + (rows['tag'][:start].min(), tagIncrement, copies)))
+            after[start - 1] = after.get(start - 1, '') + text
+        special = np.array(sorted(after), dtype = np.int64)
+
+        for first in range(0, len(rows), chunkRows):
+            last = min(len(rows), first + chunkRows)
+            shown = first + np.nonzero(emit[first:last])[0]
+            block = rows[shown]
+            names = np.array(WIRE_CARDS, dtype = object)[block['card']]
+            # the radius of a tapered wire is given on its GC card, and must be zero on the GW card
+            radius = np.where(block['taper'] != 0, 0.0, block['f'][:, 6])
+            columns = [decColumn(block['tag']), decColumn(block['segments'])]
+            columns += [sciColumn(block['f'][:, j]) for j in range(6)] + [sciColumn(radius)]
+            lines = formatCardLines(names, columns)
+            # cards that follow a row go after the last shown row at or before it
+            prefix = ''
+            for i in special[(special >= first) & (special < last)]:
+                pos = np.searchsorted(shown, i, 'right')
+                if pos:
+                    lines[pos - 1] += after[i]
+                else:
+                    prefix += after[i]
+            text = prefix + ''.join(lines)
+            if text:
+                yield text
+
+    def transformText(self):
+        ''' Return the GM cards of self.transforms, emitted after all wires so each acts on every tag from its firstTag
+        '''
+        rows = self.transforms.rows()
+        columns = [decColumn(rows['tagIncrement']), decColumn(rows['newStructures'])]
+        columns += [sciColumn(rows['f'][:, j]) for j in range(6)]
+        columns += [sciColumn(rows['firstTag'])]
+        return formatCards("GM", columns)
+
+    def exText(self, port = None):
+        ''' Return the EX cards for every feed point, or only the one numbered port (in feeding order) with a unit
+            voltage, leaving the others as plain (shorted) segments
+        '''
+        rows = self.excitations.rows()
+        if port is not None:
+            rows = rows[port:port + 1].copy()
+            rows['angle'] = 0.0
+        angle = np.deg2rad(rows['angle'])
+        zeros = np.zeros(len(rows), dtype = np.int64)
+        columns = [decColumn(zeros), decColumn(rows['tag']), decColumn(rows['segment']), decColumn(zeros)]
+        columns += [sciColumn(np.cos(angle)), sciColumn(np.sin(angle))]
+        return formatCards("EX", columns)
+
+    def ldText(self):
+        ''' Return the LD cards for every series RLC load
+        '''
+        rows = self.loads.rows()
+        zeros = np.zeros(len(rows), dtype = np.int64)
+        columns = [decColumn(zeros), decColumn(rows['tag']), decColumn(rows['segment']), decColumn(rows['segment'])]
+        columns += [sciColumn(rows['r']), sciColumn(rows['l'])]
+        return formatCards("LD", columns)
+
     # ---------------------------------------------------------------------------------------------------
     # High-level geometry functions
     # ---------------------------------------------------------------------------------------------------
@@ -240,8 +576,7 @@ class Model:
         ''' Append a wire, increment the tag number, and return this object to facilitate a chained attachToEX() call
         '''
         self.tag += 1
-        self.wires += self.gw(self.tag, segments, pt1.x, pt1.y, pt1.z, pt2.x, pt2.y, pt2.z, self.wireRadius)
-        self.flushTransformBuffer()
+        self.wires.append((0, self.tag, math.trunc(segments), (pt1.x, pt1.y, pt1.z, pt2.x, pt2.y, pt2.z, self.wireRadius), 0.0, 0.0))
         self.middle = math.trunc(segments/2) + 1
         return self
         
@@ -251,91 +586,535 @@ class Model:
         '''
         dwire = math.sqrt((pt1.x - pt2.x)**2 + (pt1.y - pt2.y) ** 2 + (pt1.z - pt2.z) ** 2)
         segments = math.ceil(dwire / dseg)
-        self.tag += 1
-        self.wires += self.gw(self.tag, segments, pt1.x, pt1.y, pt1.z, pt2.x, pt2.y, pt2.z, self.wireRadius)
-        self.flushTransformBuffer()
-        self.middle = math.trunc(segments/2) + 1
-        return self
+        return self.addWire(segments, pt1, pt2)
 
 
-    def addArc(self, segments, radius, start, end, rotate, translate):
-        ''' Append an arc using a combination of a GA card (radius, start angle, end angle), a GM card to rotate
-            and translate the arc from the origin into it's correct location, and a second GM card to restore the
-            transformation matrix for cards that come after the arc.
+    def addWires(self, segments, pts1, pts2, radius = None, taper = None):
+        ''' Append a batch of wires in one go and return their tag numbers as an array
+            pts1, pts2: (n, 3) arrays of wire endpoints
+            segments, radius: scalars or per-wire arrays, radius defaults to the current wire radius
+            taper: optional per-wire segment length ratio (see gc()), 0 for uniform segments. Note that the middle
+                   segment of a tapered wire is not at the middle of the wire, so don't feed or load one.
+        '''
+        pts1 = np.asarray(pts1, dtype = np.float64).reshape(-1, 3)
+        pts2 = np.asarray(pts2, dtype = np.float64).reshape(-1, 3)
+        n = len(pts1)
+        if radius is None:
+            radius = self.wireRadius
+        rows = np.zeros(n, dtype = WIRE_DTYPE)
+        rows['tag'] = self.tag + 1 + np.arange(n)
+        rows['segments'] = np.trunc(segments)
+        rows['f'][:, 0:3] = pts1
+        rows['f'][:, 3:6] = pts2
+        rows['f'][:, 6] = radius
+        if taper is not None:
+            rows['taper'] = taper
+        if n:
+            self.wires.extend(rows)
+            self.tag += n
+            self.middle = rows['segments'][-1] // 2 + 1
+        return rows['tag']
+
+    def addWiresAutoseg(self, dseg, pts1, pts2, radius = None):
+        ''' Append a batch of wires like addWires, with each wire's segment count calculated using segment distance
+        '''
+        pts1 = np.asarray(pts1, dtype = np.float64).reshape(-1, 3)
+        pts2 = np.asarray(pts2, dtype = np.float64).reshape(-1, 3)
+        d = pts1 - pts2
+        dwire = np.sqrt(d[:, 0] ** 2 + d[:, 1] ** 2 + d[:, 2] ** 2)
+        return self.addWires(np.ceil(dwire / dseg), pts1, pts2, radius)
+
+    def middleSegments(self, tags):
+        ''' Return the middle segment number of each of the given wire tags, counting every row of a tag
+        '''
+        rows = self.wires.rows()
+        total = np.concatenate(([0], np.cumsum(rows['segments'])))
+        segments = total[np.searchsorted(rows['tag'], tags, 'right')] - total[np.searchsorted(rows['tag'], tags, 'left')]
+        return segments // 2 + 1
+
+    def addArc(self, segments, radius, start, end, rotate, translate, tessellate = True):
+        ''' Append an arc of the given radius from the start to the end angle, rotated by rotate (a Rotation, applied
+            about X, then Y, then Z) and then translated by translate from the X-Z plane centered on the origin.
+            With tessellate, the arc goes in as one straight GW segment per arc segment at their final coordinates,
+            all sharing the arc's tag, which is the same geometry nec builds from a GA card. Otherwise it is a GA
+            card followed by the one GM card that places it; emitted right after the GA, that GM only reaches the
+            arc, so the cards that follow are left alone.
         '''
-        # Place the arc in the XZ plane with its center on the origin
         self.tag += 1
-        self.wires += self.ga(self.tag, segments, radius, start, end, self.wireRadius)
-        self.flushTransformBuffer()
-        self.middle = math.trunc(segments/2) + 1
-        # Move the arc to where it's supposed to be (note the tag #)
+        segments = math.trunc(segments)
         r = rotate
         t = translate
-        self.transforms += self.gm(r.rx, r.ry, r.rz, t.x, t.y, t.z, self.tag)
-        # Queue up the transforms to roll back the translation and rotation, using multiple gm cards to ensure
-        # that it really works (see GM card documentation about order of operations). This will restore the normal
-        # coordinate system if any elements are appended to the model after this arc, but the use of tag = n+1
-        # means it could break the nec2 parser if it's included without a GW or GA that actually uses tag n+1. The
-        # point of this buffering nonsense is to avoid triggering that parsing problem.
-        self.transformBuffer += self.gm(  0.0,   0.0,   0.0, -t.x, -t.y, -t.z, self.tag+1)
-        self.transformBuffer += self.gm(  0.0,   0.0, -r.rz,  0.0,  0.0,  0.0, self.tag+1)
-        self.transformBuffer += self.gm(  0.0, -r.ry,   0.0,  0.0,  0.0,  0.0, self.tag+1)
-        self.transformBuffer += self.gm(-r.rx,   0.0,   0.0,  0.0,  0.0,  0.0, self.tag+1)
+        move = (r.rx, r.ry, r.rz, t.x, t.y, t.z)
+        if tessellate:
+            pts = transformPoints(arcPoints(radius, start, end, segments), rotationMatrix(r.rx, r.ry, r.rz), move[3:])
+            rows = np.zeros(segments, dtype = WIRE_DTYPE)
+            rows['tag'] = self.tag
+            rows['segments'] = 1
+            rows['f'][:, 0:3] = pts[:-1]
+            rows['f'][:, 3:6] = pts[1:]
+            rows['f'][:, 6] = self.wireRadius
+            self.wires.extend(rows)
+        else:
+            self.wires.append((1, self.tag, segments, (radius, start, end, self.wireRadius, 0.0, 0.0, 0.0), 0.0, move))
+        self.middle = segments // 2 + 1
         return self
 
+    def transformWires(self, rotate, translate, firstTag = 1):
+        ''' Rotate and translate every wire and arc from firstTag on, as a GM card would, by moving their coordinates.
+            GW ends are transformed directly and the GM placing a GA arc is combined with the new transform.
+        '''
+        rows = self.wires.rows()
+        moved = rows['tag'] >= firstTag
+        rotation = rotationMatrix(rotate.rx, rotate.ry, rotate.rz)
+        translation = np.array([translate.x, translate.y, translate.z])
+        wire = moved & (rows['card'] == WIRE_CARDS.index('GW'))
+        for j in (0, 3):
+            rows['f'][wire, j:j + 3] = transformPoints(rows['f'][wire, j:j + 3], rotation, translation)
+        arc = np.nonzero(moved & (rows['card'] == WIRE_CARDS.index('GA')))[0]
+        if len(arc):
+            move = rows['move'][arc]
+            placed = np.einsum('ij,njk->nik', rotation, rotationMatrix(move[:, 0], move[:, 1], move[:, 2]))
+            rows['move'][arc, 0:3] = np.column_stack(rotationAngles(placed))
+            rows['move'][arc, 3:6] = transformPoints(move[:, 3:6], rotation, translation)
+
+    # ---------------------------------------------------------------------------------------------------
+    # Symmetric replication. The copies are stored as wires like any other, so segment numbers, feeds and
+    # loads work as usual, but are emitted as the one GX, GR or GM card that generates them. nec solves a
+    # structure built by GX or GR reflections and rotations as that many smaller matrices.
+    # ---------------------------------------------------------------------------------------------------
+
+    def imageRows(self, rows, rotation, translation, tagIncrement, copies):
+        ''' Return copies successive images of wire rows, each rotated and translated from the one before with its
+            tags tagIncrement higher
+        '''
+        images = []
+        for k in range(copies):
+            rows = rows.copy()
+            rows['tag'] += tagIncrement
+            for j in (0, 3):
+                rows['f'][:, j:j + 3] = transformPoints(rows['f'][:, j:j + 3], rotation, translation)
+            images.append(rows)
+        return np.concatenate(images) if images else rows[:0]
+
+    def matchesImage(self, start, copies, rotation, translation, tagIncrement):
+        ''' Whether wire rows start to start * (copies + 1) are the images of rows 0 to start
+        '''
+        rows = self.wires.rows()
+        end = start * (copies + 1)
+        if start < 1 or end > len(rows) or (rows['card'][:end] != WIRE_CARDS.index('GW')).any():
+            return False
+        images = self.imageRows(rows[:start], rotation, translation, tagIncrement, copies)
+        generated = rows[start:end]
+        scale = max(1.0, np.abs(rows['f'][:end, 0:6]).max())
+        return bool(np.array_equal(images['tag'], generated['tag']) and
+                    np.array_equal(images['segments'], generated['segments']) and
+                    np.array_equal(images['taper'], generated['taper']) and
+                    np.allclose(images['f'], generated['f'], rtol = 0, atol = 1e-9 * scale))
+
+    def copyStructure(self, card, field, rotation, translation, copies, feeds = True, tagIncrement = None):
+        ''' Append copies successive images of the whole structure, with the loads and (if feeds) the feed points of
+            every copy, and record the card that generates them. Each copy's tags are tagIncrement (by default the
+            current tag count) higher than the one before. Returns the tag increment.
+        '''
+        rows = self.wires.rows()
+        if not len(rows):
+            raise ValueError('there is no structure to replicate')
+        if (rows['card'] != WIRE_CARDS.index('GW')).any():
+            raise ValueError('GA arcs can\'t be replicated, add them with tessellate = True')
+        start = len(rows)
+        if tagIncrement is None:
+            tagIncrement = self.tag
+        self.wires.extend(self.imageRows(rows, rotation, translation, tagIncrement, copies))
+        for cards in (self.loads, self.excitations) if feeds else (self.loads,):
+            original = cards.rows().copy()
+            for k in range(1, copies + 1):
+                shifted = original.copy()
+                shifted['tag'] += k * tagIncrement
+                cards.extend(shifted)
+        self.tag = max(self.tag, int(self.wires.rows()['tag'].max()))
+        self.symmetry.append((card, start, copies, tagIncrement, field, rotation, translation))
+        return tagIncrement
+
+    def reflect(self, axis, feeds = True, tagIncrement = None):
+        ''' Append the mirror image of the whole structure along the 'x', 'y' or 'z' axis (in the Y-Z, X-Z or X-Y plane)
+            with its tags offset by the current tag count, emitted as a GX card. feeds also copies the feed points,
+            the loads are always copied. Returns the tag increment.
+        '''
+        i = 'xyz'.index(axis)
+        if i == 2 and self.gpflag:
+            raise ValueError('a structure over ground can\'t be reflected in the X-Y plane')
+        rotation = np.eye(3)
+        rotation[i, i] = -1.0
+        return self.copyStructure('GX', 10 ** (2 - i), rotation, np.zeros(3), 1, feeds, tagIncrement)
+
+    def rotateCopies(self, copies, feeds = True, tagIncrement = None):
+        ''' Repeat the whole structure to copies evenly spaced angles around the Z axis (copies counts the original),
+            emitted as a GR card. Returns the tag increment of each copy.
+        '''
+        return self.copyStructure('GR', copies, rotationMatrix(0, 0, 360.0 / copies), np.zeros(3), copies - 1, feeds,
+                                  tagIncrement)
+
+    def replicate(self, copies, translate, rotate = None, feeds = True, tagIncrement = None):
+        ''' Append copies of the whole structure, each rotated by rotate and then translated by translate from the one
+            before (an array of identical antennas), emitted as a GM card. Returns the tag increment of each copy.
+        '''
+        r = rotate if rotate is not None else Rotation(0, 0, 0)
+        t = translate
+        field = (r.rx, r.ry, r.rz, t.x, t.y, t.z)
+        return self.copyStructure('GM', field, rotationMatrix(r.rx, r.ry, r.rz), np.array(field[3:]), copies, feeds,
+                                  tagIncrement)
+
+    def getSymmetry(self):
+        ''' Return the recorded replications whose copies are still exact images of what they copied, rows moved since
+            (e.g. by geometry.snap_junctions) are written out as plain wires instead
+        '''
+        return [op for op in self.symmetry if self.matchesImage(op[1], op[2], op[5], op[6], op[3])]
+
+    def getSymmetryOrder(self):
+        ''' Number of sections nec splits the interaction matrix into: the product of the GX and GR replications
+            that finish the structure, nec drops the symmetry when wires are added or moved after them
+        '''
+        order, end = 1, 0
+        for card, start, copies, tagIncrement, field, rotation, translation in self.getSymmetry():
+            if start > end or card == 'GM':
+                order = 1
+            if card != 'GM':
+                order *= copies + 1
+            end = start * (copies + 1)
+        return order if end == len(self.wires) else 1
+
+    def detectSymmetry(self):
+        ''' Declare the symmetry of a model built as explicit wires, if its second half is the mirror image of its first
+            in a coordinate plane (a GX card) or it is a row of identical translated copies (a GM card).
+            Returns the card that will generate the copies, or None.
+        '''
+        rows = self.wires.rows()
+        n = len(rows)
+        if self.symmetry or n < 2:
+            return None
+        half = n // 2
+        for i, axis in enumerate('xy' if self.gpflag else 'xyz'):
+            rotation = np.eye(3)
+            rotation[i, i] = -1.0
+            if n % 2 == 0 and self.matchesImage(half, 1, rotation, np.zeros(3), rows['tag'][half] - rows['tag'][0]):
+                self.symmetry.append(('GX', half, 1, rows['tag'][half] - rows['tag'][0], 10 ** (2 - i), rotation,
+                                      np.zeros(3)))
+                return 'GX'
+        for start in range(1, half + 1):
+            if n % start:
+                continue
+            translation = rows['f'][start, 0:3] - rows['f'][0, 0:3]
+            tagIncrement = rows['tag'][start] - rows['tag'][0]
+            if self.matchesImage(start, n // start - 1, np.eye(3), translation, tagIncrement):
+                field = (0.0, 0.0, 0.0) + tuple(translation)
+                self.symmetry.append(('GM', start, n // start - 1, tagIncrement, field, np.eye(3), translation))
+                return 'GM'
+        return None
+
     def feedAtMiddle(self, angle = 0):
         ''' Attach the EX card feedpoint to the middle segment of the element that was most recently created
         '''
-        self.EX_tags.append(self.tag)
-        self.EX_segments.append(self.middle)
-        self.EX_angles.append(angle)
+        self.excitations.append((self.tag, self.middle, angle))
         
     def loadAtMiddle(self, l, r):
         ''' Attach the LD card loading to the middle segment of the element that was most recently created
         '''
-        self.LD_tags.append(self.tag)
-        self.LD_segments.append(self.middle)
-        self.LD_l.append(l)
-        self.LD_r.append(r)
+        self.loads.append((self.tag, self.middle, r, l))
+
+    def feedAtMiddleOf(self, tags, angles = 0):
+        ''' Attach EX card feedpoints to the middle segments of the given wire tags
+        '''
+        rows = np.zeros(len(tags), dtype = EX_DTYPE)
+        rows['tag'] = tags
+        rows['segment'] = self.middleSegments(tags)
+        rows['angle'] = angles
+        self.excitations.extend(rows)
+
+    def loadAtMiddleOf(self, tags, l, r):
+        ''' Attach LD card loading to the middle segments of the given wire tags
+        '''
+        rows = np.zeros(len(tags), dtype = LD_DTYPE)
+        rows['tag'] = tags
+        rows['segment'] = self.middleSegments(tags)
+        rows['r'] = r
+        rows['l'] = l
+        self.loads.extend(rows)
 
 
 
-    def getText(self, start, stepSize, stepCount, radpat = True):
+    def getText(self, start, stepSize, stepCount, radpat = True, port = None):
+        return self.getSweepText([(start, stepSize, stepCount)], radpat, port)
+
+    def getSweepText(self, sweeps, radpat = True, port = None):
+        ''' Return the card stack with one FR card, and the RP or XQ cards that run it, for each (start, stepSize,
+            stepCount) in sweeps. Single frequencies at arbitrary spacing are sweeps of (freq, 0, 1).
+            radpat is True for the full default pattern, False for impedance only, or a PatternSpec or list of them.
+            A sweep given as (start, stepSize, stepCount, radpat) overrides radpat for that sweep, so one deck can
+            run an impedance only pass over a fine sweep and a pattern pass over a coarse one.
+        '''
+        return ''.join(self.iterSweepText(sweeps, radpat, port))
+
+    def iterSweepText(self, sweeps, radpat = True, port = None, chunkRows = CARD_CHUNK):
+        ''' Generate the card stack of getSweepText in blocks, the wires chunkRows rows at a time, for writing to a
+            file, pipe or solver as it is produced (see writeCardStream)
+        '''
+        for block in self.iterStructureText(self.exText(port), chunkRows):
+            yield block
+
+        for sweep in sweeps:
+            yield self.fr(*sweep[:3]) + self.patternText(sweep[3] if len(sweep) > 3 else radpat)
+        yield self.en()
+
+    def iterStructureText(self, exText, chunkRows = CARD_CHUNK):
+        ''' Generate the wire and transform cards, then GE, GN, the given EX cards, the loads and the control cards,
+            everything of a card stack that comes before its FR cards
+        '''
+        for block in self.iterWireText(chunkRows):
+            yield block
+        yield self.transformText()
         footer = self.ge()
-        if self.gpflag:
+        if self.ground is not None:
+            footer += self.gn(self.ground.gnType, self.ground.epsilon, self.ground.sigma)
+        elif self.gpflag:
             footer += self.gn()
-        for (i,tag) in enumerate(self.EX_tags):
-                footer += self.ex(tag=tag, segment=self.EX_segments[i], angle = self.EX_angles[i])
+        footer += exText
+        footer += self.ldText()
+        footer += ''.join(self.controlCards)
+        yield footer
 
-        for (i, tag) in enumerate(self.LD_tags):
-            footer += self.ld(tag=tag, segment=self.LD_segments[i], r = self.LD_r[i], l = self.LD_l[i])
-            
-        footer += self.fr(start, stepSize, stepCount)
-        
-        if radpat:
-            footer += self.rp()
-        else:
-            footer += self.rp(NTH = 3, NPH = 3)
+    def portExText(self, port):
+        ''' Return EX cards for every feed point, with a unit voltage on the one numbered port and 0 V (a short) on the
+            others, so nec prints the current into every port
+        '''
+        rows = self.excitations.rows()
+        zeros = np.zeros(len(rows), dtype = np.int64)
+        columns = [decColumn(zeros), decColumn(rows['tag']), decColumn(rows['segment']), decColumn(zeros)]
+        columns += [sciColumn((np.arange(len(rows)) == port).astype(float)), sciColumn(np.zeros(len(rows)))]
+        return formatCards("EX", columns)
+
+    def getPortMatrixText(self, freqs):
+        ''' Return a card stack that solves every port at each frequency (MHz) in freqs, for the port admittance
+            matrix (see coupling.py). Each frequency has its own FR card, followed by an EX and XQ group per port,
+            so nec fills and factors the interaction matrix once per frequency and only changes the excitation
+        '''
+        return ''.join(self.iterPortMatrixText(freqs))
 
-        footer += self.en()
-        return self.wires + self.transforms + footer
+    def iterPortMatrixText(self, freqs, chunkRows = CARD_CHUNK):
+        ''' Generate the card stack of getPortMatrixText in blocks, see iterSweepText
+        '''
+        for block in self.iterStructureText('', chunkRows):
+            yield block
+        ports = len(self.excitations.rows())
+        for freq in freqs:
+            yield self.fr(freq, 0, 1) + ''.join(self.portExText(port) + self.xq() for port in range(ports))
+        yield self.en()
 
     def setRadius(self, radius):
         self.wireRadius = radius
 
+    def getPorts(self):
+        ''' Return arrays of the tag and segment of each feed point, in feeding order
+        '''
+        rows = self.excitations.rows()
+        return rows['tag'].copy(), rows['segment'].copy()
+
+    def getWireCount(self):
+        ''' Number of wires and arcs in the model
+        '''
+        return len(self.wires)
+
+    def getSegmentCount(self):
+        ''' Total number of segments in the model, the order of the interaction matrix nec2 has to solve
+        '''
+        return int(self.wires.rows()['segments'].sum())
+
+    def getTagSegments(self):
+        ''' Return arrays of the tag numbers and the segment count of each tag
+        '''
+        rows = self.wires.rows()
+        if not len(rows):
+            return rows['tag'].copy(), rows['segments'].copy()
+        tags, first = np.unique(rows['tag'], return_index = True)
+        return tags, np.add.reduceat(rows['segments'], first)
+
+    def getSegmentLengths(self):
+        ''' Return arrays of the shortest segment length, longest segment length and wire radius of each tag,
+            in meters
+        '''
+        rows = self.wires.rows()
+        f = rows['f']
+        arc = rows['card'] == WIRE_CARDS.index('GA')
+        length = np.sqrt(np.sum((f[:, 3:6] - f[:, 0:3]) ** 2, axis = 1))
+        length[arc] = f[arc, 0] * np.deg2rad(np.abs(f[arc, 2] - f[arc, 1]))
+        radius = np.where(arc, f[:, 3], f[:, 6])
+        n = np.maximum(rows['segments'], 1)
+        shortest = length / n
+        longest = shortest.copy()
+        # tapered wires grow geometrically from the first segment, see gc()
+        r = rows['taper']
+        tapered = (r != 0) & (r != 1)
+        first = length[tapered] * (r[tapered] - 1) / (r[tapered] ** n[tapered] - 1)
+        last = first * r[tapered] ** (n[tapered] - 1)
+        shortest[tapered] = np.minimum(first, last)
+        longest[tapered] = np.maximum(first, last)
+        return shortest, longest, radius
+
+    def getSegments(self):
+        ''' Return the tag, segment number (from 1, counted through every row of a tag), start and end points (n, 3)
+            and radius of every segment, in the order nec numbers them. Tapered wires are split as the GC card does
+            and GA arcs are placed by their GM card.
+        '''
+        rows = self.wires.rows()
+        n = np.maximum(rows['segments'], 1)
+        wire = np.repeat(np.arange(len(rows)), n)
+        k = np.arange(len(wire)) - np.repeat(np.cumsum(n) - n, n)
+        nk = n[wire].astype(np.float64)
+        t0, t1 = k / nk, (k + 1) / nk
+        r = rows['taper'][wire]
+        tapered = (r != 0) & (r != 1)
+        rt, kt, nt = r[tapered], k[tapered], nk[tapered]
+        t0[tapered] = (rt ** kt - 1) / (rt ** nt - 1)
+        t1[tapered] = (rt ** (kt + 1) - 1) / (rt ** nt - 1)
+        f = rows['f'][wire]
+        p1, p2 = f[:, 0:3], f[:, 3:6]
+        start, stop = p1 + t0[:, np.newaxis] * (p2 - p1), p1 + t1[:, np.newaxis] * (p2 - p1)
+        radius = f[:, 6].copy()
+
+        arc = rows['card'][wire] == WIRE_CARDS.index('GA')
+        if arc.any():
+            fa, move = f[arc], rows['move'][wire[arc]]
+            rotation = rotationMatrix(move[:, 0], move[:, 1], move[:, 2])
+            for ends, t in ((start, t0[arc]), (stop, t1[arc])):
+                angle = np.deg2rad(fa[:, 1] + t * (fa[:, 2] - fa[:, 1]))
+                pts = np.column_stack((fa[:, 0] * np.cos(angle), np.zeros(len(angle)), fa[:, 0] * np.sin(angle)))
+                ends[arc] = transformPoints(pts, rotation, move[:, 3:6])
+            radius[arc] = fa[:, 3]
+
+        # segment numbers run on through the rows of a tag
+        tag = rows['tag'][wire]
+        first = np.concatenate(([True], tag[1:] != tag[:-1])) if len(tag) else np.zeros(0, dtype = bool)
+        number = np.arange(len(tag)) - np.maximum.accumulate(np.where(first, np.arange(len(tag)), 0)) + 1
+        return tag, number, start, stop, radius
+
+    def getCostEstimate(self, stepCount, rpPoints = RP_POINTS):
+        ''' Estimate the cost of running the model through nec2 for stepCount frequencies, with a radiation
+            pattern of rpPoints directions at each frequency. Counts are in complex operations.
+        '''
+        n = float(self.getSegmentCount())
+        p = self.getSymmetryOrder()    # with p symmetric sections nec fills n^2/p entries and factors p blocks of n/p
+        fill = n ** 2 / p              # one interaction per matrix entry
+        solve = n ** 3 / 3. / p ** 2   # LU factorization of the complex matrix
+        pattern = n * rpPoints         # every segment current contributes to every far field direction
+        perStep = fill + solve + pattern
+        return {
+            'segments'      : int(n),
+            'wires'         : self.getWireCount(),
+            'symmetry'      : p,
+            'matrixBytes'   : BYTES_PER_COMPLEX * n ** 2 / p,
+            'fillOps'       : fill,
+            'solveOps'      : solve,
+            'patternOps'    : pattern,
+            'opsPerStep'    : perStep,
+            'totalOps'      : perStep * stepCount,
+            'estimatedSeconds': perStep * stepCount / COMPLEX_OPS_PER_SECOND,
+        }
+
+    def getThinWireWarnings(self, maxFreqMHz):
+        ''' Check every wire against the nec2 thin-wire modeling guidelines at the highest frequency to be modeled.
+            Returns a list of (tag, rule, value) for each violation, see THIN_WIRE_RULES.
+        '''
+        wavelength = SPEED_OF_LIGHT / (maxFreqMHz * 1e6)
+        shortest, longest, radius = self.getSegmentLengths()
+        tags = self.wires.rows()['tag']
+        checks = {
+            'segment > 0.1 wavelength'      : longest / wavelength,
+            'segment < 0.001 wavelength'    : shortest / wavelength,
+            'segment/radius < 8'            : shortest / np.maximum(radius, 1e-300),
+            'circumference > 0.1 wavelength': 2 * np.pi * radius / wavelength,
+        }
+        warnings = []
+        for rule, (compare, limit) in sorted(THIN_WIRE_RULES.items()):
+            value = checks[rule]
+            bad = value > limit if compare == '>' else value < limit
+            warnings += [(int(t), rule, float(v)) for t, v in zip(tags[bad], value[bad])]
+        return warnings
+
+    def getCostSummary(self, stepCount, maxFreqMHz, rpPoints = RP_POINTS):
+        ''' Human readable summary of the cost estimate and thin-wire warnings
+        '''
+        cost = self.getCostEstimate(stepCount, rpPoints)
+        tags, segments = self.getTagSegments()
+        text  = "%d wires, %d segments (per tag min %d, max %d)" % (cost['wires'], cost['segments'],
+                    segments.min() if len(segments) else 0, segments.max() if len(segments) else 0)
+        text += ", %d-fold symmetric\n" % cost['symmetry'] if cost['symmetry'] > 1 else "\n"
+        text += "matrix %.1f MB, %.3g ops per frequency (fill %.3g, solve %.3g, pattern %.3g), %d frequencies\n" % (
+                    cost['matrixBytes'] / 1e6, cost['opsPerStep'], cost['fillOps'], cost['solveOps'],
+                    cost['patternOps'], stepCount)
+        text += "estimated %.3g ops, ~%.0f s\n" % (cost['totalOps'], cost['estimatedSeconds'])
+        counts = {}
+        for tag, rule, value in self.getThinWireWarnings(maxFreqMHz):
+            counts[rule] = counts.get(rule, 0) + 1
+        for rule in sorted(counts):
+            text += "warning: %d wires with %s at %g MHz\n" % (counts[rule], rule, maxFreqMHz)
+        return text
+
+# =======================================================================================================
+# Frequency sweeps
+# =======================================================================================================
+
+def splitSweep(start, stepSize, stepCount, shards):
+    ''' Split a linear FR sweep into at most `shards` disjoint sweeps of consecutive steps, as evenly as possible.
+        Returns a list of (start, stepCount) in frequency order, to be emitted as one deck each.
+    '''
+    shards = max(1, min(int(shards), stepCount))
+    counts = [stepCount // shards + (1 if i < stepCount % shards else 0) for i in range(shards)]
+    sweeps = []
+    offset = 0
+    for count in counts:
+        sweeps.append((start + offset * stepSize, count))
+        offset += count
+    return sweeps
+
 # =======================================================================================================
 # File I/O
 # =======================================================================================================
 
 def writeCardsToFile(fileName, comments, cardStack):
-    ''' Write a NEC2 formatted card stack to the output file
+    ''' Write a NEC2 formatted card stack to the output file. An existing file with identical content is left
+        alone, so regenerating an unchanged model doesn't touch its timestamp.
     '''
+    text = comments.strip() + "\n" + cardStack.strip() + "\n"
+    if os.path.isfile(fileName):
+        nec2File = open(fileName,'r')
+        unchanged = nec2File.read() == text
+        nec2File.close()
+        if unchanged:
+            return
     nec2File = open(fileName,'w')
-    nec2File.write(comments.strip() + "\n")
-    nec2File.write(cardStack.strip() + "\n")
+    nec2File.write(text)
     nec2File.close()
 
 
+def iterDeck(comments, cards):
+    ''' Generate a deck in the format of writeCardsToFile from comments and the text blocks of a card stack (e.g.
+        Model.iterSweepText)
+    '''
+    yield comments.strip() + "\n"
+    for block in cards:
+        yield block
+
+
+def writeCardStream(stream, comments, cards):
+    ''' Write a deck to an open file, pipe or process stdin block by block as cards (e.g. Model.iterSweepText)
+        generates it, without ever holding the whole card stack. Returns the number of bytes written
+    '''
+    written = 0
+    for block in iterDeck(comments, cards):
+        stream.write(block)
+        written += len(block)
+    return written
+
+
 def copyCardFileToConsole(fileName):
     ''' Dump the card stack back to the console for a quick sanity check
     '''
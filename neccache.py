@@ -0,0 +1,176 @@
+# jon klein
+# jtklein@alaska.edu
+# content addressed on-disk cache of nec output files
+#
+# each card stack is keyed by a hash of its normalized content (comments dropped, fields
+# whitespace-normalized and numbers in canonical form), so regenerating an unchanged model
+# maps to the same key and its nec run can be skipped. outputs are kept under that key
+# in a cache directory with size based least-recently-used eviction.
+#
+# command line, used by simulate.sh:
+#   python2 neccache.py restore OUTDIR DECK...  - copy cached outputs to OUTDIR/DECK.out, print the decks that still need a run
+#   python2 neccache.py store DECK OUTFILE      - add a finished nec output to the cache
+#   python2 neccache.py evict                   - trim the cache to its size limit
+
+import os
+import sys
+import shutil
+import hashlib
+import tempfile
+
+CACHE_DIR = os.environ.get('NECCACHE_DIR', os.path.expanduser('~/.cache/sabre_nec'))
+CACHE_MAX_BYTES = int(float(os.environ.get('NECCACHE_MAX_BYTES', 10e9)))
+# mixed into every key, change it when the solver changes so old outputs aren't reused
+CACHE_SALT = os.environ.get('NECCACHE_SALT', 'nec2dxs11k')
+
+COMMENT_CARDS = ('CM', 'CE')
+
+def normalize_deck(text):
+    # returns the card stack with comments and blank lines removed, fields separated by single spaces,
+    # card names upper case and numbers in canonical form (so 1, 1.0 and 1.000e0 all match)
+    cards = []
+    for line in text.splitlines():
+        fields = line.replace(',', ' ').split()
+        if not fields or fields[0][:2].upper() in COMMENT_CARDS:
+            continue
+        card = [fields[0].upper()]
+        for field in fields[1:]:
+            try:
+                card.append(repr(float(field)))
+            except ValueError:
+                card.append(field)
+        cards.append(' '.join(card))
+    return '\n'.join(cards) + '\n'
+
+def deck_key(text, salt = CACHE_SALT):
+    # returns the cache key of a card stack
+    h = hashlib.sha256(salt.encode('utf-8'))
+    h.update(normalize_deck(text).encode('utf-8'))
+    return h.hexdigest()
+
+def deck_file_key(filename, salt = CACHE_SALT):
+    with open(filename, 'r') as f:
+        return deck_key(f.read(), salt)
+
+class NecCache:
+    # file name suffix of cached entries
+    SUFFIX = '.out'
+
+    def __init__(self, path = CACHE_DIR, max_bytes = CACHE_MAX_BYTES, salt = CACHE_SALT):
+        # salt is mixed into the keys of decks restored or stored through this cache, see deck_key
+        self.path = path
+        self.max_bytes = max_bytes
+        self.salt = salt
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError:
+                # another process got there first
+                pass
+
+    def entry(self, key):
+        # path of the output file for a key, spread over subdirectories to keep them small
+        return os.path.join(self.path, key[:2], key + self.SUFFIX)
+
+    def contains(self, key):
+        return os.path.isfile(self.entry(key))
+
+    def get(self, key, dest):
+        # copy the cached output for key to dest and mark it recently used, returns False on a miss
+        entry = self.entry(key)
+        try:
+            shutil.copyfile(entry, dest)
+            os.utime(entry, None)
+        except (IOError, OSError):
+            return False
+        return True
+
+    def put(self, key, src):
+        # add the nec output file src to the cache under key, then evict down to the size limit
+        entry = self.entry(key)
+        folder = os.path.dirname(entry)
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                pass
+        # copy to a temporary file and rename, so concurrent readers never see a partial output
+        fd, tmp = tempfile.mkstemp(dir = folder, suffix = '.tmp')
+        os.close(fd)
+        try:
+            shutil.copyfile(src, tmp)
+            os.rename(tmp, entry)
+        except (IOError, OSError):
+            os.remove(tmp)
+            raise
+        self.evict()
+
+    def entries(self):
+        # returns (last use time, size, path) of every cached output
+        found = []
+        for root, dirs, files in os.walk(self.path):
+            for name in files:
+                if not name.endswith(self.SUFFIX):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                found.append((st.st_mtime, st.st_size, path))
+        return found
+
+    def size(self):
+        return sum(size for mtime, size, path in self.entries())
+
+    def evict(self, max_bytes = None):
+        # delete least recently used outputs until the cache fits in max_bytes, returns the bytes freed
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        entries = sorted(self.entries())
+        total = sum(size for mtime, size, path in entries)
+        freed = 0
+        for mtime, size, path in entries:
+            if total - freed <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # already evicted by a concurrent run
+                continue
+            freed += size
+        return freed
+
+def restore(outdir, decks, cache = None):
+    # copy cached outputs of decks to outdir/DECK.out, returns the decks that are not cached
+    if cache is None:
+        cache = NecCache()
+    missing = []
+    for deck in decks:
+        dest = os.path.join(outdir, os.path.basename(deck) + '.out')
+        if not cache.get(deck_file_key(deck, cache.salt), dest):
+            missing.append(deck)
+    return missing
+
+def store(deck, outfile, cache = None):
+    if cache is None:
+        cache = NecCache()
+    cache.put(deck_file_key(deck, cache.salt), outfile)
+
+def main(argv):
+    if len(argv) >= 3 and argv[0] == 'restore':
+        if not os.path.isdir(argv[1]):
+            os.makedirs(argv[1])
+        for deck in restore(argv[1], argv[2:]):
+            print(deck)
+    elif len(argv) == 3 and argv[0] == 'store':
+        store(argv[1], argv[2])
+    elif len(argv) == 1 and argv[0] == 'evict':
+        NecCache().evict()
+    else:
+        sys.stderr.write('usage: neccache.py restore OUTDIR DECK... | store DECK OUTFILE | evict\n')
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,376 @@
+# jon klein
+# jtklein@alaska.edu
+# reads nec decks back into nec2utils Models, and a compact binary format for models
+#
+# parse_deck turns a card stack into a Model (GW/GA/GC/GM/GX/GR/GS geometry, GE/GN ground, EX/LD feeds
+# and loads), the list of sweeps its FR and RP/XQ cards run (see Model.getSweepText) and its comments, so
+# for a deck written by this repo
+#   writeCardsToFile(name, comments, m.getSweepText(sweeps))
+# writes the same file again. decks edited by hand or in 4nec2 are read too: fields may be separated by
+# spaces, tabs or commas or sit in nec's fixed columns, SY symbols and expressions are evaluated and a
+# wire radius may be given as a wire gauge (#12). their geometry comes back exactly, but a GM that moves
+# already placed wires is applied to their coordinates instead of being kept as a card. program control
+# cards the Model has no fields for (TL, NT, EX and LD types other than a unit voltage or a series RL on
+# one segment, ...) are kept verbatim in Model.controlCards. a model has one setup for all its sweeps, so
+# cards that change it after an RP or XQ card are refused, except the EX groups of a port matrix deck
+# (Model.getPortMatrixText) that drive the same sources again: every source some group drives with a unit
+# voltage becomes a feed of the model, in the order of the first group.
+#
+# save_model writes the arrays behind a Model (and optionally its sweeps and comments) to a compressed
+# npz file, load_model reads it back to a Model that emits byte-identical cards.
+#
+# usage:
+#   m, sweeps, comments = read_deck('necfiles/lpda_vert.nec')
+#   m.getTagSegments(), m.excitations.rows()
+#   save_model('lpda_vert.npz', m, sweeps, comments)
+#   m, sweeps, comments = load_model('lpda_vert.npz')
+
+import re
+import ast
+import math
+import operator
+import numpy as np
+import profiling
+from nec2utils import Model, PatternSpec, Point, Rotation, CardArray, EX_DTYPE, WIRE_CARDS, WIRE_DTYPE, patternList, \
+    rotationMatrix, sci, dec
+from ground import Ground, PRESETS
+
+FORMAT_VERSION = 1
+
+# geometry cards that make structure the Model can't hold
+UNSUPPORTED_GEOMETRY = ('GH', 'GF', 'SP', 'SM', 'SC')
+# program control cards that start a calculation of their own, they can't be moved ahead of the FR cards
+UNSUPPORTED_CONTROL = ('NE', 'NH', 'NX', 'WG')
+
+# two numbers run together, only seen in nec's fixed column format
+FIXED_COLUMNS_RE = re.compile(r'\d[eE][-+]?\d+[-+]\d')
+
+# nec's default frequency, for an RP or XQ card before any FR card
+DEFAULT_FREQ = 299.8
+
+SYMMETRY_DTYPE = [('card', 'S2'), ('start', np.int64), ('copies', np.int64), ('tagIncrement', np.int64),
+                  ('field', np.float64, (6,)), ('rotation', np.float64, (3, 3)), ('translation', np.float64, (3,))]
+SWEEP_DTYPE = [('start', np.float64), ('step', np.float64), ('count', np.int64), ('patterns', np.int64)]
+PATTERN_DTYPE = [('thetaStart', np.float64), ('thetaStep', np.float64), ('nTheta', np.int64),
+                 ('phiStart', np.float64), ('phiStep', np.float64), ('nPhi', np.int64)]
+
+OPERATORS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+             ast.Pow: operator.pow, ast.USub: operator.neg, ast.UAdd: operator.pos}
+FUNCTIONS = {'sqr': math.sqrt, 'sqrt': math.sqrt, 'abs': abs, 'exp': math.exp, 'log': math.log,
+             'log10': math.log10, 'int': math.trunc}
+CONSTANTS = {'pi': math.pi}
+
+def evaluate(text, symbols):
+    # value of a SY expression or card field, using the symbols defined so far (names are case insensitive)
+    def value(node):
+        if isinstance(node, ast.Expression):
+            return value(node.body)
+        if isinstance(node, ast.BinOp) and type(node.op) in OPERATORS:
+            return OPERATORS[type(node.op)](value(node.left), value(node.right))
+        if isinstance(node, ast.UnaryOp) and type(node.op) in OPERATORS:
+            return OPERATORS[type(node.op)](value(node.operand))
+        if isinstance(node, ast.Name) and node.id.lower() in symbols:
+            return symbols[node.id.lower()]
+        if isinstance(node, ast.Name) and node.id.lower() in CONSTANTS:
+            return CONSTANTS[node.id.lower()]
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id.lower() in FUNCTIONS
+                and len(node.args) == 1):
+            return FUNCTIONS[node.func.id.lower()](value(node.args[0]))
+        if type(node).__name__ in ('Num', 'Constant'):
+            number = node.n if type(node).__name__ == 'Num' else node.value
+            if isinstance(number, (int, float)) and not isinstance(number, bool):
+                return number
+        raise ValueError('can\'t evaluate %r' % text)
+    try:
+        tree = ast.parse(text.strip().replace('^', '**'), mode = 'eval')
+    except SyntaxError:
+        raise ValueError('can\'t evaluate %r' % text)
+    return float(value(tree))
+
+def wire_gauge_radius(gauge):
+    # radius in meters of an american wire gauge
+    return 0.005 * 92 ** ((36 - gauge) / 39.) * 0.0254 / 2
+
+def field(token, symbols):
+    try:
+        return float(token)
+    except ValueError:
+        if token.startswith('#'):
+            return wire_gauge_radius(float(token[1:]))
+        return evaluate(token, symbols)
+
+def fixed_columns(line):
+    # fields of a card in nec's fixed column format, returns None if the line doesn't parse that way
+    # geometry cards have integers in columns 3-10 and floats 10 wide from 11, the others integers in
+    # columns 3-20 and floats from 21
+    if line[0].upper() == 'G':
+        spans = [(2, 5), (5, 10)] + [(10 + 10 * i, 20 + 10 * i) for i in range(7)]
+    else:
+        spans = [(2, 5), (5, 10), (10, 15), (15, 20)] + [(20 + 10 * i, 30 + 10 * i) for i in range(6)]
+    try:
+        return [float(line[a:b]) if line[a:b].strip() else 0. for a, b in spans if a < len(line)]
+    except ValueError:
+        return None
+
+def card_fields(line, symbols):
+    # numeric fields of a card line, returns the number of fields given and the values padded with zeros to
+    # at least 11. geometry cards have 2 integers and 7 floats, the others 4 integers and 6 floats
+    if FIXED_COLUMNS_RE.search(line):
+        values = fixed_columns(line)
+        if values is None:
+            raise ValueError('malformed card %r' % line)
+    else:
+        values = [field(t, symbols) for t in line[2:].replace(',', ' ').split()]
+    return len(values), values + [0.] * (11 - len(values))
+
+def card_text(name, count, values):
+    # a card in the format Model writes, integer fields first
+    return name + ''.join(dec(v) if i < 4 else sci(v) for i, v in enumerate(values[:count])) + '\n'
+
+def define_symbols(line, symbols):
+    # SY card, name=expression assignments separated by commas
+    for assignment in line[2:].split(','):
+        if assignment.strip():
+            name, expression = assignment.split('=', 1)
+            symbols[name.strip().lower()] = evaluate(expression, symbols)
+
+def voltage_angle(real, imag):
+    # phase in degrees of a unit EX voltage, the one of the equivalent angles that Model.ex prints back the same
+    angle = round(math.degrees(math.atan2(imag, real)) % 360., 9)
+    for candidate in (angle, angle - 360.):
+        a = np.deg2rad(candidate)
+        if sci(np.cos(a)) == sci(real) and sci(np.sin(a)) == sci(imag):
+            return candidate
+    return angle
+
+def place_arc(model, values):
+    # a GM card right after the GA card it moves (Model.addArc with tessellate = False) becomes its placement,
+    # returns False if it does anything else
+    rows = model.wires.rows()
+    if not len(rows) or rows['card'][-1] != WIRE_CARDS.index('GA') or rows['move'][-1].any():
+        return False
+    tagIncrement, copies, its = int(values[0]), int(values[1]), int(round(values[8]))
+    if tagIncrement or copies or its != rows['tag'][-1] or (len(rows) > 1 and rows['tag'][-2] >= its):
+        return False
+    rows['move'][-1] = values[2:8]
+    return True
+
+def move_structure(model, values):
+    # GM card: move the wires from tag ITS on, or add NRPT copies of them
+    rows = model.wires.rows()
+    tagIncrement, copies, its = int(values[0]), int(values[1]), int(round(values[8]))
+    r, t = Rotation(*values[2:5]), Point(*values[5:8])
+    if not copies:
+        moved = rows['tag'] >= its
+        rows['tag'][moved & (rows['tag'] > 0)] += tagIncrement
+        model.transformWires(r, t, its + tagIncrement if its > 0 else its)
+    elif len(rows) and its <= rows['tag'].min():
+        model.replicate(copies, t, r, feeds = False, tagIncrement = tagIncrement)
+    else:
+        source = rows[rows['tag'] >= its]
+        if (source['card'] != WIRE_CARDS.index('GW')).any():
+            raise ValueError('GM copies of GA arcs are not supported')
+        model.wires.extend(model.imageRows(source, rotationMatrix(r.rx, r.ry, r.rz), np.array(values[5:8]),
+                                           tagIncrement, copies))
+    if len(model.wires):
+        model.tag = max(model.tag, int(model.wires.rows()['tag'].max()))
+
+def scale_structure(model, scale):
+    # GS card: scale every dimension of the structure so far
+    rows = model.wires.rows()
+    arc = rows['card'] == WIRE_CARDS.index('GA')
+    rows['f'][~arc] *= scale
+    rows['f'][arc, 0] *= scale
+    rows['f'][arc, 3] *= scale
+    rows['move'][arc, 3:6] *= scale
+
+def parse_deck(text):
+    # parse the text of a nec deck, returns (model, sweeps, comments)
+    #   sweeps - list of (start, stepSize, stepCount, radpat) for Model.getSweepText, radpat a list of PatternSpec
+    #            for the RP cards run at that FR card (empty for XQ)
+    #   comments - the CM and CE lines
+    model = Model(0)
+    sweeps, comments, symbols = [], [], {}
+    frequency, patterns = None, None
+    executed = grounded = False
+    last = None
+    # [tag, segment, angle of a unit voltage (None if 0 V), card text of a 0 V source] of the voltage sources
+    # before the first RP or XQ card, in order
+    sources = []
+    for number, line in enumerate(text.splitlines(), 1):
+        stripped = line.strip()
+        name = stripped[:2].upper()
+        if name in ('CM', 'CE'):
+            comments.append(stripped)
+            continue
+        # 4nec2 comments start with a quote
+        stripped = stripped.split("'")[0].strip()
+        if not stripped:
+            continue
+        try:
+            if name == 'SY':
+                define_symbols(stripped, symbols)
+                continue
+            if name == 'EN':
+                break
+            count, values = card_fields(stripped, symbols)
+        except ValueError as e:
+            raise ValueError('line %d: %s' % (number, e))
+        i1, i2, i3, i4 = [int(v) for v in values[:4]]
+        f = values[4:]
+
+        if name == 'GW':
+            model.wires.append((0, int(values[0]), int(values[1]), values[2:9], 0.0, (0.0,) * 6))
+            if values[8]:
+                model.wireRadius = values[8]
+        elif name == 'GA':
+            model.wires.append((1, int(values[0]), int(values[1]), values[2:6] + [0.0] * 3, 0.0, (0.0,) * 6))
+        elif name == 'GC':
+            row = model.wires.rows()[-1:]
+            if last != 'GW' or values[3] != values[4]:
+                raise ValueError('line %d: GC cards must follow a GW card and give one radius' % number)
+            row['taper'], row['f'][:, 6] = values[2], values[3]
+        elif name == 'GM':
+            if not place_arc(model, values):
+                move_structure(model, values)
+        elif name == 'GX':
+            tagIncrement = i1
+            for axis, digit in (('z', i2 % 10), ('y', i2 // 10 % 10), ('x', i2 // 100)):
+                if digit:
+                    model.reflect(axis, feeds = False, tagIncrement = tagIncrement)
+                    tagIncrement *= 2
+        elif name == 'GR':
+            model.rotateCopies(i2, feeds = False, tagIncrement = i1)
+        elif name == 'GS':
+            scale_structure(model, values[2])
+        elif name == 'GE':
+            model.gpflag = i1
+        elif name in UNSUPPORTED_GEOMETRY + UNSUPPORTED_CONTROL:
+            raise ValueError('line %d: %s cards are not supported' % (number, name))
+        elif name == 'FR':
+            if i1 != 0:
+                raise ValueError('line %d: only linear FR sweeps are supported' % number)
+            frequency, patterns = (f[0], f[1], max(i2, 1)), None
+        elif name in ('RP', 'XQ'):
+            if frequency is None:
+                frequency = (DEFAULT_FREQ, 0.0, 1)
+            if name == 'RP' and i1 != 0:
+                raise ValueError('line %d: only normal mode RP cards are supported' % number)
+            if patterns is None or (name == 'RP' and not patterns):
+                patterns = []
+                sweeps.append(frequency + (patterns,))
+            if name == 'RP':
+                patterns.append(PatternSpec(f[0], f[2], i2, f[1], f[3], i3))
+            executed = True
+        elif name == 'EX' and executed and i1 == 0 and i4 == 0 and (i2, i3) in [(t, g) for t, g, a, c in sources]:
+            # another excitation of the same sources, as in a port matrix deck
+            source = [src for src in sources if (src[0], src[1]) == (i2, i3)][0]
+            if source[2] is None and abs(math.hypot(f[0], f[1]) - 1) < 1e-5:
+                source[2] = voltage_angle(f[0], f[1])
+        elif executed:
+            raise ValueError('line %d: %s after an RP or XQ card, a model has one setup for all its sweeps' %
+                             (number, name))
+        elif name == 'GN':
+            grounded = True
+            if i2:
+                raise ValueError('line %d: GN radial wire screens are not supported' % number)
+            model.ground = Ground(f[0], f[1], i1) if i1 >= 0 else None
+        elif name == 'EX' and i1 == 0 and i4 == 0 and abs(math.hypot(f[0], f[1]) - 1) < 1e-5:
+            model.excitations.append((i2, i3, voltage_angle(f[0], f[1])))
+            sources.append([i2, i3, voltage_angle(f[0], f[1]), None])
+        elif name == 'EX' and i1 == 0 and i4 == 0 and f[0] == 0 and f[1] == 0:
+            sources.append([i2, i3, None, card_text(name, count, values)])
+            model.controlCards.append(sources[-1][3])
+        elif name == 'LD' and i1 == 0 and i3 == i4 and f[2] == 0:
+            model.loads.append((i2, i3, f[0], f[1]))
+        else:
+            model.controlCards.append(card_text(name, count, values))
+        last = name
+
+    # 0 V sources a later excitation drove are feeds of a port matrix deck
+    driven = [src for src in sources if src[3] is not None and src[2] is not None]
+    if driven:
+        for src in driven:
+            model.controlCards.remove(src[3])
+        model.excitations = CardArray(EX_DTYPE, max(len(sources), 1))
+        for tag, segment, angle, card in sources:
+            if angle is not None:
+                model.excitations.append((tag, segment, angle))
+
+    # a ground plane without a GN card is perfectly conducting
+    if model.gpflag > 0 and not grounded:
+        model.ground = PRESETS['perfect']
+    if frequency is not None and patterns is None:
+        sweeps.append(frequency + ([],))
+    if len(model.wires):
+        model.tag = max(model.tag, int(model.wires.rows()['tag'].max()))
+    return model, sweeps, '\n'.join(comments)
+
+@profiling.timed()
+def read_deck(filename):
+    # parse a .nec file, see parse_deck
+    f = open(filename, 'r')
+    try:
+        return parse_deck(f.read())
+    finally:
+        f.close()
+
+def save_model(filename, model, sweeps = (), comments = ''):
+    # write a model, and optionally the sweeps and comments of its deck, to a compressed npz file
+    ground = model.ground
+    symmetry = np.zeros(len(model.symmetry), dtype = SYMMETRY_DTYPE)
+    for row, (card, start, copies, tagIncrement, fields, rotation, translation) in zip(symmetry, model.symmetry):
+        row['card'], row['start'], row['copies'], row['tagIncrement'] = card, start, copies, tagIncrement
+        row['field'] = fields if card == 'GM' else (fields,) + (0.0,) * 5
+        row['rotation'], row['translation'] = rotation, translation
+    sweep_rows = np.zeros(len(sweeps), dtype = SWEEP_DTYPE)
+    specs = []
+    for row, sweep in zip(sweep_rows, sweeps):
+        radpat = patternList(sweep[3] if len(sweep) > 3 else True)
+        row['start'], row['step'], row['count'], row['patterns'] = sweep[0], sweep[1], sweep[2], len(radpat)
+        specs += [(p.thetaStart, p.thetaStep, p.nTheta, p.phiStart, p.phiStep, p.nPhi) for p in radpat]
+    np.savez_compressed(filename,
+        version = np.array([FORMAT_VERSION]),
+        wires = model.wires.rows(), transforms = model.transforms.rows(),
+        excitations = model.excitations.rows(), loads = model.loads.rows(),
+        symmetry = symmetry,
+        controlCards = np.array([c.encode('ascii') for c in model.controlCards], dtype = 'S'),
+        scalars = np.array([model.tag, model.wireRadius, model.gpflag]),
+        ground = np.array([ground.epsilon, ground.sigma, ground.gnType] if ground is not None else []),
+        groundName = np.array([ground.name.encode('ascii') if ground is not None else b'']),
+        sweeps = sweep_rows, patterns = np.array(specs, dtype = PATTERN_DTYPE),
+        comments = np.array([comments.encode('ascii')]))
+
+def as_str(value):
+    return str(value.decode('ascii')) if isinstance(value, bytes) else str(value)
+
+def load_model(filename):
+    # read a file written by save_model, returns (model, sweeps, comments) like parse_deck
+    data = np.load(filename)
+    try:
+        if data['version'][0] > FORMAT_VERSION:
+            raise ValueError('%s has model format %d, newer than %d' % (filename, data['version'][0], FORMAT_VERSION))
+        tag, wireRadius, gpflag = data['scalars']
+        ground = data['ground']
+        model = Model(float(wireRadius), Ground(ground[0], ground[1], int(ground[2]), as_str(data['groundName'][0]))
+                      if len(ground) else int(gpflag))
+        model.gpflag = int(gpflag)
+        model.tag = int(tag)
+        model.wires.extend(data['wires'].astype(WIRE_DTYPE))
+        model.transforms.extend(data['transforms'])
+        model.excitations.extend(data['excitations'])
+        model.loads.extend(data['loads'])
+        for row in data['symmetry']:
+            card = as_str(row['card'])
+            fields = tuple(float(v) for v in row['field']) if card == 'GM' else int(row['field'][0])
+            model.symmetry.append((card, int(row['start']), int(row['copies']), int(row['tagIncrement']), fields,
+                                   row['rotation'].copy(), row['translation'].copy()))
+        model.controlCards = [as_str(c) for c in data['controlCards']]
+        patterns = [PatternSpec(*p) for p in data['patterns'].tolist()]
+        sweeps = []
+        for start, step, count, n in data['sweeps'].tolist():
+            sweeps.append((start, step, count, patterns[:n]))
+            patterns = patterns[n:]
+        return model, sweeps, as_str(data['comments'][0])
+    finally:
+        data.close()
@@ -0,0 +1,254 @@
+# jon klein
+# jtklein@alaska.edu
+# streaming parser for nec2 .out files
+#
+# the output file is memory mapped and scanned for its per-frequency sections, only the
+# tables that are asked for are copied out of the map and converted to numpy arrays, so
+# the whole file is never read in as text. per frequency this gives
+#   inputs   - antenna input parameters, one row per EX source (INPUT_DTYPE)
+#   currents - structure currents, one row per segment (CURRENT_DTYPE)
+#   pattern  - radiation pattern, one row per theta/phi point (PATTERN_DTYPE)
+#
+# usage:
+#   for f in iter_frequencies('out/lpda_vert.nec.out'):
+#       print f['freq'], f['inputs']['impedance']
+#   r = read_out('out/lpda_vert.nec.out')
+#   r['inputs']['impedance'] -> (n_freqs, n_sources) complex impedance
+#   r = read_shards(['out/lpda_vert_fr%d.nec.out' % i for i in range(8)])
+
+import re
+import mmap
+import bisect
+import numpy as np
+import profiling
+
+INPUT_DTYPE = [('tag', np.int64), ('segment', np.int64), ('voltage', np.complex128), ('current', np.complex128),
+               ('impedance', np.complex128), ('admittance', np.complex128), ('power', np.float64)]
+CURRENT_DTYPE = [('segment', np.int64), ('tag', np.int64), ('x', np.float64), ('y', np.float64), ('z', np.float64),
+                 ('length', np.float64), ('current', np.complex128)]
+PATTERN_DTYPE = [('theta', np.float64), ('phi', np.float64), ('vert_db', np.float64), ('hor_db', np.float64),
+                 ('total_db', np.float64), ('axial_ratio', np.float64), ('tilt', np.float64), ('sense', np.int8),
+                 ('e_theta', np.complex128), ('e_phi', np.complex128)]
+
+# polarization sense column of the pattern table, stored as a small integer
+SENSES = (b'LINEAR', b'RIGHT', b'LEFT')
+
+# section header, number of numeric columns per row, conversion to a record array
+SECTIONS = {
+    'inputs':   (b'ANTENNA INPUT PARAMETERS', 11),
+    'currents': (b'CURRENTS AND LOCATION', 10),
+    'pattern':  (b'RADIATION PATTERNS', 12),
+}
+
+FREQ_RE = re.compile(br'FREQUENCY\s*[=:]\s*([-+]?[0-9.]+(?:[Ee][-+]?\d+)?)')
+# numbers, and the NaN and Infinity nec prints for the impedance of a 0 V source (the shorted ports of
+# Model.getPortMatrixText). a windows runtime prints those as 1.#QNAN and 1.#INF, see NONFINITE_RE
+NUMBER_RE = re.compile(br'[-+]?(?:(?:\d+\.\d*|\.\d+|\d+)(?:[Ee][-+]?\d+)?|[Nn][Aa][Nn]|[Ii][Nn][Ff](?:[Ii][Nn][Ii][Tt][Yy])?)')
+NONFINITE_RE = re.compile(br'1\.#(INF|QNAN|SNAN|IND)\d*')
+DATA_LINE_RE = re.compile(br'[ \t]*[-+]?\.?\d')
+
+# number of header lines allowed between a section title and the first row of its table
+MAX_HEADER_LINES = 8
+
+def complex_column(re, im):
+    # re + 1j * im, without the nan that multiplying an infinite im by 1j makes of its real part
+    z = np.empty(len(re), dtype = np.complex128)
+    z.real, z.imag = re, im
+    return z
+
+def to_inputs(c):
+    rows = np.zeros(len(c), dtype = INPUT_DTYPE)
+    rows['tag'], rows['segment'] = c[:, 0], c[:, 1]
+    rows['voltage'] = complex_column(c[:, 2], c[:, 3])
+    rows['current'] = complex_column(c[:, 4], c[:, 5])
+    rows['impedance'] = complex_column(c[:, 6], c[:, 7])
+    rows['admittance'] = complex_column(c[:, 8], c[:, 9])
+    rows['power'] = c[:, 10]
+    return rows
+
+def to_currents(c):
+    rows = np.zeros(len(c), dtype = CURRENT_DTYPE)
+    rows['segment'], rows['tag'] = c[:, 0], c[:, 1]
+    rows['x'], rows['y'], rows['z'], rows['length'] = c[:, 2], c[:, 3], c[:, 4], c[:, 5]
+    rows['current'] = c[:, 6] + 1j * c[:, 7]
+    return rows
+
+def to_pattern(c):
+    rows = np.zeros(len(c), dtype = PATTERN_DTYPE)
+    for i, name in enumerate(('theta', 'phi', 'vert_db', 'hor_db', 'total_db', 'axial_ratio', 'tilt', 'sense')):
+        rows[name] = c[:, i]
+    rows['e_theta'] = c[:, 8] * np.exp(1j * np.deg2rad(c[:, 9]))
+    rows['e_phi'] = c[:, 10] * np.exp(1j * np.deg2rad(c[:, 11]))
+    return rows
+
+CONVERTERS = {'inputs': to_inputs, 'currents': to_currents, 'pattern': to_pattern}
+
+def table_bounds(mm, pos, end):
+    # returns the (start, stop) byte offsets of the block of numeric rows that follows pos
+    start = None
+    headers = 0
+    while pos < end:
+        eol = mm.find(b'\n', pos, end)
+        if eol < 0:
+            eol = end
+        is_data = DATA_LINE_RE.match(mm, pos, eol) is not None
+        if start is None:
+            if is_data:
+                start = pos
+            else:
+                headers += 1
+                if headers > MAX_HEADER_LINES:
+                    return pos, pos
+        elif not is_data:
+            return start, pos
+        pos = eol + 1
+    if start is None:
+        return end, end
+    return start, end
+
+def parse_table(block, ncols):
+    # converts a block of table rows to an (n_rows, ncols) float array
+    for i, sense in enumerate(SENSES):
+        block = block.replace(sense, (' %d ' % i).encode('ascii'))
+    if b'#' in block:
+        block = NONFINITE_RE.sub(lambda m: b'inf' if m.group(1) == b'INF' else b'nan', block)
+    values = np.array(NUMBER_RE.findall(block)).astype(np.float64)
+    if len(values) % ncols == 0:
+        return values.reshape(-1, ncols)
+
+    # slow path, rows with a blank polarization sense (pattern points with no field) are one value short
+    rows = []
+    for line in block.splitlines():
+        row = NUMBER_RE.findall(line)
+        if len(row) == ncols - 1 and ncols == SECTIONS['pattern'][1]:
+            row.insert(7, b'0')
+        if len(row) != ncols:
+            raise ValueError('malformed nec output row, expected %d values: %r' % (ncols, line))
+        rows.append(row)
+    return np.array(rows).astype(np.float64).reshape(-1, ncols)
+
+def iter_frequencies(filename, sections = ('inputs', 'currents', 'pattern')):
+    # generator over the frequencies of a nec output file, yields a dict per frequency with the
+    # frequency in MHz under 'freq' and a record array for each of the requested sections
+    f = open(filename, 'rb')
+    try:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            return
+        try:
+            match = FREQ_RE.search(mm)
+            while match:
+                next_match = FREQ_RE.search(mm, match.end())
+                end = next_match.start() if next_match else len(mm)
+                result = {'freq': float(match.group(1))}
+                for name in sections:
+                    header, ncols = SECTIONS[name]
+                    idx = mm.find(header, match.end(), end)
+                    if idx < 0:
+                        continue
+                    # a deck with several RP cards (Model.patternText) prints one pattern table per card
+                    tables = []
+                    while idx >= 0:
+                        eol = mm.find(b'\n', idx, end)
+                        start, stop = table_bounds(mm, eol + 1 if eol >= 0 else end, end)
+                        tables.append(parse_table(mm[start:stop], ncols))
+                        idx = mm.find(header, stop, end) if name == 'pattern' else -1
+                    result[name] = CONVERTERS[name](np.vstack(tables))
+                yield result
+                match = next_match
+        finally:
+            mm.close()
+    finally:
+        f.close()
+
+def iter_tables(filename, section = 'inputs'):
+    # generator over every table of one section in file order, yields (frequency in MHz, record array), where the
+    # frequency is that of the nearest FREQUENCY header before the table. a deck that runs several excitations at
+    # one frequency (nec2utils.Model.getPortMatrixText) prints a table for each of them
+    header, ncols = SECTIONS[section]
+    f = open(filename, 'rb')
+    try:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            return
+        try:
+            freqs = [(m.start(), float(m.group(1))) for m in FREQ_RE.finditer(mm)]
+            starts = [start for start, freq in freqs]
+            idx = mm.find(header)
+            while idx >= 0:
+                before = bisect.bisect_right(starts, idx) - 1
+                eol = mm.find(b'\n', idx)
+                start, stop = table_bounds(mm, eol + 1 if eol >= 0 else len(mm), len(mm))
+                freq = freqs[before][1] if before >= 0 else np.nan
+                yield freq, CONVERTERS[section](parse_table(mm[start:stop], ncols))
+                idx = mm.find(header, max(stop, idx + 1))
+        finally:
+            mm.close()
+    finally:
+        f.close()
+
+def stack(tables):
+    # stack per frequency tables into one (n_freqs, n_rows) array if they all have the same length
+    if tables and all(len(t) == len(tables[0]) for t in tables):
+        return np.vstack(tables)
+    return tables
+
+@profiling.timed()
+def read_out(filename, sections = ('inputs', 'currents', 'pattern')):
+    # parse a whole nec output file, returns a dict with 'freq' (n_freqs,) and for each section
+    # an (n_freqs, n_rows) record array (or a list of per frequency arrays if the row counts differ)
+    freqs = []
+    tables = dict((name, []) for name in sections)
+    for result in iter_frequencies(filename, sections):
+        freqs.append(result['freq'])
+        for name in sections:
+            if name in result:
+                tables[name].append(result[name])
+    out = {'freq': np.array(freqs)}
+    for name in sections:
+        out[name] = stack(tables[name])
+    return out
+
+def merge(results):
+    # merge read_out results of decks that split one frequency sweep (log_antenna.make_lpda_nec shards)
+    # into one result ordered by frequency, a frequency solved by more than one deck is kept once
+    # a section missing at some frequencies of a deck can't be lined up with them, its tables are
+    # kept in the order of the decks' first frequencies instead
+    results = sorted(results, key = lambda r: r['freq'].min() if len(r['freq']) else np.inf)
+    freqs = np.concatenate([r['freq'] for r in results])
+    order = np.argsort(freqs, kind = 'mergesort')
+    order = order[np.concatenate(([True], np.diff(freqs[order]) != 0))[:len(order)]]
+    out = {'freq': freqs[order]}
+    for name in set(results[0]) - set(['freq']):
+        tables = []
+        for r in results:
+            tables.extend(list(r[name]))
+        if len(tables) == len(freqs):
+            tables = [tables[i] for i in order]
+        out[name] = stack(tables)
+    return out
+
+def read_shards(filenames, sections = ('inputs', 'currents', 'pattern')):
+    # read and merge the output files of every frequency shard of a deck
+    return merge([read_out(f, sections) for f in filenames])
+
+def pattern_grid(pattern):
+    # reshape the pattern rows of one frequency into (n_theta, n_phi) arrays, rows placed by their own angles, so
+    # several RP tables (e.g. LPDA_PATTERN_CUTS, one cut per phi) are joined in order of phi
+    # returns theta values, phi values and the reshaped record array. rows that don't cover every (theta, phi) of
+    # their angles (beamPattern's dense window on a sparse grid) raise a ValueError
+    pattern = np.asarray(pattern).reshape(-1)
+    theta, i = np.unique(pattern['theta'], return_inverse = True)
+    phi, j = np.unique(pattern['phi'], return_inverse = True)
+    grid = np.zeros((len(theta), len(phi)), dtype = pattern.dtype)
+    filled = np.zeros(grid.shape, dtype = bool)
+    grid[i, j] = pattern
+    filled[i, j] = True
+    if not filled.all():
+        raise ValueError('pattern of %d points is not a grid, %d of its %d x %d (theta, phi) points are missing' %
+                         (len(pattern), (~filled).sum(), len(theta), len(phi)))
+    return theta, phi, grid
@@ -0,0 +1,346 @@
+# jon klein
+# jtklein@alaska.edu
+# surrogate assisted optimization of lpda element lengths and coil loading
+#
+# elem_len, the feed coils and the termination coil used to be tuned by hand. optimize fits a
+# radial basis function surrogate (cubic kernel with a linear tail) to every design evaluated so
+# far and picks the next batch of candidates from it, trading the surrogate's prediction against
+# the distance to designs already evaluated (the stochastic rbf method of Regis and Shoemaker,
+# "A stochastic radial basis function method for the global optimization of expensive functions",
+# INFORMS J. Computing 2007, with the coordinate perturbations of their DYCORS variant). a batch is
+# solved in parallel by the scheduler, so a good design takes a few dozen nec runs where a grid
+# over the same parameters would take thousands.
+#
+# NecEvaluator writes one deck per candidate, named after its content hash (neccache.deck_key), so
+# a geometry that comes up again, in this run or a later one, is neither solved nor parsed twice:
+# its responses are memoized in memory and its nec output is restored from the neccache.
+# MomEvaluator does the same with the in process solver of mom.py, for a quick search without nec.
+#
+# usage, the rear element and its coils of the horizontal antenna for low vswr and high f/b:
+#   space = [Parameter('elem_len', 14., 16., element = 9), Parameter('feed_coil_turns', 2, 14, element = 9, resolution = 1),
+#            Parameter('termcoil_turns', 4, 14, resolution = 1)]
+#   r = optimize(NecEvaluator(space, HORIZ, usepole = True, ground = True), space, max_evals = 60)
+#   r['best'], r['params'][r['best']]
+
+import os
+import json
+import numpy as np
+import mom
+import necout
+import neccache
+import scheduler
+from nec2utils import PatternSpec, writeCardsToFile
+from log_antenna import build_lpda_model, LPDA_COMMENTS, NECFILE_FOLDER, FREQ_STEP
+from sweep import make_antenna, plain, DEFAULTS, HORIZ, ANTENNA_ARRAYS
+from adaptivesweep import vswr
+
+# weights of the surrogate value against the distance to evaluated designs, cycled through each batch
+# from exploring (low) to exploiting the surrogate (high)
+SCORE_WEIGHTS = (.3, .5, .8, .95)
+# random candidates the surrogate is evaluated on per proposal, per parameter
+CANDIDATES_PER_PARAM = 100
+# step size of the coordinate perturbations, as a fraction of each parameter range
+SIGMA_INIT, SIGMA_MIN, SIGMA_MAX = .2, .005, .2
+
+class Parameter:
+    def __init__(self, name, low, high, element = None, resolution = None):
+        # an lpda_antenna attribute to optimize between low and high
+        #   element - index into a per element array (elem_len, feed_coil_turns..), None sets every element
+        #   resolution - values are rounded to this, e.g. 1 for coil turns
+        self.name = name
+        self.low = float(low)
+        self.high = float(high)
+        self.element = element
+        self.resolution = resolution
+
+    def value(self, u):
+        # parameter value at u in [0, 1] of its range, rounded to its resolution
+        v = self.low + np.clip(u, 0., 1.) * (self.high - self.low)
+        if self.resolution:
+            v = np.clip(np.round(v / self.resolution) * self.resolution, self.low, self.high)
+        return float(v)
+
+    def unit(self, v):
+        return (float(v) - self.low) / (self.high - self.low)
+
+    def label(self):
+        return self.name if self.element is None else '%s[%d]' % (self.name, self.element)
+
+def design_params(space, u):
+    # parameter dict (label -> value) of a design at unit coordinates u
+    return dict((p.label(), p.value(x)) for p, x in zip(space, u))
+
+def snap(space, u):
+    # unit coordinates of the rounded design at u, so equal designs have equal coordinates
+    return np.array([p.unit(p.value(x)) for p, x in zip(space, u)])
+
+def apply_params(antenna, space, params):
+    # set the design parameters (a design_params dict) on an lpda_antenna
+    for p in space:
+        v = params[p.label()]
+        if p.name in ANTENNA_ARRAYS:
+            values = np.array(getattr(antenna, p.name), dtype = float)
+            if p.element is None:
+                values[:] = v
+            else:
+                values[p.element] = v
+            setattr(antenna, p.name, values)
+        else:
+            setattr(antenna, p.name, v)
+    return antenna
+
+# -------------------------------------------------------------------------------------------
+# objectives
+# -------------------------------------------------------------------------------------------
+
+def max_vswr(r):
+    # worst vswr of any port over the band
+    return np.max(r['vswr'])
+
+def min_front_to_back(r):
+    # smallest front to back ratio (dB) over the band
+    return np.min(r['fb'])
+
+def lpda_objective(r, fb_weight = .1):
+    # default objective to minimize: worst vswr, less fb_weight per dB of the smallest front to back ratio
+    return max_vswr(r) - fb_weight * min_front_to_back(r)
+
+# -------------------------------------------------------------------------------------------
+# evaluation
+# -------------------------------------------------------------------------------------------
+
+class NecEvaluator:
+    def __init__(self, space, antenna = HORIZ, others = (), swept_index = 0, usepole = True, ground = True, policy = None,
+                 fstart = 8, fstop = 18, fstep = FREQ_STEP, direction = (70., 180.), objective = lpda_objective,
+                 name = 'lpda_opt', folder = NECFILE_FOLDER, outdir = 'out', solver = scheduler.SOLVER, ram = 4e9,
+                 cores = 4, cache = None):
+        # solve designs with nec and score them with objective
+        #   antenna - parameter dict of the optimized antenna (see sweep.make_antenna), others and swept_index add
+        #             fixed antennas to every model as in sweep.run_sweep
+        #   direction - boresight (theta, phi) in degrees, the back lobe is read 180 degrees of azimuth away
+        #   objective - callable taking a responses dict ('freq', 'vswr' (n_freqs, n_ports), 'fb' (n_freqs,) in dB,
+        #               'gain' (n_freqs,) boresight gain in dBi) and returning the value to minimize
+        self.space = space
+        self.antenna = dict(DEFAULTS, **antenna)
+        self.others = [dict(DEFAULTS, **o) for o in others]
+        self.swept_index = swept_index
+        self.usepole = usepole
+        self.ground = ground
+        self.policy = policy
+        self.sweep = (fstart, fstep, int(round((fstop - fstart) / float(fstep))) + 1)
+        self.direction = direction
+        self.objective = objective
+        self.name = name
+        self.folder = folder
+        self.outdir = outdir
+        self.solver = solver
+        self.ram = ram
+        self.cores = cores
+        self.cache = scheduler.solver_cache(solver) if cache is None else cache
+        self.responses = {} # deck hash -> responses
+        self.runs = 0
+
+    def model(self, params):
+        antennas = [make_antenna(o) for o in self.others]
+        antennas.insert(self.swept_index, apply_params(make_antenna(self.antenna), self.space, params))
+        return build_lpda_model(antennas, self.usepole, self.ground, self.policy)
+
+    def pattern(self):
+        # boresight and the same elevation 180 degrees of azimuth away
+        theta, phi = self.direction
+        return PatternSpec(theta, 0., 1, phi % 180., 180., 2)
+
+    def deck_text(self, model):
+        return model.getSweepText([self.sweep], self.pattern())
+
+    def read(self, out):
+        return self.responses_of(necout.read_out(out, ('inputs', 'pattern')))
+
+    def responses_of(self, r):
+        # responses of a read_out (or mom.MomSolver.solve) result of deck_text's sweep and pattern
+        z = np.asarray(r['inputs']['impedance']).reshape(len(r['freq']), -1)
+        pattern = r['pattern']
+        front = np.isclose(pattern['phi'][0] % 360., self.direction[1] % 360.)
+        gain = pattern['total_db'][:, front][:, 0]
+        return {'freq': r['freq'], 'vswr': vswr(z), 'gain': gain, 'fb': gain - pattern['total_db'][:, ~front][:, 0]}
+
+    def solve(self, params_list):
+        # responses of every design, solving each distinct geometry not seen before once
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        if not os.path.isdir(self.outdir):
+            os.makedirs(self.outdir)
+        keys, jobs = [], {}
+        for params in params_list:
+            model = self.model(params)
+            text = self.deck_text(model)
+            key = neccache.deck_key(text)
+            keys.append(key)
+            if key in self.responses or key in jobs:
+                continue
+            deck = os.path.join(self.folder, '%s_%s.nec' % (self.name, key[:12]))
+            writeCardsToFile(deck, LPDA_COMMENTS, text)
+            jobs[key] = scheduler.job_from_model(model, deck, self.outdir, self.sweep[2])
+
+        missing = set(neccache.restore(self.outdir, [job.deck for job in jobs.values()], self.cache))
+        run = [job for job in jobs.values() if job.deck in missing]
+        if run:
+            scheduler.run_jobs(run, self.ram, self.cores, self.solver, on_success = self.store)
+            self.runs += len(run)
+        for key, job in jobs.items():
+            try:
+                self.responses[key] = self.read(job.out)
+            except (IOError, IndexError, ValueError):
+                # failed run or unreadable output, scored as infinitely bad
+                self.responses[key] = None
+        return [self.responses[key] for key in keys]
+
+    def store(self, job):
+        # cache the output of a finished run. a solver can exit 0 without writing one, solve scores that design as inf
+        if os.path.isfile(job.out):
+            neccache.store(job.deck, job.out, self.cache)
+
+    def __call__(self, params_list):
+        # objective value of every design (a list of design_params dicts), inf where the solve failed
+        return np.array([np.inf if r is None else self.objective(r) for r in self.solve(params_list)])
+
+class MomEvaluator(NecEvaluator):
+    def __init__(self, space, antenna = HORIZ, approximate_ground = True, **kwargs):
+        # NecEvaluator solving with the in process mom.MomSolver instead of nec, takes the same arguments
+        # approximate_ground - solve a finite ground as perfect (mom can't model finite grounds)
+        NecEvaluator.__init__(self, space, antenna, **kwargs)
+        self.approximate_ground = approximate_ground
+
+    def solve(self, params_list):
+        # responses of every design, memoized by deck hash like NecEvaluator, solved one after the other
+        responses = []
+        for params in params_list:
+            model = self.model(params)
+            key = neccache.deck_key(self.deck_text(model))
+            if key not in self.responses:
+                solver = mom.MomSolver(model, approximate_ground = self.approximate_ground)
+                start, step, count = self.sweep
+                r = solver.solve(start + step * np.arange(count), self.pattern())
+                self.responses[key] = self.responses_of(r)
+                self.runs += 1
+            responses.append(self.responses[key])
+        return responses
+
+# -------------------------------------------------------------------------------------------
+# surrogate
+# -------------------------------------------------------------------------------------------
+
+def rbf_fit(x, y, smoothing = 1e-9):
+    # cubic radial basis function interpolant with a linear tail through points x (n, d) with values y (n,)
+    n, d = x.shape
+    r = np.sqrt(np.sum((x[:, np.newaxis] - x[np.newaxis]) ** 2, axis = 2))
+    p = np.hstack((np.ones((n, 1)), x))
+    a = np.zeros((n + d + 1, n + d + 1))
+    a[:n, :n] = r ** 3 + smoothing * np.eye(n)
+    a[:n, n:] = p
+    a[n:, :n] = p.T
+    coef = np.linalg.lstsq(a, np.concatenate((y, np.zeros(d + 1))), rcond = None)[0]
+    return x, coef[:n], coef[n:]
+
+def rbf_eval(fit, u):
+    # surrogate values at points u (m, d)
+    x, w, c = fit
+    r = np.sqrt(np.sum((u[:, np.newaxis] - x[np.newaxis]) ** 2, axis = 2))
+    return (r ** 3).dot(w) + c[0] + u.dot(c[1:])
+
+def latin_hypercube(n, d, rng):
+    # n points in the unit cube with one point in each of n slices along every axis
+    return (np.argsort(rng.rand(n, d), axis = 0) + rng.rand(n, d)) / n
+
+def propose(x, y, space, count, sigma, rng, weights = SCORE_WEIGHTS):
+    # count new designs (unit coordinates) from the surrogate of the designs x with values y
+    d = x.shape[1]
+    finite = np.isfinite(y)
+    # failed designs count as the worst one that worked, so the surrogate steers away without blowing up
+    y = np.where(finite, y, np.max(y[finite]) if finite.any() else 0.)
+    fit = rbf_fit(x, y)
+
+    # perturb a few coordinates of the best design, and sample the whole space
+    m = CANDIDATES_PER_PARAM * d
+    best = x[np.argmin(y)]
+    perturb = rng.rand(m, d) < min(1., 20. / d)
+    perturb[np.arange(m), rng.randint(0, d, m)] = True
+    local = np.clip(best + perturb * rng.randn(m, d) * sigma, 0., 1.)
+    candidates = np.vstack((local, rng.rand(m, d)))
+    candidates = np.array([snap(space, u) for u in candidates])
+    s = rbf_eval(fit, candidates)
+    s = (s - s.min()) / ((s.max() - s.min()) or 1.)
+
+    chosen = []
+    known = x
+    for k in range(count):
+        dist = np.sqrt(np.min(np.sum((candidates[:, np.newaxis] - known[np.newaxis]) ** 2, axis = 2), axis = 1))
+        if not np.any(dist > 0):
+            break
+        scaled = (dist - dist.min()) / ((dist.max() - dist.min()) or 1.)
+        w = weights[k % len(weights)]
+        score = np.where(dist > 0, w * s + (1 - w) * (1 - scaled), np.inf)
+        pick = candidates[np.argmin(score)]
+        chosen.append(pick)
+        known = np.vstack((known, pick))
+    return np.array(chosen).reshape(-1, d)
+
+def optimize(evaluate, space, max_evals = 60, batch = 4, initial = None, start = None, seed = 0, log = None):
+    # minimize evaluate over the parameter space
+    #   evaluate - callable taking a list of design_params dicts and returning their objective values, e.g.
+    #              NecEvaluator, called with batch designs at a time
+    #   initial - designs of the latin hypercube the search starts from, by default 2 (n_params + 1)
+    #   start - design_params dict of a known design to include, by default the antenna the evaluator starts from
+    #   log - json lines file every evaluated design is appended to
+    # returns a dict with the unit coordinates 'x' and 'params' of every evaluated design, their 'values' and the
+    # index of the 'best' one
+    rng = np.random.RandomState(seed)
+    d = len(space)
+    if initial is None:
+        initial = 2 * (d + 1)
+    x = latin_hypercube(initial, d, rng)
+    if start is None and hasattr(evaluate, 'antenna'):
+        ant = make_antenna(evaluate.antenna)
+        start = {}
+        for p in space:
+            start[p.label()] = float(np.asarray(getattr(ant, p.name), dtype = float).flat[p.element or 0])
+    if start is not None:
+        x = np.vstack(([[p.unit(start[p.label()]) for p in space]], x))
+    x = np.clip(np.array([snap(space, u) for u in x]), 0., 1.)[:max_evals]
+
+    params = [design_params(space, u) for u in x]
+    values = np.asarray(evaluate(params), dtype = float)
+    sigma = SIGMA_INIT
+    while len(values) < max_evals:
+        new = propose(x, values, space, min(batch, max_evals - len(values)), sigma, rng)
+        if not len(new):
+            break
+        new_params = [design_params(space, u) for u in new]
+        new_values = np.asarray(evaluate(new_params), dtype = float)
+        # shrink the perturbations when a batch brings no improvement, grow them again when one does
+        if np.min(new_values) < np.min(values):
+            sigma = min(SIGMA_MAX, sigma * 2)
+        else:
+            sigma = max(SIGMA_MIN, sigma / 2)
+        x = np.vstack((x, new))
+        params += new_params
+        values = np.concatenate((values, new_values))
+
+    if log is not None:
+        with open(log, 'a') as f:
+            for p, v in zip(params, values):
+                f.write(json.dumps({'params': p, 'value': plain(v) if np.isfinite(v) else None}, sort_keys = True) + '\n')
+    return {'x': x, 'params': params, 'values': values, 'best': int(np.argmin(values))}
+
+def main():
+    # rear element length and its feed coil, and the termination coil, of the horizontal antenna over ground with the pole
+    space = [Parameter('elem_len', 14., 16., element = 9),
+             Parameter('feed_coil_turns', 2, 14, element = 9, resolution = 1),
+             Parameter('termcoil_turns', 4, 14, resolution = 1)]
+    evaluate = NecEvaluator(space, HORIZ, usepole = True, ground = True, cores = 4)
+    r = optimize(evaluate, space, max_evals = 40, batch = 4, log = os.path.join(evaluate.outdir, 'optimize.jsonl'))
+    print('best of %d designs (%d nec runs): %s, objective %g' % (len(r['values']), evaluate.runs,
+                                                                  r['params'][r['best']], r['values'][r['best']]))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,363 @@
+# jon klein
+# jtklein@alaska.edu
+# batched pattern analytics: gain, front to back, beamwidth, sidelobes and polarization
+#
+# comparing the lpda_orth_dualpol* and lpda_diag_dualpol* variants used to mean flipping through
+# patterns in xnecview. here every RP grid of every file and frequency is a slice of one stack,
+# (..., n_theta, n_phi), and each figure of merit is computed for the whole stack at once:
+#   peak_db, peak_theta, peak_phi - peak total gain (dBi) and its direction
+#   front_db                      - total gain in the front direction (the peak, or a fixed direction)
+#   fb_db                         - front to back ratio, against 180 degrees of azimuth away from the front
+#   beamwidth_az, beamwidth_el    - 3 dB beamwidths (degrees) of the azimuth and theta cuts through the front,
+#                                   nan where the beam doesn't fall 3 dB on both sides within the grid
+#   sidelobe_az_db, sidelobe_el_db - highest lobe outside the main lobe of each cut, relative to the front (dB)
+#   axial_ratio                   - minor / major axis of the polarization ellipse in the front direction
+#   co_db, cross_db               - co and cross polarized gain in the front direction (dBi)
+#   isolation_db                  - co - cross polarized gain in the front direction
+#   isolation_beam_db             - the worst co - cross polarized gain inside the 3 dB beam
+# co polarization is the projection of a reference polarization (an lpda element angle in degrees, as given
+# to lpda_antenna, or a 3 vector) onto each direction's transverse plane, cross polarization is at right
+# angles to it (ludwig's second definition). envelope_correlation gives the pattern coupling of the two ports
+# of a dual pol pair from their single port fields (superposition.PortSolution).
+#
+# analyze_files and analyze_store read patterns a chunk of grids at a time, so sweeps larger than memory
+# are summarized with only one chunk held.
+#
+# usage:
+#   r = analyze_files(['out/lpda_orth_dualpol%s.nec.out' % s for s in ('', '90', '180', '270')], polarization = 90)
+#   r['isolation_db'] -> (n_grids,) with r['file'] and r['freq'] saying which file and frequency each is
+#   theta, phi, grids = pattern_stack(necout.read_out('out/lpda_vert.nec.out', ('pattern',)))
+#   s = analyze_grids(theta, phi, grids, polarization = 90)   # s['fb_db'] -> (n_freqs,)
+
+import numpy as np
+import necout
+
+BEAMWIDTH_DB = 3.
+CHUNK_GRIDS = 256 # pattern grids analyzed at a time by analyze_files and analyze_store
+FLAT_DB = 1e-6 # gain steps smaller than this along a cut are rounding, not the start of the next lobe
+
+METRICS = ('peak_db', 'peak_theta', 'peak_phi', 'front_db', 'fb_db', 'beamwidth_az', 'beamwidth_el',
+           'sidelobe_az_db', 'sidelobe_el_db', 'axial_ratio', 'co_db', 'cross_db', 'isolation_db',
+           'isolation_beam_db')
+
+def element_polarization(angle):
+    # unit vector along an lpda element at angle degrees in the y-z plane (0 horizontal, 90 vertical)
+    a = np.deg2rad(angle)
+    return np.array([0., np.cos(a), np.sin(a)])
+
+def field_basis(theta, phi):
+    # theta and phi unit vectors (..., 3) at nec angles in degrees
+    t, p = np.deg2rad(theta), np.deg2rad(phi)
+    theta_hat = np.stack((np.cos(t) * np.cos(p), np.cos(t) * np.sin(p), -np.sin(t) + 0 * p), axis = -1)
+    phi_hat = np.stack((-np.sin(p) + 0 * t, np.cos(p) + 0 * t, 0 * (t + p)), axis = -1)
+    return theta_hat, phi_hat
+
+def polarization_fields(theta, phi, e_theta, e_phi, reference):
+    # co and cross polarized field components of (..., n_theta, n_phi) fields, see the header
+    # reference is an element angle in degrees or a 3 vector, nan where it points along the direction
+    reference = np.asarray(reference, dtype = float)
+    if reference.ndim == 0:
+        reference = element_polarization(reference)
+    theta_hat, phi_hat = field_basis(np.asarray(theta)[:, np.newaxis], np.asarray(phi)[np.newaxis, :])
+    ct, cp = np.dot(theta_hat, reference), np.dot(phi_hat, reference)
+    norm = np.hypot(ct, cp)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        ct, cp = ct / norm, cp / norm
+    return e_theta * ct + e_phi * cp, e_phi * ct - e_theta * cp
+
+def axial_ratio(e_theta, e_phi):
+    # minor / major axis of the polarization ellipse, 0 for linear and 1 for circular polarization
+    right = np.abs(e_theta + 1j * e_phi)
+    left = np.abs(e_theta - 1j * e_phi)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return np.abs(right - left) / (right + left)
+
+def power_db(field):
+    with np.errstate(divide = 'ignore'):
+        return 10 * np.log10(np.abs(field) ** 2)
+
+def solid_angle_weights(theta, phi):
+    # (n_theta, n_phi) solid angle of each grid point, trapezoidal along both axes
+    def trapezoid(values):
+        values = np.deg2rad(np.asarray(values, dtype = float))
+        if len(values) < 2:
+            return np.ones(len(values))
+        w = np.zeros(len(values))
+        d = np.diff(values) / 2.
+        w[:-1] += d
+        w[1:] += d
+        return np.abs(w)
+    return np.abs(np.sin(np.deg2rad(theta)))[:, np.newaxis] * np.outer(trapezoid(theta), trapezoid(phi))
+
+def envelope_correlation(theta, phi, e1_theta, e1_phi, e2_theta, e2_phi):
+    # envelope correlation of two far fields (..., n_theta, n_phi), 0 for orthogonal patterns and 1 for
+    # identical ones, e.g. the single port runs of the two antennas of a dual pol pair
+    w = solid_angle_weights(theta, phi)
+    cross = np.sum(w * (e1_theta * np.conj(e2_theta) + e1_phi * np.conj(e2_phi)), axis = (-2, -1))
+    p1 = np.sum(w * (np.abs(e1_theta) ** 2 + np.abs(e1_phi) ** 2), axis = (-2, -1))
+    p2 = np.sum(w * (np.abs(e2_theta) ** 2 + np.abs(e2_phi) ** 2), axis = (-2, -1))
+    return np.abs(cross) ** 2 / (p1 * p2)
+
+# -------------------------------------------------------------------------------------------
+# grid axes and cuts
+# -------------------------------------------------------------------------------------------
+
+def axis_span(values):
+    # (usable points, step, periodic) of a uniform grid axis. an axis covering the full circle is periodic,
+    # and a last point repeating the first (phi 0 to 360) is left out of the cuts
+    values = np.asarray(values, dtype = float)
+    if len(values) < 2:
+        return len(values), 0., False
+    step = (values[-1] - values[0]) / (len(values) - 1)
+    if np.isclose(values[-1] - values[0], 360.):
+        return len(values) - 1, step, True
+    return len(values), step, np.isclose(len(values) * step, 360.)
+
+def nearest(values, targets, periodic = False):
+    # index of the grid point nearest each target angle, and whether it is within half a step of it
+    values = np.asarray(values, dtype = float)
+    d = np.asarray(targets, dtype = float)[..., np.newaxis] - values
+    if periodic:
+        d = (d + 180.) % 360. - 180.
+    index = np.argmin(np.abs(d), axis = -1)
+    count, step, p = axis_span(values)
+    tolerance = abs(step) / 2. if step else 1e-6
+    return index, np.take_along_axis(np.abs(d), index[..., np.newaxis], -1)[..., 0] <= tolerance + 1e-9
+
+def centered(cut, center, periodic):
+    # (n, m) cuts rolled so each row's center index lands on column m // 2, points off the end are nan
+    n, m = cut.shape
+    index = center[:, np.newaxis] + np.arange(m)[np.newaxis, :] - m // 2
+    if periodic:
+        return np.take_along_axis(cut, index % m, 1)
+    valid = (index >= 0) & (index < m)
+    values = np.take_along_axis(cut, np.clip(index, 0, m - 1), 1)
+    values[~valid] = np.nan
+    return values
+
+def half_width(side, level):
+    # distance in grid steps from column 0 (the center) to where each row first falls to level, nan if never
+    with np.errstate(invalid = 'ignore'):
+        below = side <= level[:, np.newaxis]
+    found = below.any(axis = 1)
+    j = np.maximum(np.argmax(below, axis = 1), 1)
+    rows = np.arange(len(side))
+    before, after = side[rows, j - 1], side[rows, j]
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        frac = np.where(before > after, (before - level) / (before - after), 0.)
+    return np.where(found, j - 1 + frac, np.nan)
+
+def lobe_top(side):
+    # grid steps from the center up to the top of its lobe, where each row stops rising, 0 if it falls from the center
+    with np.errstate(invalid = 'ignore'):
+        rising = np.diff(side, axis = 1) > FLAT_DB
+    return np.where(rising.all(axis = 1), side.shape[1] - 1, np.argmax(~rising, axis = 1))
+
+def main_lobe_end(side, top):
+    # grid steps from the center to the first null past each row's lobe top, where it stops falling, the last
+    # column if never
+    m = side.shape[1]
+    index = top[:, np.newaxis] + np.arange(m)[np.newaxis, :]
+    side = np.where(index < m, np.take_along_axis(side, np.minimum(index, m - 1), 1), np.nan)
+    with np.errstate(invalid = 'ignore'):
+        rising = np.diff(side, axis = 1) > FLAT_DB
+    rising |= np.isnan(side[:, 1:])
+    return top + np.where(rising.any(axis = 1), np.argmax(rising, axis = 1), m - 1)
+
+def theta_cut(gain, theta, phi, front_t, front_p):
+    # (n, m) cuts in theta through each grid's front, with the index of the front in them, the step and whether
+    # they are periodic. nec grids with negative theta hold the whole upper half of the great circle in one phi
+    # column, grids from theta 0 join the front's column to the one 180 degrees of azimuth away, over the zenith
+    rows = np.arange(len(gain))
+    count_t, step_t, periodic_t = axis_span(theta)
+    column = gain[rows, :count_t, front_p]
+    opposite_p, found = nearest(phi, phi[front_p] + 180., True)
+    if theta.min() < 0 or not found.all() or not np.isclose(theta[0], 0.):
+        return column, front_t, step_t, periodic_t
+    full = np.isclose(theta[-1], 180.)
+    # the back half, from the last theta back to the zenith, without the points it shares with the front column
+    back = gain[rows, (count_t - 2 if full else count_t - 1):0:-1, opposite_p]
+    return np.hstack((back, column)), back.shape[1] + front_t, step_t, full
+
+def cut_stats(cut, center, step, periodic, drop_db = BEAMWIDTH_DB):
+    # beamwidth (degrees) and sidelobe level (dB below the center) of (n, m) cuts around their center index
+    v = centered(cut, center, periodic)
+    c = v.shape[1] // 2
+    right, left = v[:, c:], v[:, c::-1]
+    level = v[:, c] - drop_db
+    width = (half_width(right, level) + half_width(left, level)) * abs(step)
+    if periodic:
+        with np.errstate(invalid = 'ignore'):
+            width[width >= 360.] = np.nan
+
+    # the main lobe is the one the center is on, climbed to its top (the center needn't be the peak with an
+    # explicit direction) and down to the nulls on both sides. a center in a null goes with the higher neighbour
+    rows = np.arange(len(v))
+    top_l, top_r = lobe_top(left), lobe_top(right)
+    both = (top_l > 0) & (top_r > 0)
+    with np.errstate(invalid = 'ignore'):
+        higher_r = right[rows, top_r] >= left[rows, top_l]
+    top_l[both & higher_r] = 0
+    top_r[both & ~higher_r] = 0
+    columns = np.arange(v.shape[1])[np.newaxis, :]
+    lobe = ((columns >= c - main_lobe_end(left, top_l)[:, np.newaxis]) &
+            (columns <= c + main_lobe_end(right, top_r)[:, np.newaxis]))
+    outside = np.where(lobe | np.isnan(v), -np.inf, v).max(axis = 1)
+    sidelobe = np.where(np.isfinite(outside), outside - v[:, c], np.nan)
+    return width, sidelobe
+
+# -------------------------------------------------------------------------------------------
+# analysis
+# -------------------------------------------------------------------------------------------
+
+def analyze(theta, phi, total_db, e_theta = None, e_phi = None, polarization = None, direction = None,
+            beam_db = BEAMWIDTH_DB):
+    # figures of merit (see the header) of a stack of pattern grids in one pass
+    #   theta, phi - grid angles in degrees, (n_theta,) and (n_phi,)
+    #   total_db - total gain (..., n_theta, n_phi), e_theta and e_phi the complex fields of the same shape,
+    #              needed for the axial ratio and, with polarization, the co and cross polarized gains
+    #   polarization - reference polarization, an element angle in degrees or a 3 vector
+    #   direction - (theta, phi) of the front, or None for each grid's peak
+    # returns a dict of arrays of the stack's leading shape
+    theta, phi = np.asarray(theta, dtype = float), np.asarray(phi, dtype = float)
+    total_db = np.asarray(total_db, dtype = float)
+    shape = total_db.shape[:-2]
+    nt, np_ = total_db.shape[-2:]
+    gain = total_db.reshape(-1, nt, np_)
+    n = len(gain)
+    rows = np.arange(n)
+    count_p, step_p, periodic_p = axis_span(phi)
+
+    peak = np.argmax(gain.reshape(n, -1), axis = 1)
+    peak_t, peak_p = np.unravel_index(peak, (nt, np_))
+    if direction is None:
+        front_t, front_p = peak_t, peak_p
+    else:
+        t, found_t = nearest(theta, direction[0])
+        p, found_p = nearest(phi, direction[1], True)
+        if not (found_t and found_p):
+            raise ValueError('direction %s is not on the pattern grid' % (direction,))
+        front_t, front_p = np.zeros(n, dtype = int) + t, np.zeros(n, dtype = int) + p
+    front = gain[rows, front_t, front_p]
+
+    # the back is the same theta 180 degrees of azimuth away, or the opposite theta at the same azimuth
+    back_p, found = nearest(phi, phi[front_p] + 180., True)
+    back_t = front_t.copy()
+    mirror_t, mirror_found = nearest(theta, -theta[front_t])
+    use_mirror = ~found & mirror_found
+    back_t[use_mirror], back_p[use_mirror] = mirror_t[use_mirror], front_p[use_mirror]
+    fb = np.where(found | mirror_found, front - gain[rows, back_t, back_p], np.nan)
+
+    width_az, sidelobe_az = cut_stats(gain[rows, front_t, :count_p], front_p, step_p, periodic_p, beam_db)
+    cut, center, step_t, periodic_t = theta_cut(gain, theta, phi, front_t, front_p)
+    width_el, sidelobe_el = cut_stats(cut, center, step_t, periodic_t, beam_db)
+
+    out = {'peak_db': gain[rows, peak_t, peak_p], 'peak_theta': theta[peak_t], 'peak_phi': phi[peak_p],
+           'front_db': front, 'fb_db': fb, 'beamwidth_az': width_az, 'beamwidth_el': width_el,
+           'sidelobe_az_db': sidelobe_az, 'sidelobe_el_db': sidelobe_el}
+    nan = np.zeros(n) + np.nan
+    out['axial_ratio'] = out['co_db'] = out['cross_db'] = out['isolation_db'] = out['isolation_beam_db'] = nan
+    if e_theta is not None and e_phi is not None:
+        e_theta = np.asarray(e_theta).reshape(-1, nt, np_)
+        e_phi = np.asarray(e_phi).reshape(-1, nt, np_)
+        out['axial_ratio'] = axial_ratio(e_theta[rows, front_t, front_p], e_phi[rows, front_t, front_p])
+        if polarization is not None:
+            co, cross = polarization_fields(theta, phi, e_theta, e_phi, polarization)
+            # co and cross polarized shares of the total gain
+            total = power_db(np.hypot(np.abs(e_theta), np.abs(e_phi)))
+            co_db = gain + power_db(co) - total
+            cross_db = gain + power_db(cross) - total
+            out['co_db'] = co_db[rows, front_t, front_p]
+            out['cross_db'] = cross_db[rows, front_t, front_p]
+            out['isolation_db'] = out['co_db'] - out['cross_db']
+            beam = gain >= (front - beam_db)[:, np.newaxis, np.newaxis]
+            with np.errstate(invalid = 'ignore'):
+                isolation = np.where(beam, co_db - cross_db, np.inf).min(axis = (1, 2))
+            out['isolation_beam_db'] = np.where(np.isfinite(isolation), isolation, np.nan)
+    return dict((name, value.reshape(shape)) for name, value in out.items())
+
+def analyze_grids(theta, phi, grids, **options):
+    # analyze a stack of necout.PATTERN_DTYPE grids (..., n_theta, n_phi), options are those of analyze
+    return analyze(theta, phi, grids['total_db'], grids['e_theta'], grids['e_phi'], **options)
+
+def pattern_stack(result):
+    # the pattern of every frequency of a read_out result as (theta, phi, (n_freqs, n_theta, n_phi) grids)
+    tables = result['pattern']
+    theta, phi, grids = None, None, []
+    for table in tables:
+        t, p, grid = necout.pattern_grid(np.asarray(table))
+        if theta is not None and (not np.array_equal(t, theta) or not np.array_equal(p, phi)):
+            raise ValueError('the pattern grid changes between frequencies')
+        theta, phi = t, p
+        grids.append(grid)
+    if not grids:
+        return np.zeros(0), np.zeros(0), np.zeros((0, 0, 0), dtype = necout.PATTERN_DTYPE)
+    return theta, phi, np.array(grids)
+
+# -------------------------------------------------------------------------------------------
+# chunked evaluation
+# -------------------------------------------------------------------------------------------
+
+def analyze_stream(grids, chunk = CHUNK_GRIDS, **options):
+    # analyze (labels, theta, phi, grid) from an iterator a chunk of grids at a time, where labels is a dict
+    # of scalars that identify the grid (file, run, freq). returns the metrics and labels as (n_grids,) arrays
+    parts = []
+    batch = []
+
+    def flush():
+        if batch:
+            theta, phi = batch[0][1], batch[0][2]
+            r = analyze_grids(theta, phi, np.array([g for labels, t, p, g in batch]), **options)
+            for name in batch[0][0]:
+                r[name] = np.array([labels[name] for labels, t, p, g in batch])
+            parts.append(r)
+            del batch[:]
+
+    for labels, theta, phi, grid in grids:
+        if batch and (grid.shape != batch[0][3].shape or not np.array_equal(theta, batch[0][1])
+                      or not np.array_equal(phi, batch[0][2])):
+            flush()
+        batch.append((labels, theta, phi, grid))
+        if len(batch) >= chunk:
+            flush()
+    flush()
+    if not parts:
+        return dict((name, np.zeros(0)) for name in METRICS)
+    return dict((name, np.concatenate([p[name] for p in parts])) for name in parts[0])
+
+def file_grids(filenames):
+    # (labels, theta, phi, grid) of every frequency of every nec output file, read one frequency at a time
+    for i, filename in enumerate(filenames):
+        for r in necout.iter_frequencies(filename, ('pattern',)):
+            if 'pattern' in r:
+                theta, phi, grid = necout.pattern_grid(r['pattern'])
+                yield {'file': i, 'freq': r['freq']}, theta, phi, grid
+
+def store_grids(store, runs = None, chunk_runs = 16):
+    # (labels, theta, phi, grid) of every frequency of the given runs (all by default) of a results.ResultStore,
+    # reading the pattern table for chunk_runs runs at a time
+    if runs is None:
+        runs = store.column('run')
+    runs = np.asarray(runs, dtype = np.int64)
+    fields = [f[0] for f in necout.PATTERN_DTYPE]
+    for first in range(0, len(runs), chunk_runs):
+        t = store.table('pattern', runs[first:first + chunk_runs], columns = ['run', 'freq'] + fields)
+        order = np.lexsort((t['freq'], t['run']))
+        key = np.column_stack((t['run'][order], t['freq'][order]))
+        starts = np.nonzero(np.concatenate(([True], np.any(key[1:] != key[:-1], axis = 1))))[0]
+        stops = np.append(starts[1:], len(order))
+        for start, stop in zip(starts, stops):
+            rows = order[start:stop]
+            table = np.zeros(len(rows), dtype = necout.PATTERN_DTYPE)
+            for name in fields:
+                table[name] = t[name][rows]
+            theta, phi, grid = necout.pattern_grid(table)
+            yield {'run': int(key[start, 0]), 'freq': key[start, 1]}, theta, phi, grid
+
+def analyze_files(filenames, chunk = CHUNK_GRIDS, **options):
+    # metrics of every frequency of every nec output file, labelled by 'file' (index in filenames) and 'freq'
+    return analyze_stream(file_grids(filenames), chunk, **options)
+
+def analyze_store(store, runs = None, chunk = CHUNK_GRIDS, **options):
+    # metrics of every frequency of the given runs of a results.ResultStore, labelled by 'run' and 'freq'
+    return analyze_stream(store_grids(store, runs), chunk, **options)
@@ -0,0 +1,181 @@
+# jon klein
+# jtklein@alaska.edu
+# opt-in stage timers and peak memory sampling
+#
+# the generators, parsers and solver wrappers mark their stages with stage() or timed(). these cost
+# a function call while profiling is off, so they stay in production code. once enabled, every stage
+# accumulates its call count, wall and cpu time, and the peak resident memory seen while it ran,
+# sampled by a background thread every SAMPLE_S seconds. nested stages are each charged their own
+# time, so 'make_lpda_nec' includes the 'getText' inside it.
+#
+# the report is a json line per run (time, argv and one record per stage) appended to a file, for
+# tracking regressions over time next to the benchmark.py reports
+#
+# usage:
+#   SABRE_PROFILE=profile.jsonl python2 log_antenna.py   # written when the process exits
+# or from python:
+#   profiling.enable('profile.jsonl')
+#   with profiling.stage('my stage'):
+#       ...
+#   profiling.write_report()   # or at exit, if enable was given a path
+
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+import functools
+import contextlib
+
+PROFILE_ENV = 'SABRE_PROFILE' # report file, profiling is enabled at import when this is set
+SAMPLE_S = .01 # seconds between memory samples
+
+def current_rss():
+    # resident memory of this process in bytes, the peak so far where /proc isn't available
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def cpu_time():
+    t = os.times()
+    return t[0] + t[1]
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.sample_s = SAMPLE_S
+        self.lock = threading.Lock()
+        self.stages = {} # name -> accumulated record
+        self.unreported = False # stages were timed since the last report was written
+        self.active = [] # [name, peak rss] of the stages running now
+        self.sampler = None
+        self.stop = threading.Event()
+
+    def enable(self, path = None, sample_s = SAMPLE_S):
+        self.path = path
+        self.sample_s = sample_s
+        self.enabled = True
+        if sample_s and self.sampler is None:
+            self.stop.clear()
+            self.sampler = threading.Thread(target = self.sample)
+            self.sampler.daemon = True
+            self.sampler.start()
+
+    def disable(self):
+        self.enabled = False
+        if self.sampler is not None:
+            self.stop.set()
+            self.sampler.join()
+            self.sampler = None
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+
+    def sample(self):
+        while not self.stop.wait(self.sample_s):
+            rss = current_rss()
+            with self.lock:
+                for entry in self.active:
+                    entry[1] = max(entry[1], rss)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        entry = [name, current_rss()]
+        with self.lock:
+            self.active.append(entry)
+        wall, cpu = time.time(), cpu_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.time() - wall, cpu_time() - cpu
+            rss = current_rss()
+            with self.lock:
+                self.active.remove(entry)
+                record = self.stages.setdefault(name, {'stage': name, 'calls': 0, 'wall_s': 0., 'cpu_s': 0.,
+                                                       'max_wall_s': 0., 'peak_rss_bytes': 0})
+                record['calls'] += 1
+                record['wall_s'] += wall
+                record['cpu_s'] += cpu
+                record['max_wall_s'] = max(record['max_wall_s'], wall)
+                record['peak_rss_bytes'] = max(record['peak_rss_bytes'], entry[1], rss)
+                self.unreported = True
+
+    def report(self):
+        # one record per stage: calls, total and longest wall time, cpu time and peak rss, slowest first
+        with self.lock:
+            records = [dict(r) for r in self.stages.values()]
+        return sorted(records, key = lambda r: r['wall_s'], reverse = True)
+
+    def write_report(self, path = None, **context):
+        # append the report as one json line to path (the enable path by default), with any context given
+        path = path or self.path
+        if path is None:
+            return None
+        line = {'time': time.time(), 'argv': sys.argv, 'pid': os.getpid(), 'stages': self.report()}
+        line.update(context)
+        with open(path, 'a') as f:
+            f.write(json.dumps(line, sort_keys = True) + '\n')
+        self.unreported = False
+        return line
+
+PROFILER = Profiler()
+
+def enable(path = None, sample_s = SAMPLE_S):
+    PROFILER.enable(path, sample_s)
+
+def disable():
+    PROFILER.disable()
+
+def enabled():
+    return PROFILER.enabled
+
+def reset():
+    PROFILER.reset()
+
+def stage(name):
+    # context manager timing the code in it as stage name
+    return PROFILER.stage(name)
+
+def timed(name = None):
+    # decorator timing every call of a function as stage name (the function's name by default)
+    def decorate(function):
+        label = name or function.__name__
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return function(*args, **kwargs)
+            with PROFILER.stage(label):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def report():
+    return PROFILER.report()
+
+def write_report(path = None, **context):
+    return PROFILER.write_report(path, **context)
+
+def print_report(stream = sys.stdout):
+    stream.write('%-28s %8s %12s %12s %12s %12s\n' % ('stage', 'calls', 'wall (s)', 'cpu (s)', 'max (s)', 'peak (MB)'))
+    for r in report():
+        stream.write('%-28s %8d %12.3f %12.3f %12.3f %12.1f\n' % (r['stage'], r['calls'], r['wall_s'], r['cpu_s'],
+                                                                  r['max_wall_s'], r['peak_rss_bytes'] / 1e6))
+
+def write_at_exit():
+    if PROFILER.path is not None and PROFILER.unreported:
+        PROFILER.write_report()
+    # stop the sampler before the interpreter tears down the modules it uses
+    PROFILER.disable()
+
+atexit.register(write_at_exit)
+if os.environ.get(PROFILE_ENV):
+    enable(os.environ[PROFILE_ENV])
@@ -0,0 +1,292 @@
+# jon klein
+# jtklein@alaska.edu
+# columnar on-disk store of nec results, indexed by model parameters and deck hash
+#
+# sweep outputs used to be loose out/*.out files named after their decks, so every question across
+# a sweep meant parsing all of them again. a ResultStore keeps the parsed tables of every run in
+# columns: runs are buffered as they finish and written in chunks, one .npy file per column and
+# chunk, which queries memory map and read only for the chunks that hold the runs asked for.
+# an index (one json line per run) maps each run to its generator parameters (the sweep manifest
+# row), its deck's content hash (neccache.deck_key) and its chunk, so a run whose deck is already
+# stored is skipped, and runs are selected with vectorized comparisons on the parameter columns.
+#
+# tables, one row per
+#   inputs  - run, frequency and source: run, freq and the fields of necout.INPUT_DTYPE
+#   pattern - run, frequency and far field point: run, freq and the fields of necout.PATTERN_DTYPE
+#
+# usage:
+#   store = ResultStore('results')
+#   ingest(store, ['necfiles/' + r['filename'] for r in rows], 'out', rows)  # rows from sweep.run_sweep
+#   runs = store.select(usepole = True, ground = True)
+#   t = store.table('inputs', runs, freq = 10, columns = ('run', 'impedance'))
+#   store.params(t['run'], 'feedangle'), adaptivesweep.vswr(t['impedance'])
+#
+# command line, appending every deck of a sweep manifest whose output exists:
+#   python2 results.py ingest results out necfiles/manifest.json
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import numpy as np
+import necout
+import neccache
+
+INDEX_NAME = 'index.jsonl'
+CHUNK_RUNS = 64 # runs buffered before they are written as a chunk
+
+TABLES = {
+    'inputs': necout.INPUT_DTYPE,
+    'pattern': necout.PATTERN_DTYPE,
+}
+
+def plain(value):
+    # numpy values to plain python types for the json index
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return value
+
+def read_result(filename, sections = ('inputs', 'pattern')):
+    # necout.read_out, but with an empty table for a frequency a section is missing at, so every
+    # table still lines up with its frequency
+    freqs, tables = [], dict((name, []) for name in sections)
+    for result in necout.iter_frequencies(filename, sections):
+        freqs.append(result['freq'])
+        for name in sections:
+            tables[name].append(result.get(name, np.zeros(0, dtype = TABLES[name])))
+    tables['freq'] = np.array(freqs)
+    return tables
+
+def flatten(result, name):
+    # one record per frequency and row of a read_out section, as a dict of columns with run and freq
+    freqs = result['freq']
+    tables = result.get(name, [])
+    if not len(tables):
+        return None
+    if len(tables) != len(freqs):
+        raise ValueError('%d %s tables for %d frequencies' % (len(tables), name, len(freqs)))
+    tables = [np.asarray(t).reshape(-1) for t in tables]
+    rows = np.concatenate(tables)
+    columns = {'freq': np.repeat(freqs, [len(t) for t in tables])}
+    for field in rows.dtype.names:
+        columns[field] = rows[field]
+    return columns
+
+class ResultStore:
+    def __init__(self, path, chunk_runs = CHUNK_RUNS):
+        self.path = path
+        self.chunk_runs = chunk_runs
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.runs = []       # index rows, in run order
+        self.hashes = {}     # deck hash -> run
+        self.positions = {}  # run -> its row in self.runs
+        self.next_run = 0
+        self.next_chunk = 0
+        self.pending = []    # (index row, {table: columns}) not yet written
+        self.read_index()
+
+    def index_file(self):
+        return os.path.join(self.path, INDEX_NAME)
+
+    def chunk_dir(self, chunk):
+        return os.path.join(self.path, 'chunk%06d' % chunk)
+
+    def read_index(self):
+        self.runs = []
+        if os.path.isfile(self.index_file()):
+            with open(self.index_file(), 'r') as f:
+                for line in f:
+                    try:
+                        row = json.loads(line)
+                    except ValueError:
+                        # a line cut short by an interrupted append
+                        continue
+                    if os.path.isdir(self.chunk_dir(row['chunk'])):
+                        self.runs.append(row)
+        self.hashes = dict((row['hash'], row['run']) for row in self.runs)
+        self.positions = dict((row['run'], i) for i, row in enumerate(self.runs))
+        self.next_run = max([row['run'] for row in self.runs] + [-1]) + 1
+        # a chunk the index doesn't reference was written by a flush interrupted before its index append,
+        # its runs weren't recorded, so it's removed rather than left to collide with the next chunk
+        indexed = set(row['chunk'] for row in self.runs)
+        chunks = []
+        for name in os.listdir(self.path):
+            if name.startswith('chunk') and name[len('chunk'):].isdigit():
+                chunk = int(name[len('chunk'):])
+                if chunk in indexed:
+                    chunks.append(chunk)
+                else:
+                    shutil.rmtree(self.chunk_dir(chunk), ignore_errors = True)
+        self.next_chunk = max(chunks + [-1]) + 1
+
+    def __len__(self):
+        return len(self.runs) + len(self.pending)
+
+    def contains(self, deck_hash):
+        return deck_hash in self.hashes or any(row['hash'] == deck_hash for row, tables in self.pending)
+
+    def add(self, params, result, deck_hash, deck = None):
+        # append one run: params (dict of generator parameters), result (necout.read_out or read_shards) and the
+        # content hash of its deck. a run whose deck hash is already stored is skipped
+        # returns the run number, or None if it was skipped
+        if self.contains(deck_hash):
+            return None
+        run = self.next_run + len(self.pending)
+        row = {'run': run, 'hash': deck_hash, 'deck': deck, 'chunk': self.next_chunk, 'nfreq': len(result['freq']),
+               'time': time.time(), 'params': dict((k, plain(v)) for k, v in params.items())}
+        tables = {}
+        for name in TABLES:
+            columns = flatten(result, name) if name in result else None
+            if columns is not None:
+                columns['run'] = np.zeros(len(columns['freq']), dtype = np.int64) + run
+                tables[name] = columns
+        self.pending.append((row, tables))
+        if len(self.pending) >= self.chunk_runs:
+            self.flush()
+        return run
+
+    def add_output(self, deck, out, params = None, sections = ('inputs', 'pattern')):
+        # parse and append the nec output file of a deck, see add
+        return self.add(params or {}, read_result(out, sections), neccache.deck_file_key(deck), deck)
+
+    def flush(self):
+        # write the pending runs as one chunk, then append them to the index
+        if not self.pending:
+            return
+        chunk = self.pending[0][0]['chunk']
+        tmp = tempfile.mkdtemp(dir = self.path, prefix = '.chunk')
+        try:
+            for name in TABLES:
+                parts = [tables[name] for row, tables in self.pending if name in tables]
+                if not parts:
+                    continue
+                for column in parts[0]:
+                    np.save(os.path.join(tmp, '%s.%s.npy' % (name, column)),
+                            np.concatenate([p[column] for p in parts]))
+            os.rename(tmp, self.chunk_dir(chunk))
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors = True)
+            raise
+        self.next_chunk = chunk + 1
+        with open(self.index_file(), 'a') as f:
+            for row, tables in self.pending:
+                f.write(json.dumps(row, sort_keys = True) + '\n')
+                self.positions[row['run']] = len(self.runs)
+                self.runs.append(row)
+                self.hashes[row['hash']] = row['run']
+        self.next_run += len(self.pending)
+        self.pending = []
+
+    def close(self):
+        self.flush()
+
+    # -------------------------------------------------------------------------------------------
+    # queries
+    # -------------------------------------------------------------------------------------------
+
+    def rows(self, runs):
+        # positions in self.runs (and in column) of the given run numbers. runs are numbered as they were added
+        # and a run dropped from the index leaves a gap, so a run number isn't its position
+        try:
+            return np.array([self.positions[run] for run in np.asarray(runs, dtype = np.int64).reshape(-1)],
+                            dtype = np.int64)
+        except KeyError as e:
+            raise ValueError('run %d is not stored' % e.args[0])
+
+    def column(self, name):
+        # a parameter (or index field: run, hash, deck, chunk, nfreq) of every stored run as an array, in the
+        # order of self.runs, None where a run doesn't have it. list valued parameters come back as an object array
+        self.flush()
+        values = [row[name] if name in row else row['params'].get(name) for row in self.runs]
+        if any(isinstance(v, list) for v in values):
+            column = np.empty(len(values), dtype = object)
+            column[:] = values
+            return column
+        return np.array(values)
+
+    def select(self, **where):
+        # numbers of the runs whose parameters match every condition: a value (equality), a list or tuple of
+        # values, or a callable taking the column array and returning a boolean mask
+        self.flush()
+        keep = np.ones(len(self.runs), dtype = bool)
+        for name, condition in where.items():
+            column = self.column(name)
+            if callable(condition):
+                keep &= np.asarray(condition(column), dtype = bool)
+            elif isinstance(condition, (list, tuple)) and column.dtype != object:
+                keep &= np.in1d(column, condition)
+            else:
+                keep &= np.array([v == condition for v in column], dtype = bool)
+        return self.column('run')[keep].astype(np.int64)
+
+    def params(self, runs, name):
+        # parameter name of each of the given runs (e.g. the run column of a table)
+        self.flush()
+        return self.column(name)[self.rows(runs)]
+
+    def table(self, name, runs = None, freq = None, columns = None, tolerance = 1e-6):
+        # rows of table name for the given runs (all if None), at the given frequency or frequencies (MHz, all
+        # if None), as a dict of column arrays. only the chunks holding those runs are read
+        self.flush()
+        if runs is None:
+            runs = self.column('run')
+        runs = np.asarray(runs, dtype = np.int64).reshape(-1)
+        chunks = np.unique(self.column('chunk')[self.rows(runs)]) if len(runs) else []
+        names = list(columns) if columns is not None else ['run', 'freq'] + [f[0] for f in TABLES[name]]
+        parts = dict((c, []) for c in names)
+        for chunk in chunks:
+            folder = self.chunk_dir(chunk)
+            load = lambda c: np.load(os.path.join(folder, '%s.%s.npy' % (name, c)), mmap_mode = 'r')
+            if not os.path.isfile(os.path.join(folder, '%s.run.npy' % name)):
+                continue
+            keep = np.in1d(load('run'), runs)
+            if freq is not None:
+                f = load('freq')
+                keep &= np.any(np.abs(f[:, np.newaxis] - np.atleast_1d(freq)[np.newaxis]) <= tolerance, axis = 1)
+            index = np.nonzero(keep)[0]
+            for c in names:
+                parts[c].append(np.asarray(load(c)[index]))
+        out = {}
+        for c in names:
+            out[c] = np.concatenate(parts[c]) if parts[c] else np.zeros(0, dtype = dtype_of(name, c))
+        return out
+
+def dtype_of(name, column):
+    # numpy dtype of a column of table name
+    fields = dict([(f[0], f[1]) for f in TABLES[name]] + [('run', np.int64), ('freq', np.float64)])
+    return fields[column]
+
+def ingest(store, decks, outdir, manifest = None):
+    # append every deck whose output (outdir/DECK.out) exists and isn't stored yet, with its parameters from
+    # manifest rows (sweep.run_sweep, matched by file name). returns the run numbers added
+    params = dict((row['filename'], dict((k, v) for k, v in row.items() if k != 'filename'))
+                  for row in manifest or [])
+    added = []
+    for deck in decks:
+        out = os.path.join(outdir, os.path.basename(deck) + '.out')
+        if not os.path.isfile(out) or store.contains(neccache.deck_file_key(deck)):
+            continue
+        run = store.add_output(deck, out, params.get(os.path.basename(deck), {}))
+        if run is not None:
+            added.append(run)
+    store.flush()
+    return added
+
+def main(argv):
+    if len(argv) == 4 and argv[0] == 'ingest':
+        with open(argv[3], 'r') as f:
+            rows = json.load(f)
+        folder = os.path.dirname(argv[3])
+        store = ResultStore(argv[1])
+        added = ingest(store, [os.path.join(folder, row['filename']) for row in rows], argv[2], rows)
+        print('%d runs added, %d stored' % (len(added), len(store)))
+    else:
+        sys.stderr.write('usage: results.py ingest STORE OUTDIR MANIFEST.json\n')
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,412 @@
+# jon klein
+# jtklein@alaska.edu
+# memory aware scheduler for running nec2 over many decks on one machine
+#
+# replaces a fixed `parallel -j N` job count. each deck's peak memory and run time are
+# estimated from its segment, wire and frequency counts, and jobs are packed against a ram
+# and core budget, largest first. failed runs are retried, and the wall time and peak rss
+# of every run are appended to a json lines log, which is also used to calibrate the
+# run time estimate on the next invocation.
+#
+# the solver is a command template, {deck} and {out} are replaced by the deck and output
+# paths, so any local engine (or a stub that just writes an output file) can stand in for nec/mp:
+#   python2 scheduler.py --ram 6G --cores 5 out *.nec
+#   python2 scheduler.py --solver 'cp {deck} {out}' out *.nec
+# with --results, every finished run is appended to a results.ResultStore, with its parameters
+# from the sweep manifest given by --manifest:
+#   python2 scheduler.py --results results --manifest necfiles/manifest.json out necfiles/*.nec
+#
+# a job can also be given its deck as a generator of card text (job_from_cards, e.g. from
+# Model.iterSweepText) instead of a file. the cards are then streamed to the solver as they are
+# made, through a fifo that stands in for {deck}, or the solver's stdin if the template has no
+# {deck}, and only written to disk if the job has an archive path. see sweep.stream_sweep.
+
+import os
+import sys
+import time
+import json
+import errno
+import fcntl
+import shlex
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import neccache
+import profiling
+import results
+
+SOLVER = 'wine nec2mp/nec2dxs11k.exe {deck} {out}'
+JOB_LOG = 'jobs.jsonl'
+
+# memory model, nec2dxs11k statically allocates its arrays for up to 11k segments (~0.9 gb per
+# process, see simulate.sh) and the interaction matrix is N^2 double precision complex on top of that
+BASE_BYTES = 900e6
+BYTES_PER_MATRIX_ENTRY = 16
+
+# run time model, seconds = overhead + per frequency (fill * N^2 + solve * N^3)
+OVERHEAD_S = 2.
+FILL_S = 2e-7
+SOLVE_S = 3e-9
+
+FIFO_POLL_S = .01 # how often a card feeder checks whether the solver has opened its fifo
+
+def parse_size(text):
+    # parse a size like 8G, 512M or 1e9 to bytes
+    units = {'K': 1e3, 'M': 1e6, 'G': 1e9, 'T': 1e12}
+    text = str(text).strip().upper().rstrip('B')
+    if text and text[-1] in units:
+        return float(text[:-1]) * units[text[-1]]
+    return float(text)
+
+def deck_counts(filename):
+    # returns (wires, segments, frequencies) of a nec deck, counting the wires GX, GR and GM cards replicate and
+    # the frequencies of every FR card (a port matrix deck has one per frequency)
+    tags, counts = [], [] # tag and segment count of every wire of the structure so far
+    freqs = 0
+    with open(filename, 'r') as f:
+        for line in f:
+            fields = line.replace(',', ' ').split()
+            if not fields:
+                continue
+            card = fields[0].upper()
+            values = [int(float(v)) for v in fields[1:4] if is_number(v)]
+            if card in ('GW', 'GA', 'GH') and len(values) > 1:
+                tags.append(values[0])
+                counts.append(values[1])
+            elif card == 'GX' and len(values) > 1:
+                # a reflection for each nonzero digit of I2, the tag increment doubles with each one
+                increment = values[0]
+                for digit in str(abs(values[1])):
+                    if digit != '0':
+                        tags, counts = tags + [t + increment if t else 0 for t in tags], counts * 2
+                        increment *= 2
+            elif card == 'GR' and len(values) > 1:
+                # I2 copies of the structure in all, tags incremented by I1 for each
+                tags, counts = replicate(tags, counts, values[0], values[1] - 1)
+            elif card == 'GM' and len(values) > 1 and values[1] > 0:
+                # I2 more copies of the wires from tag ITS (the last field) on
+                its = int(float(fields[9])) if len(fields) > 9 and is_number(fields[9]) else 0
+                tags, counts = replicate(tags, counts, values[0], values[1], its)
+            elif card == 'FR' and len(values) > 1:
+                freqs += max(1, values[1])
+    return len(tags), sum(counts), max(freqs, 1)
+
+def is_number(text):
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
+
+def replicate(tags, counts, increment, copies, first = 0):
+    # tags and segment counts after copies more copies of the wires from tag first on
+    source = [(t, n) for t, n in zip(tags, counts) if t >= first]
+    for k in range(1, copies + 1):
+        tags = tags + [t + k * increment if t else 0 for t, n in source]
+        counts = counts + [n for t, n in source]
+    return tags, counts
+
+class Job:
+    def __init__(self, deck, out, wires, segments, freqs, cards = None, archive = None):
+        self.deck = deck
+        self.out = out
+        self.wires = wires
+        self.segments = segments
+        self.freqs = freqs
+        # cards, if given, is called for each attempt and returns the deck text in blocks, which are streamed
+        # to the solver instead of it reading deck. archive is a file the streamed deck is also written to
+        self.cards = cards
+        self.archive = archive
+        self.attempts = 0
+        self.est_mem = estimate_memory(segments)
+        self.est_time = estimate_runtime(segments, freqs)
+
+def job_from_deck(deck, outdir):
+    wires, segments, freqs = deck_counts(deck)
+    return Job(deck, os.path.join(outdir, os.path.basename(deck) + '.out'), wires, segments, freqs)
+
+def job_from_model(model, deck, outdir, freqs):
+    return Job(deck, os.path.join(outdir, os.path.basename(deck) + '.out'),
+               model.getWireCount(), model.getSegmentCount(), freqs)
+
+def job_from_cards(cards, name, outdir, wires, segments, freqs, archive = None):
+    # a job that streams its deck, cards is a function returning the blocks of deck text (see nec2utils.iterDeck)
+    # name labels the run in records and names the output, outdir/name.out
+    return Job(archive or name, os.path.join(outdir, os.path.basename(name) + '.out'), wires, segments, freqs,
+               cards, archive)
+
+def solver_cache(solver = SOLVER):
+    # the output cache of a solver command template. outputs of any solver but SOLVER are keyed apart, so a stub
+    # or another engine never stands in for a real nec2dxs11k run
+    salt = neccache.CACHE_SALT if solver == SOLVER else '%s %s' % (neccache.CACHE_SALT, solver)
+    return neccache.NecCache(salt = salt)
+
+def estimate_memory(segments, base = BASE_BYTES, per_entry = BYTES_PER_MATRIX_ENTRY):
+    # estimated peak memory in bytes of a nec run
+    return base + per_entry * float(segments) ** 2
+
+def estimate_runtime(segments, freqs, overhead = OVERHEAD_S, fill = FILL_S, solve = SOLVE_S):
+    # estimated wall time in seconds of a nec run
+    n = float(segments)
+    return overhead + freqs * (fill * n ** 2 + solve * n ** 3)
+
+def calibrate(records):
+    # scale factor between measured and estimated run times in a job log, 1 if there is no history
+    pairs = [(r['wall_s'], r['est_time']) for r in records if r.get('status') == 0 and r.get('est_time')]
+    if not pairs:
+        return 1.
+    return sum(w for w, e in pairs) / sum(e for w, e in pairs)
+
+def read_log(path):
+    records = []
+    if os.path.isfile(path):
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    return records
+
+def solver_command(solver, job, deck = None):
+    # deck replaces {deck} instead of the job's deck file, e.g. the fifo its cards are streamed through
+    deck = job.deck if deck is None else deck
+    return [arg.format(deck = deck, out = job.out) for arg in shlex.split(solver)]
+
+class CardFeeder(threading.Thread):
+    # writes the streamed deck of a job to the solver, into a fifo or the solver's stdin, and to the job's
+    # archive file if it has one. error is set if the deck couldn't be written for any reason other than
+    # the solver closing its end early (it's the solver's exit status that says if that was a failure)
+    def __init__(self, job, fifo = None, stdin = None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.job = job
+        self.fifo = fifo
+        self.stdin = stdin
+        self.done = threading.Event() # set once the solver has exited
+        self.error = None
+
+    def open_fifo(self):
+        # opening a fifo for writing blocks until there is a reader, so poll without blocking until the
+        # solver opens it, or give up if it exits without doing so
+        while not self.done.is_set():
+            try:
+                fd = os.open(self.fifo, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError as e:
+                if e.errno != errno.ENXIO:
+                    raise
+                time.sleep(FIFO_POLL_S)
+                continue
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags & ~os.O_NONBLOCK)
+            return os.fdopen(fd, 'w')
+        return None
+
+    def run(self):
+        stream = archive = None
+        try:
+            if self.job.archive is not None:
+                archive = open(self.job.archive, 'w')
+            stream = self.stdin if self.fifo is None else self.open_fifo()
+            if stream is None and archive is None:
+                return
+            for block in self.job.cards():
+                if archive is not None:
+                    archive.write(block)
+                if stream is not None:
+                    try:
+                        stream.write(block)
+                    except IOError as e:
+                        if e.errno != errno.EPIPE:
+                            raise
+                        stream = None
+            if stream is not None:
+                stream.close()
+        except Exception as e:
+            self.error = e
+        finally:
+            if archive is not None:
+                archive.close()
+            if stream is not None and not stream.closed:
+                try:
+                    stream.close()
+                except IOError:
+                    pass
+
+def start_solver(solver, job, fifo_dir):
+    # start the solver on a job, returns (process, card feeder or None)
+    # close_fds, so no solver holds on to the stdin pipe of another and keeps it from seeing the end of its deck
+    if job.cards is None:
+        return subprocess.Popen(solver_command(solver, job), close_fds = True), None
+    if '{deck}' in solver:
+        fifo = os.path.join(fifo_dir, '%d_%s' % (job.attempts, os.path.basename(job.deck)))
+        os.mkfifo(fifo)
+        feeder = CardFeeder(job, fifo = fifo)
+        proc = subprocess.Popen(solver_command(solver, job, fifo), close_fds = True)
+    else:
+        proc = subprocess.Popen(solver_command(solver, job), stdin = subprocess.PIPE, close_fds = True)
+        feeder = CardFeeder(job, stdin = proc.stdin)
+    feeder.start()
+    return proc, feeder
+
+def job_record(job, code, wall, peak_rss, scale):
+    return {'deck': job.deck, 'out': job.out, 'status': code, 'attempts': job.attempts,
+            'wall_s': wall, 'peak_rss_bytes': peak_rss, 'segments': job.segments, 'wires': job.wires,
+            'freqs': job.freqs, 'est_mem': job.est_mem, 'est_time': job.est_time,
+            'predicted_s': job.est_time * scale, 'time': time.time()}
+
+def run_jobs(jobs, ram = 4e9, cores = 4, solver = SOLVER, retries = 1, log = None, on_success = None):
+    # run jobs with at most `cores` at once and their estimated memory summed below `ram`
+    # a job estimated to need more than the whole budget runs alone
+    # returns a list of per-job records (deck, status, attempts, wall time, peak rss, estimates)
+    if cores < 1:
+        raise ValueError('cores must be at least 1, got %r' % (cores,))
+
+    # estimates are scaled by how far off they were in previous runs
+    scale = 1.
+    if log is not None:
+        scale = calibrate(read_log(log))
+
+    # longest first, so the big runs don't end up alone at the tail of the schedule
+    pending = sorted(jobs, key = lambda j: (j.est_time, j.est_mem), reverse = True)
+    running = {}
+    feeders = {}
+    records = []
+    # fifos of jobs whose cards are streamed
+    fifo_dir = tempfile.mkdtemp(prefix = 'necfifo') if any(job.cards is not None for job in jobs) else None
+
+    def finish(job, code, wall, peak_rss):
+        record = job_record(job, code, wall, peak_rss, scale)
+        records.append(record)
+        if log is not None:
+            with open(log, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+        if code == 0 and on_success is not None:
+            on_success(job)
+
+    try:
+        with profiling.stage('run_jobs'):
+            return schedule(pending, running, feeders, fifo_dir, ram, cores, solver, retries, finish, records)
+    finally:
+        # only left running if the loop raised, don't leave them to run on unwatched
+        for job, proc, start in running.values():
+            try:
+                proc.kill()
+                proc.wait()
+            except OSError:
+                pass
+        if fifo_dir is not None:
+            shutil.rmtree(fifo_dir, ignore_errors = True)
+
+def schedule(pending, running, feeders, fifo_dir, ram, cores, solver, retries, finish, records):
+    # the run loop of run_jobs
+    while pending or running:
+        mem_used = sum(job.est_mem for job, proc, start in running.values())
+        i = 0
+        while i < len(pending) and len(running) < cores:
+            job = pending[i]
+            if running and mem_used + job.est_mem > ram:
+                i += 1
+                continue
+            del pending[i]
+            job.attempts += 1
+            try:
+                proc, feeder = start_solver(solver, job, fifo_dir)
+            except OSError as e:
+                # the solver can't be started at all, retrying won't help
+                sys.stderr.write('could not start solver for %s: %s\n' % (job.deck, e))
+                finish(job, 127, 0., 0)
+                continue
+            running[proc.pid] = (job, proc, time.time())
+            if feeder is not None:
+                feeders[proc.pid] = feeder
+            mem_used += job.est_mem
+
+        if not running:
+            continue
+
+        # wait for any child, wait4 gives the peak rss of that run
+        pid, status, usage = os.wait4(-1, 0)
+        if pid not in running:
+            continue
+        job, proc, start = running.pop(pid)
+        wall = time.time() - start
+        code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+        proc.returncode = code
+        feeder = feeders.pop(pid, None)
+        if feeder is not None:
+            feeder.done.set()
+            feeder.join()
+            if feeder.fifo is not None and os.path.exists(feeder.fifo):
+                os.remove(feeder.fifo)
+            if feeder.error is not None:
+                sys.stderr.write('could not stream the deck of %s: %s\n' % (job.deck, feeder.error))
+                code = code or 1
+        if code == 0 and not os.path.isfile(job.out):
+            sys.stderr.write('solver exited 0 without writing %s\n' % job.out)
+            code = 1
+
+        if code != 0 and job.attempts <= retries:
+            pending.append(job)
+            continue
+        finish(job, code, wall, usage.ru_maxrss * 1024)
+    return records
+
+def main(argv):
+    parser = argparse.ArgumentParser(description = 'run nec2 over decks within a ram and core budget')
+    parser.add_argument('outdir', help = 'folder for the nec output files')
+    parser.add_argument('decks', nargs = '*', help = 'nec decks to run')
+    parser.add_argument('--ram', default = '4G', help = 'memory budget, e.g. 6G (default 4G)')
+    parser.add_argument('--cores', type = int, default = 4, help = 'maximum concurrent runs (default 4)')
+    parser.add_argument('--solver', default = os.environ.get('NEC_SOLVER', SOLVER),
+                        help = 'solver command template with {deck} and {out} (default %(default)s)')
+    parser.add_argument('--retries', type = int, default = 1, help = 'retries of a failed run (default 1)')
+    parser.add_argument('--no-cache', action = 'store_true', help = 'rerun decks even if their output is cached')
+    parser.add_argument('--results', help = 'results store to append finished runs to')
+    parser.add_argument('--manifest', help = 'sweep manifest with the parameters of the decks, for --results')
+    args = parser.parse_args(argv)
+    if args.cores < 1:
+        parser.error('--cores must be at least 1')
+
+    if not os.path.isdir(args.outdir):
+        os.makedirs(args.outdir)
+
+    decks = args.decks
+    store = None
+    if not args.no_cache:
+        cache = solver_cache(args.solver)
+        decks = neccache.restore(args.outdir, decks, cache)
+        store = lambda job: neccache.store(job.deck, job.out, cache)
+
+    if args.results:
+        manifest = []
+        if args.manifest:
+            with open(args.manifest, 'r') as f:
+                manifest = json.load(f)
+        params = dict((row['filename'], row) for row in manifest)
+        db = results.ResultStore(args.results)
+        cache_store = store
+
+        def store(job):
+            if cache_store is not None:
+                cache_store(job)
+            row = dict(params.get(os.path.basename(job.deck), {}))
+            row.pop('filename', None)
+            db.add_output(job.deck, job.out, row)
+
+    jobs = [job_from_deck(deck, args.outdir) for deck in decks]
+    records = run_jobs(jobs, parse_size(args.ram), args.cores, args.solver, args.retries,
+                       log = os.path.join(args.outdir, JOB_LOG), on_success = store)
+    if args.results:
+        # decks restored from the cache never ran, this appends those not stored yet and writes the last chunk
+        results.ingest(db, args.decks, args.outdir, manifest)
+
+    failed = [r['deck'] for r in records if r['status'] != 0]
+    for deck in failed:
+        sys.stderr.write('nec run failed: %s\n' % deck)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,143 @@
+# jon klein
+# jtklein@alaska.edu
+# adaptive segmentation policy for lpda models
+#
+# instead of one global segment length of lambda_min/300 for every wire, each wire gets a
+# nominal segment length from the wavelength it matters at:
+#   dipole elements - segments per wavelength at the element's own half wave resonance, so
+#                     the long rear elements are segmented for the low end of the band
+#   feed network    - segments per wavelength at the top frequency, these wires are short,
+#                     closely spaced and carry the feed and coil loads
+#   tower and boom  - coarser, they are not resonant in the band
+# no segment is ever longer than lambda_min / min_density (0.05 wavelength by default).
+#
+# where a wire meets finer wires at a junction (a dipole meeting its feed connection), its
+# segments are tapered with a GC card from the junction segment length up to its nominal
+# length, so adjacent segments across the junction are the same length. the junction segment
+# length is also kept at least min_length_radius times the thickest radius at the junction,
+# which is the stepped radius correction: a step in radius never coincides with a segment
+# that is too short for the thin-wire kernel of the thicker wire.
+#
+# the nec2 guidelines are from the NEC-2 user's guide, part III, "segmentation" and
+# http://www.antennex.com/w4rnl/col0100/amod23.htm for lpda specifics
+
+import numpy as np
+
+C = 299792458.0
+
+class SegmentationPolicy:
+    def __init__(self, max_freq, element_density = 100., feed_density = 300., structure_density = 50.,
+                 min_density = 20., max_taper = 1.3, min_length_radius = 2., junction_tolerance = 1e-6):
+        # max_freq - highest frequency to be modeled (Hz)
+        # element_density - segments per wavelength at each dipole element's resonance
+        # feed_density - segments per wavelength at max_freq on feed lines and coil connections
+        # structure_density - segments per wavelength at max_freq on the tower and boom
+        # min_density - segments per wavelength at max_freq that no wire may fall below
+        # max_taper - largest length ratio between neighbouring segments of a tapered wire
+        # min_length_radius - smallest segment length / radius at a junction (2 is the extended kernel limit)
+        # junction_tolerance - wire ends closer than this (m) are treated as one junction
+        self.lambda_min = C / max_freq
+        self.element_density = element_density
+        self.feed_density = feed_density
+        self.structure_density = structure_density
+        self.min_density = min_density
+        self.max_taper = max_taper
+        self.min_length_radius = min_length_radius
+        self.junction_tolerance = junction_tolerance
+
+    def element_length(self, elem_len):
+        # nominal segment length of a dipole element of total length elem_len, resonant at a wavelength of 2 * elem_len
+        return np.minimum(2. * np.asarray(elem_len, dtype = float) / self.element_density, self.max_length())
+
+    def feed_length(self):
+        return min(self.lambda_min / self.feed_density, self.max_length())
+
+    def structure_length(self):
+        return min(self.lambda_min / self.structure_density, self.max_length())
+
+    def max_length(self):
+        return self.lambda_min / self.min_density
+
+    def junction_lengths(self, start, stop, radius, nominal):
+        # segment length wanted next to each wire end, the finest nominal length of all the wires
+        # meeting there, but no shorter than min_length_radius times the thickest radius there
+        n = len(start)
+        ends = np.vstack((start, stop))
+        keys = np.round(ends / self.junction_tolerance).astype(np.int64)
+        uniq, inverse = np.unique(keys, axis = 0, return_inverse = True)
+        inverse = inverse.ravel()
+
+        finest = np.full(len(uniq), np.inf)
+        np.minimum.at(finest, inverse, np.tile(nominal, 2))
+        thickest = np.zeros(len(uniq))
+        np.maximum.at(thickest, inverse, np.tile(radius, 2))
+        target = np.maximum(finest, self.min_length_radius * thickest)[inverse]
+
+        # a wire end that touches nothing else needs no refinement
+        count = np.bincount(inverse, minlength = len(uniq))[inverse]
+        target[count < 2] = np.inf
+        return target[:n], target[n:]
+
+    def segment(self, start, stop, radius, nominal, fixed = None):
+        # choose segment counts and tapers for a batch of wires
+        #   start, stop - (n, 3) wire endpoints
+        #   radius, nominal - per wire radius and nominal segment length
+        #   fixed - mask of wires that must stay uniformly segmented (fed or loaded at their middle segment)
+        # returns segment counts, taper ratios (0 for uniform, see Model.gc) and a mask of wires whose
+        # ends should be swapped so that the tapered end comes first
+        start = np.asarray(start, dtype = float).reshape(-1, 3)
+        stop = np.asarray(stop, dtype = float).reshape(-1, 3)
+        n = len(start)
+        radius = np.broadcast_to(np.asarray(radius, dtype = float), (n,))
+        nominal = np.minimum(np.broadcast_to(np.asarray(nominal, dtype = float), (n,)), self.max_length())
+        if fixed is None:
+            fixed = np.zeros(n, dtype = bool)
+
+        length = np.sqrt(np.sum((stop - start) ** 2, axis = 1))
+        counts = np.maximum(1, np.ceil(length / nominal)).astype(np.int64)
+        taper = np.zeros(n)
+
+        first, last = self.junction_lengths(start, stop, radius, nominal)
+        uniform = length / counts
+        need_first = first < uniform * (1 - 1e-9)
+        need_last = last < uniform * (1 - 1e-9)
+        flip = need_last & ~need_first & ~fixed
+        tapered = (need_first | need_last) & ~fixed
+        d0 = np.where(flip, last, first)[tapered]
+
+        n_taper, r = self.taper(length[tapered], d0, nominal[tapered])
+        counts[tapered] = n_taper
+        taper[tapered] = np.where(r > 1, r, 0.)
+        return counts, taper, flip
+
+    def taper(self, length, d0, dmax):
+        # fewest segments for wires of the given lengths whose first segment is d0, with each segment
+        # at most max_taper times the previous one and none longer than dmax
+        # returns segment counts and length ratios
+        n = np.maximum(1, np.ceil(length / dmax)).astype(np.int64)
+        limit = np.maximum(n, np.ceil(length / d0)).astype(np.int64)
+        r = np.ones(len(length))
+        todo = np.ones(len(length), dtype = bool)
+        while todo.any():
+            r[todo] = taper_ratio(length[todo], d0[todo], n[todo])
+            ok = (r <= self.max_taper) & (d0 * r ** (n - 1) <= dmax * (1 + 1e-9))
+            todo = ~ok & (n < limit)
+            n[todo] += 1
+        return n, r
+
+def taper_ratio(length, d0, n, iterations = 60):
+    # ratio r >= 1 such that n segments starting at d0 and growing by r add up to length, by bisection
+    # d0 * (r^n - 1) / (r - 1) is increasing in r, and equals d0 * n at r = 1
+    length, d0, n = np.broadcast_arrays(np.asarray(length, dtype = float), np.asarray(d0, dtype = float),
+                                        np.asarray(n, dtype = float))
+    lo = np.ones(len(length))
+    # at this ratio the last segment alone is as long as the wire
+    hi = np.maximum((length / d0) ** (1. / np.maximum(n - 1, 1)), 1.)
+    for i in range(iterations):
+        mid = (lo + hi) / 2
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            total = np.where(mid > 1, d0 * (mid ** n - 1) / (mid - 1), d0 * n)
+        short = total < length
+        lo = np.where(short, mid, lo)
+        hi = np.where(short, hi, mid)
+    return np.where(d0 * n >= length, 1., hi)
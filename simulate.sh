@@ -1,5 +1,6 @@
-# runs nec2/mp over multiple files in parallel
+# runs nec2/mp over multiple files in parallel, packing runs into the ram and core budget (see scheduler.py)
 # ram usage for running 4 at once is ~4 gb, loads ~60% of a i7-4700hq on average
 # view out files with xnecview -z0 100 -log {filename}
+# decks whose normalized content is already in the output cache (see neccache.py) are not rerun
 python2 log_antenna.py
-find *.nec | parallel -j 5 'wine nec2mp/nec2dxs11k.exe {} out/{}.out'
+python2 scheduler.py --ram 5G --cores 5 out *.nec
@@ -0,0 +1,102 @@
+# jon klein
+# jtklein@alaska.edu
+# superposition of single port nec runs into arbitrary multi-port excitations
+#
+# a model is linear in its sources, so a model with P feed ports only needs P nec runs, one
+# per port with 1 V on that port and the others shorted (see log_antenna.make_lpda_port_necs).
+# the segment currents, port currents and far fields of any other set of port voltages are
+# then weighted sums of those runs, computed here with numpy for any number of excitations
+# at once. the dual pol feedangle studies (vert90, ldiag180, ...) become 2 runs and a sum.
+#
+# usage:
+#   ports = make_lpda_port_necs('lpda_orth', [horiz, vert], usepole = True, ground = True)
+#   ... run the decks ...
+#   s = PortSolution(['out/%s.out' % f for f, tag, seg in ports], [(tag, seg) for f, tag, seg in ports])
+#   r = s.combine(excitations([[0, 0], [0, 90], [0, 180], [0, 270]]))
+#   r['impedance'] -> (4 excitations, n_freqs, 2 ports) input impedance of each port
+#   r['gain_db']   -> (4 excitations, n_freqs, n_directions) total power gain
+
+import numpy as np
+import necout
+
+# pattern points below this gain carry no usable field for calibrating the gain constant
+MIN_CALIBRATION_DB = -99.
+
+def excitations(phases, amplitudes = 1.):
+    # port voltages from phases in degrees and amplitudes, both (n_excitations, n_ports) or broadcastable
+    return np.asarray(amplitudes, dtype = float) * np.exp(1j * np.deg2rad(np.asarray(phases, dtype = float)))
+
+def port_index(currents, tag, segment):
+    # row of the current table holding segment number `segment` (counted within the tag, as on EX cards) of tag
+    rows = np.nonzero(currents['tag'] == tag)[0]
+    if segment < 1 or segment > len(rows):
+        raise ValueError('tag %d has no segment %d' % (tag, segment))
+    return rows[segment - 1]
+
+class PortSolution:
+    def __init__(self, outfiles, ports):
+        # outfiles - nec output file of each single port run, in port order
+        # ports - (tag, segment) of each port, in the same order
+        if len(outfiles) != len(ports):
+            raise ValueError('need one output file per port')
+        self.ports = list(ports)
+        runs = [necout.read_out(f) for f in outfiles]
+
+        self.freq = runs[0]['freq']
+        for f, run in zip(outfiles, runs):
+            if not np.array_equal(run['freq'], self.freq):
+                raise ValueError('%s was not run at the same frequencies' % f)
+            for name in ('inputs', 'currents', 'pattern'):
+                if isinstance(run[name], list):
+                    raise ValueError('%s has no consistent %s table at every frequency' % (f, name))
+
+        # unit voltage responses, indexed [port run, frequency, ...]
+        self.currents = np.array([run['currents']['current'] for run in runs])
+        self.e_theta = np.array([run['pattern']['e_theta'] for run in runs])
+        self.e_phi = np.array([run['pattern']['e_phi'] for run in runs])
+        pattern = runs[0]['pattern'][0]
+        self.theta = pattern['theta']
+        self.phi = pattern['phi']
+
+        # short circuit admittance matrix, current at port j with 1 V on port k: [frequency, j, k]
+        index = [port_index(runs[0]['currents'][0], tag, seg) for tag, seg in self.ports]
+        self.admittance = np.transpose(self.currents[:, :, index], (1, 2, 0))
+
+        # constant relating |E|^2 / input power to the power gain nec reports, calibrated from every run
+        power = np.array([run['inputs']['power'][:, 0] for run in runs])
+        field = np.abs(self.e_theta) ** 2 + np.abs(self.e_phi) ** 2
+        gain_db = np.array([run['pattern']['total_db'] for run in runs])
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            ratio = 10 ** (gain_db / 10.) * power[:, :, np.newaxis] / field
+        ratio[(gain_db <= MIN_CALIBRATION_DB) | ~np.isfinite(ratio)] = np.nan
+        self.gain_constant = np.nanmedian(np.moveaxis(ratio, 1, 0).reshape(len(self.freq), -1), axis = 1)
+
+    def impedance_matrix(self):
+        # open circuit impedance matrix [frequency, port, port]
+        return np.linalg.inv(self.admittance)
+
+    def combine(self, voltages):
+        # results for port voltages of shape (n_ports,) or (n_excitations, n_ports)
+        # returns a dict of arrays indexed [excitation, frequency, ...]
+        v = np.atleast_2d(np.asarray(voltages, dtype = complex))
+        if v.shape[1] != len(self.ports):
+            raise ValueError('expected %d port voltages' % len(self.ports))
+
+        port_current = np.einsum('fjk,mk->mfj', self.admittance, v)
+        currents = np.einsum('kfs,mk->mfs', self.currents, v)
+        e_theta = np.einsum('kfp,mk->mfp', self.e_theta, v)
+        e_phi = np.einsum('kfp,mk->mfp', self.e_phi, v)
+        power = 0.5 * np.real(np.sum(v[:, np.newaxis, :] * np.conj(port_current), axis = 2))
+
+        k = self.gain_constant[np.newaxis, :, np.newaxis] / power[:, :, np.newaxis]
+        with np.errstate(divide = 'ignore'):
+            vert_db = 10 * np.log10(k * np.abs(e_theta) ** 2)
+            hor_db = 10 * np.log10(k * np.abs(e_phi) ** 2)
+            gain_db = 10 * np.log10(k * (np.abs(e_theta) ** 2 + np.abs(e_phi) ** 2))
+
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            impedance = v[:, np.newaxis, :] / port_current
+
+        return {'voltage': v, 'port_current': port_current, 'impedance': impedance, 'power': power,
+                'currents': currents, 'e_theta': e_theta, 'e_phi': e_phi,
+                'vert_db': vert_db, 'hor_db': hor_db, 'gain_db': gain_db}
@@ -0,0 +1,216 @@
+# jon klein
+# jtklein@alaska.edu
+# parameter sweeps over sabre lpda models
+#
+# a sweep is a dict mapping parameter names to lists of values, it is expanded into the
+# cartesian product of all the values and one nec file is generated for each variant across
+# a process pool. file names are derived from a hash of the parameters, so the same variant
+# always lands in the same file, and a manifest (csv and json) maps each file to its parameters.
+#
+# example, every feed phase of the vertical antenna in the orthogonal dual pol pair, with and without the pole:
+#   run_sweep({'angle': [90], 'xoffset': [0], 'yoffset': [.1], 'zoffset': [.5], 'feed_zoffset': [.6],
+#              'feedangle': [0, 90, 180, 270], 'usepole': [True, False]},
+#             prefix = 'lpda_orth_dualpol', others = [HORIZ], swept_index = 1)
+#
+# stream_sweep runs a sweep without writing its decks: each variant's model is built as its solver
+# starts and its cards are streamed to it (see scheduler.job_from_cards), optionally archived to disk
+#   stream_sweep({'feedangle': [0, 90, 180, 270]}, 'out', prefix = 'lpda_horiz', solver = 'nec2c -i {deck} -o {out}')
+
+import os
+import csv
+import json
+import hashlib
+import itertools
+import multiprocessing
+import numpy as np
+import scheduler
+from nec2utils import iterDeck
+from log_antenna import lpda_antenna, make_lpda_nec, build_lpda_model, NECFILE_FOLDER, ADAPTIVE_SEGMENTATION, \
+    FREQ_STEP, LPDA_COMMENTS
+
+# arguments to the lpda_antenna constructor
+ANTENNA_ARGS = ('angle', 'xoffset', 'yoffset', 'zoffset', 'feed_zoffset', 'feedangle', 'feedline_angle')
+# per element arrays of lpda_antenna, each sweep value is a whole array
+ANTENNA_ARRAYS = ('elem_len', 'elem_space', 'dipole_radius', 'feed_coil_turns', 'feed_coil_d', 'feed_coil_l')
+# scalar lpda_antenna attributes
+ANTENNA_ATTRS = ('termcoil_l', 'termcoil_d', 'termcoil_turns', 'load')
+# arguments to make_lpda_nec, adaptive_segmentation selects log_antenna.ADAPTIVE_SEGMENTATION over the global dseg
+# ground values are True/False, ground preset names or 'epsilon,sigma' strings (see ground.ground_sweep)
+MODEL_ARGS = ('usepole', 'ground', 'adaptive_segmentation')
+
+SWEEP_PARAMS = ANTENNA_ARGS + ANTENNA_ARRAYS + ANTENNA_ATTRS + MODEL_ARGS
+
+# parameters not given in a sweep take these values (the horizontal antenna from log_antenna.main)
+DEFAULTS = {'angle': 0, 'xoffset': .1, 'yoffset': 0, 'zoffset': 0, 'feed_zoffset': .1, 'feedangle': 0,
+            'feedline_angle': 0, 'usepole': True, 'ground': True, 'adaptive_segmentation': False}
+
+HORIZ = {'angle': 0, 'xoffset': .1, 'yoffset': 0, 'zoffset': 0, 'feed_zoffset': .1}
+RDIAG = {'angle': 45, 'xoffset': .1, 'yoffset': 0, 'zoffset': 0, 'feed_zoffset': .1}
+
+MANIFEST_NAME = 'manifest'
+
+def main():
+    # every feed phase of both dual pol pairs, with and without ground and pole
+    grid = {'xoffset': [0], 'yoffset': [.1], 'zoffset': [.5], 'feed_zoffset': [.6],
+            'feedangle': [0, 90, 180, 270], 'usepole': [True, False], 'ground': [True, False]}
+    run_sweep(dict(grid, angle = [90]), prefix = 'lpda_orth_dualpol', others = [HORIZ], swept_index = 1)
+    run_sweep(dict(grid, angle = [135]), prefix = 'lpda_diag_dualpol', others = [RDIAG], swept_index = 0,
+              manifest = 'manifest_diag')
+
+def plain(value):
+    # convert numpy values to plain python types so they can go into json
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return value
+
+def expand_grid(grid):
+    # returns a list of parameter dicts, one for each point in the cartesian product of the grid
+    # parameters are expanded in sorted name order, so the variant order is deterministic
+    for name in grid:
+        if name not in SWEEP_PARAMS:
+            raise ValueError('unknown sweep parameter: %s' % name)
+
+    names = sorted(grid)
+    values = []
+    for name in names:
+        v = grid[name]
+        # a single value (or a single array for per element parameters) is a one point axis
+        if name in ANTENNA_ARRAYS:
+            if np.ndim(v[0]) == 0:
+                v = [v]
+        elif np.ndim(v) == 0:
+            v = [v]
+        values.append([plain(x) for x in v])
+
+    variants = []
+    for point in itertools.product(*values):
+        params = dict(DEFAULTS)
+        params.update(zip(names, point))
+        variants.append(params)
+    return variants
+
+def variant_hash(params, others = (), swept_index = 0):
+    # short hash of everything that goes into a variant's model
+    key = json.dumps([params, list(others), swept_index], sort_keys = True)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+
+def variant_filename(prefix, params, others = (), swept_index = 0):
+    return '%s_%s.nec' % (prefix, variant_hash(params, others, swept_index))
+
+def make_antenna(params):
+    # create an lpda_antenna from a parameter dict, overriding element arrays and attributes
+    args = dict((k, params[k]) for k in ANTENNA_ARGS if k in params)
+    ant = lpda_antenna(**args)
+    for name in ANTENNA_ARRAYS:
+        if name in params:
+            setattr(ant, name, np.array(params[name]))
+    for name in ANTENNA_ATTRS:
+        if name in params:
+            setattr(ant, name, params[name])
+    return ant
+
+def variant_antennas(params, others = (), swept_index = 0):
+    antennas = [make_antenna(dict(DEFAULTS, **o)) for o in others]
+    antennas.insert(swept_index, make_antenna(params))
+    return antennas
+
+def variant_policy(params):
+    return ADAPTIVE_SEGMENTATION if params['adaptive_segmentation'] else None
+
+def build_variant(job):
+    # generate the nec file for one variant, runs in a worker process. the geometry isn't checked here, every
+    # variant would print the same warnings, check_model(build_variant_model(...)) checks one when needed
+    filename, params, others, swept_index, folder = job
+    make_lpda_nec(filename, variant_antennas(params, others, swept_index), usepole = params['usepole'],
+                  ground = params['ground'], folder = folder, summary = False, policy = variant_policy(params),
+                  validate = False)
+    return filename
+
+def build_variant_model(params, others = (), swept_index = 0):
+    # the model of one variant, as make_lpda_nec builds it
+    return build_lpda_model(variant_antennas(params, others, swept_index), params['usepole'], params['ground'],
+                            variant_policy(params))
+
+def variant_cards(params, others = (), swept_index = 0, patterns = True):
+    # the deck of one variant as make_lpda_nec writes it, generated in blocks
+    steps = ((18 - 8) / FREQ_STEP) + 1
+    m = build_variant_model(params, others, swept_index)
+    return iterDeck(LPDA_COMMENTS, m.iterSweepText([(8, FREQ_STEP, steps)], patterns))
+
+def write_manifest(folder, name, rows):
+    # write the file -> parameters mapping as both json and csv
+    with open(os.path.join(folder, name + '.json'), 'w') as f:
+        json.dump(rows, f, indent = 1, sort_keys = True)
+
+    columns = ['filename'] + sorted(set(k for row in rows for k in row) - set(['filename']))
+    with open(os.path.join(folder, name + '.csv'), 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow([json.dumps(row[c]) if isinstance(row.get(c), list) else row.get(c, '') for c in columns])
+
+def run_sweep(grid, prefix = 'lpda_sweep', others = (), swept_index = 0, folder = NECFILE_FOLDER,
+              processes = None, manifest = MANIFEST_NAME):
+    # generate one nec file per point in the grid across a process pool
+    #   grid - dict of parameter name -> list of values, see SWEEP_PARAMS
+    #   others - parameter dicts of fixed antennas to include in every model (e.g. the other polarization)
+    #   swept_index - position of the swept antenna in the model, relative to the others
+    # returns the manifest rows, a list of parameter dicts with the generated filename
+    folder = os.path.join(folder, '')
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+
+    others = [dict((k, plain(v)) for k, v in o.items()) for o in others]
+    rows = []
+    jobs = []
+    for params in expand_grid(grid):
+        filename = variant_filename(prefix, params, others, swept_index)
+        rows.append(dict(params, filename = filename))
+        jobs.append((filename, params, others, swept_index, folder))
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes)
+    try:
+        pool.map(build_variant, jobs, chunksize = max(1, len(jobs) // (4 * processes)))
+    finally:
+        pool.close()
+        pool.join()
+
+    if manifest:
+        write_manifest(folder, manifest, rows)
+    return rows
+
+def stream_sweep(grid, outdir, prefix = 'lpda_sweep', others = (), swept_index = 0, solver = scheduler.SOLVER,
+                 ram = 4e9, cores = 4, archive = None, log = None, on_success = None, patterns = True):
+    # run the solver on every point in the grid, streaming each deck to it instead of writing the decks first
+    #   outdir - folder for the solver output, each named after the file the deck would have had (.nec.out)
+    #   archive - folder to also write the decks to (with a manifest), None to keep them off the disk
+    #   solver, ram, cores, log and on_success are passed to scheduler.run_jobs
+    # returns (manifest rows, run records)
+    for folder in [outdir, archive]:
+        if folder is not None and not os.path.isdir(folder):
+            os.makedirs(folder)
+
+    others = [dict((k, plain(v)) for k, v in o.items()) for o in others]
+    steps = ((18 - 8) / FREQ_STEP) + 1
+    rows = []
+    jobs = []
+    for params in expand_grid(grid):
+        filename = variant_filename(prefix, params, others, swept_index)
+        rows.append(dict(params, filename = filename))
+        # the model is built here for the size estimates, and again by the feeder as the solver starts,
+        # so only the models of running jobs are ever held
+        m = build_variant_model(params, others, swept_index)
+        cards = lambda params = params: variant_cards(params, others, swept_index, patterns)
+        path = os.path.join(archive, filename) if archive is not None else None
+        jobs.append(scheduler.job_from_cards(cards, filename, outdir, m.getWireCount(), m.getSegmentCount(), steps,
+                                             path))
+
+    if archive is not None:
+        write_manifest(archive, MANIFEST_NAME, rows)
+    records = scheduler.run_jobs(jobs, ram, cores, solver, log = log, on_success = on_success)
+    return rows, records
+
+if __name__ == '__main__':
+    main()